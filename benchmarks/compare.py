@@ -0,0 +1,53 @@
+import argparse
+import json
+import sys
+
+# Метрика и направление: +1 — больше хуже, -1 — меньше хуже
+METRICS = {
+    "p50_ms": 1,
+    "p99_ms": 1,
+    "updates_per_sec": -1,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение двух прогонов benchmarks.run")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="допустимое ухудшение, доля (0.1 = 10%%)"
+    )
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    if baseline["meta"]["volumes"] != candidate["meta"]["volumes"]:
+        print("⚠️ Прогоны сделаны на разных объемах данных, сравнение неточное.")
+
+    regressions = 0
+    for name, new in candidate["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            continue
+        for metric, direction in METRICS.items():
+            if not old[metric]:
+                continue
+            change = (new[metric] - old[metric]) / old[metric]
+            regressed = change * direction > args.threshold
+            regressions += regressed
+            mark = "❌" if regressed else "  "
+            print(
+                f"{mark} {name:<18} {metric:<16} {old[metric]:>10.2f} -> {new[metric]:>10.2f} "
+                f"({change:+.1%})"
+            )
+
+    if regressions:
+        print(f"Регрессий: {regressions}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+# Методы, которые Telegram ограничивает по чатам и глобально (~1 сообщ./с в чат, ~30 сообщ./с всего)
+LIMITED_METHODS = {"sendMessage", "editMessageText", "sendInvoice", "deleteMessage"}
+
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+class Bucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        # 0 — токен взят, иначе через сколько секунд он появится
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class BotApiEmulator:
+    # Локальная замена Bot API: отвечает на запросы бота, выдает обновления через
+    # getUpdates или вебхук и пересылает ответы бота виртуальным пользователям
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        error_rate: float = 0.0,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+    ):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.global_bucket = Bucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets: Dict[int, Bucket] = {}
+
+        self.calls: Counter = Counter()
+        self.flood_errors = 0
+        self.connected = asyncio.Event()
+
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._pending: List[Dict] = []
+        self._has_updates = asyncio.Event()
+        self._webhook_url: Optional[str] = None
+        self._webhook_secret: Optional[str] = None
+        self._http: Optional[aiohttp.ClientSession] = None
+        # Ответы бота по чатам и владельцы callback/pre_checkout запросов
+        self.inboxes: Dict[int, asyncio.Queue] = {}
+        self._query_owners: Dict[str, int] = {}
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        app.on_cleanup.append(self._close_http)
+        return app
+
+    async def _close_http(self, app: web.Application):
+        if self._http is not None:
+            await self._http.close()
+
+    # --- Сторона бота ---
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post()) if request.can_read_body else {}
+        self.calls[method] += 1
+
+        if method != "getUpdates" and self.latency:
+            await asyncio.sleep(self.latency)
+
+        retry_after = self._check_flood(method, params)
+        if retry_after:
+            self.flood_errors += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                },
+                status=429,
+            )
+
+        handler = getattr(self, f"_api_{method}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    def _check_flood(self, method: str, params: Dict[str, Any]) -> int:
+        if method not in LIMITED_METHODS:
+            return 0
+        if self.error_rate and random.random() < self.error_rate:
+            return 1
+        chat_id = int(params.get("chat_id", 0))
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = Bucket(self.chat_rate, self.chat_burst)
+        wait = max(bucket.take(), self.global_bucket.take())
+        return math.ceil(wait) if wait else 0
+
+    async def _api_getMe(self, params: Dict) -> Dict:
+        return BOT_USER
+
+    async def _api_deleteWebhook(self, params: Dict) -> bool:
+        self._webhook_url = None
+        return True
+
+    async def _api_setWebhook(self, params: Dict) -> bool:
+        self._webhook_url = params["url"]
+        self._webhook_secret = params.get("secret_token")
+        self.connected.set()
+        return True
+
+    async def _api_getUpdates(self, params: Dict) -> List[Dict]:
+        self.connected.set()
+        offset = int(params.get("offset", 0))
+        self._pending = [update for update in self._pending if update["update_id"] >= offset]
+        if not self._pending:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), float(params.get("timeout", 0)))
+            except asyncio.TimeoutError:
+                return []
+        return self._pending[: int(params.get("limit", 100))]
+
+    async def _api_sendMessage(self, params: Dict) -> Dict:
+        return self._deliver("sendMessage", params, self._message(params))
+
+    async def _api_editMessageText(self, params: Dict) -> Dict:
+        message = self._message(params)
+        message["message_id"] = int(params.get("message_id", 0))
+        return self._deliver("editMessageText", params, message)
+
+    async def _api_sendInvoice(self, params: Dict) -> Dict:
+        return self._deliver("sendInvoice", params, self._message(params))
+
+    async def _api_deleteMessage(self, params: Dict) -> bool:
+        return self._deliver("deleteMessage", params, True)
+
+    async def _api_answerCallbackQuery(self, params: Dict) -> bool:
+        chat_id = self._query_owners.pop(params["callback_query_id"], None)
+        return self._deliver("answerCallbackQuery", params, True, chat_id)
+
+    async def _api_answerPreCheckoutQuery(self, params: Dict) -> bool:
+        chat_id = self._query_owners.pop(params["pre_checkout_query_id"], None)
+        return self._deliver("answerPreCheckoutQuery", params, True, chat_id)
+
+    def _message(self, params: Dict) -> Dict:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if "reply_markup" in params:
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        return message
+
+    def _deliver(self, method: str, params: Dict, result: Any, chat_id: Optional[int] = None):
+        if chat_id is None and "chat_id" in params:
+            chat_id = int(params["chat_id"])
+        inbox = self.inboxes.get(chat_id)
+        if inbox is not None:
+            inbox.put_nowait((method, params, result))
+        return result
+
+    # --- Сторона пользователей ---
+    async def push_update(self, update: Dict):
+        update["update_id"] = next(self._update_ids)
+        if "callback_query" in update:
+            self._query_owners[update["callback_query"]["id"]] = update["callback_query"]["from"]["id"]
+        if "pre_checkout_query" in update:
+            self._query_owners[update["pre_checkout_query"]["id"]] = update["pre_checkout_query"]["from"]["id"]
+
+        if self._webhook_url is None:
+            self._pending.append(update)
+            self._has_updates.set()
+            return
+        if self._http is None:
+            self._http = aiohttp.ClientSession()
+        headers = {}
+        if self._webhook_secret:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self._webhook_secret
+        async with self._http.post(self._webhook_url, json=update, headers=headers) as response:
+            response.raise_for_status()
+
+
+class StepFailed(Exception):
+    pass
+
+
+class VirtualUser:
+    # Сценарий покупателя: /start -> каталог -> карточка курса -> покупка -> оплата.
+    # Следующий шаг строится из ответа бота, как это делал бы живой клиент
+    def __init__(self, emulator: BotApiEmulator, user_id: int, think_time: float, timeout: float):
+        self.emulator = emulator
+        self.user_id = user_id
+        self.think_time = think_time
+        self.timeout = timeout
+        self.inbox = emulator.inboxes[user_id] = asyncio.Queue()
+        self.latencies: List[float] = []
+        self._ids = itertools.count(1)
+
+    async def run(self):
+        await self._step(self._message(text="/start"), "sendMessage")
+        _, _, catalog = await self._step(self._message(text="🎓 Доступные курсы"), "sendMessage")
+        _, _, details = await self._step(
+            self._callback(self._first_button(catalog), catalog), "editMessageText"
+        )
+        _, invoice, _ = await self._step(
+            self._callback(self._first_button(details), details), "sendInvoice"
+        )
+
+        payload = invoice["payload"]
+        amount = sum(price["amount"] for price in json.loads(invoice["prices"]))
+        _, answer, _ = await self._step(
+            {
+                "pre_checkout_query": {
+                    "id": f"{self.user_id}_{next(self._ids)}",
+                    "from": self._user(),
+                    "currency": "RUB",
+                    "total_amount": amount,
+                    "invoice_payload": payload,
+                }
+            },
+            "answerPreCheckoutQuery",
+        )
+        if answer.get("ok") != "true":
+            raise StepFailed(f"pre_checkout отклонен: {answer.get('error_message')}")
+        await self._step(
+            self._message(
+                successful_payment={
+                    "currency": "RUB",
+                    "total_amount": amount,
+                    "invoice_payload": payload,
+                    "telegram_payment_charge_id": f"emu_{self.user_id}_{next(self._ids)}",
+                    "provider_payment_charge_id": f"emu_{self.user_id}",
+                }
+            ),
+            "sendMessage",
+        )
+
+    async def _step(self, update: Dict, expected_method: str):
+        # Троттлинг бота отбрасывает апдейты чаще раза в секунду — выдерживаем паузу
+        await asyncio.sleep(self.think_time)
+        started = time.perf_counter()
+        await self.emulator.push_update(update)
+        deadline = started + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                method, params, result = await asyncio.wait_for(self.inbox.get(), remaining)
+            except asyncio.TimeoutError:
+                raise StepFailed(f"нет ответа {expected_method}")
+            # Попутные вызовы (answerCallbackQuery и т.п.) пропускаем
+            if method == expected_method:
+                self.latencies.append(time.perf_counter() - started)
+                return method, params, result
+
+    def _user(self) -> Dict:
+        return {"id": self.user_id, "is_bot": False, "first_name": f"User {self.user_id}"}
+
+    def _message(self, **content) -> Dict:
+        return {
+            "message": {
+                "message_id": next(self._ids),
+                "date": int(time.time()),
+                "chat": {"id": self.user_id, "type": "private"},
+                "from": self._user(),
+                **content,
+            }
+        }
+
+    def _callback(self, data: str, message: Dict) -> Dict:
+        return {
+            "callback_query": {
+                "id": f"{self.user_id}_{next(self._ids)}",
+                "from": self._user(),
+                "chat_instance": str(self.user_id),
+                "data": data,
+                "message": message,
+            }
+        }
+
+    @staticmethod
+    def _first_button(message: Dict) -> str:
+        keyboard = message.get("reply_markup", {}).get("inline_keyboard")
+        if not keyboard:
+            raise StepFailed("в ответе нет инлайн-кнопок (пустой каталог?)")
+        return keyboard[0][0]["callback_data"]
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def main(args: argparse.Namespace):
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    emulator = BotApiEmulator(
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        global_rate=args.global_rate,
+        chat_rate=args.chat_rate,
+    )
+    runner = web.AppRunner(emulator.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(
+        f"Эмулятор Bot API слушает {args.host}:{args.port}. "
+        f"Запустите бота с TELEGRAM_API_URL=http://{args.host}:{args.port}"
+    )
+
+    try:
+        # Ждем первый getUpdates или setWebhook от бота
+        await emulator.connected.wait()
+        users = [
+            VirtualUser(emulator, args.first_user_id + i, args.think_time, args.timeout)
+            for i in range(args.users)
+        ]
+
+        async def run_user(user: VirtualUser, delay: float) -> Optional[str]:
+            await asyncio.sleep(delay)
+            try:
+                await user.run()
+            except StepFailed as e:
+                return str(e)
+            return None
+
+        started = time.perf_counter()
+        failures = await asyncio.gather(
+            *(run_user(user, i * args.ramp_up / args.users) for i, user in enumerate(users))
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+
+    latencies = sorted(latency for user in users for latency in user.latencies)
+    failed = Counter(failure for failure in failures if failure)
+    report = {
+        "meta": vars(args),
+        "flows_completed": args.users - sum(failed.values()),
+        "flows_failed": dict(failed),
+        "elapsed_s": round(elapsed, 3),
+        "updates": len(latencies),
+        # Время ответа: от выдачи обновления боту до нужного вызова Bot API
+        "response_p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "response_p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "api_calls": dict(emulator.calls),
+        "api_calls_per_sec": round(sum(emulator.calls.values()) / elapsed, 1),
+        "flood_errors": emulator.flood_errors,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Эмулятор Bot API с нагрузкой от виртуальных пользователей")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--first-user-id", type=int, default=10_000_000_000)
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="за сколько секунд стартуют все пользователи")
+    parser.add_argument("--think-time", type=float, default=1.1, help="пауза перед каждым шагом, с")
+    parser.add_argument("--timeout", type=float, default=30.0, help="ожидание ответа бота, с")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка ответа Bot API")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля случайных 429")
+    parser.add_argument("--global-rate", type=float, default=30.0)
+    parser.add_argument("--chat-rate", type=float, default=1.0)
+    parser.add_argument("--output", default="bench_results_e2e.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
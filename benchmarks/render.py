@@ -0,0 +1,100 @@
+import os
+
+# Микробенчмарк без БД и сети: модулям бота нужен только токен в окружении
+os.environ.setdefault("BOT_TOKEN", "42:BENCHMARK")
+
+import argparse  # noqa: E402
+import timeit  # noqa: E402
+from decimal import Decimal  # noqa: E402
+from typing import Callable, Dict, List, Tuple  # noqa: E402
+
+from handlers.admin import _format_course_details_text  # noqa: E402
+from handlers.user import COURSES_PER_PAGE, render_course_card  # noqa: E402
+from keyboards.user_kb import get_courses_list_kb  # noqa: E402
+from models.courses import CatalogSnapshot, build_catalog_page  # noqa: E402
+from services.render_cache import RenderCache  # noqa: E402
+
+
+def make_courses(count: int) -> Tuple[Dict, ...]:
+    # Экранируемые символы в названиях — как в реальном каталоге
+    return tuple(
+        {
+            "id": course_id,
+            "title": f"Курс №{course_id}: Python & <асинхронность>",
+            "short_description": "Краткое описание курса " * 3,
+            "full_description": "Полное описание курса с подробностями. " * 40,
+            "price": Decimal(990 + (course_id % 20) * 500),
+            "materials_link": f"https://example.com/materials/{course_id}",
+            "is_active": True,
+        }
+        for course_id in range(1, count + 1)
+    )
+
+
+def measure(func: Callable, number: int) -> float:
+    # Лучшее из пяти повторов, микросекунды на вызов
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def run(count: int, number: int) -> Tuple[List[Tuple[str, float, float]], int]:
+    courses = make_courses(count)
+    course = courses[0]
+    snapshot = CatalogSnapshot(
+        version=1, by_id={row["id"]: row for row in courses}, active=courses, orders={}
+    )
+    # Страница из середины каталога, отсортированного по цене
+    start = courses[len(courses) // 2]["id"]
+    cache = RenderCache()
+
+    def catalog_page():
+        page = build_catalog_page(snapshot, "p", COURSES_PER_PAGE, start)
+        return get_courses_list_kb(page)
+
+    def cached_catalog_page():
+        page = build_catalog_page(snapshot, "p", COURSES_PER_PAGE, start)
+        return cache.get(
+            ("catalog", page.sort, page.start), page.source, lambda: get_courses_list_kb(page)
+        )
+
+    payload = len(catalog_page().model_dump_json(exclude_none=True).encode())
+    cases = [
+        ("страница каталога", catalog_page, cached_catalog_page),
+        (
+            "карточка курса",
+            lambda: render_course_card(course),
+            lambda: cache.get(("course", 1), course, lambda: render_course_card(course)),
+        ),
+        (
+            "карточка в админке",
+            lambda: _format_course_details_text(course, 1, "Просмотр курса"),
+            lambda: cache.get(
+                ("admin_course", 1),
+                course,
+                lambda: _format_course_details_text(course, 1, "Просмотр курса"),
+            ),
+        ),
+    ]
+    return [(name, measure(before, number), measure(after, number)) for name, before, after in cases], payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Стоимость отрисовки каталога без кэша и с кэшем")
+    parser.add_argument(
+        "--courses",
+        type=lambda value: [int(count) for count in value.split(",")],
+        default=[10, 100, 500],
+        help="размеры каталога через запятую",
+    )
+    parser.add_argument("--number", type=int, default=200, help="вызовов в одном замере")
+    args = parser.parse_args()
+
+    print(f"{'курсов':>7}  {'что рисуем':<22} {'без кэша, мкс':>14} {'с кэшем, мкс':>13} {'ускорение':>10}")
+    for count in args.courses:
+        results, payload = run(count, args.number)
+        for name, before, after in results:
+            print(f"{count:>7}  {name:<22} {before:>14.1f} {after:>13.2f} {before / after:>9.0f}x")
+        print(f"{count:>7}  размер клавиатуры страницы: {payload} байт")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import os
+import sys
+
+# Сидирование очищает таблицы, поэтому бенчмарк работает только с явно
+# заданной BENCH_DATABASE_URL и никогда с DATABASE_URL из .env
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+if not BENCH_DATABASE_URL:
+    sys.exit("Укажите BENCH_DATABASE_URL — отдельную базу для бенчмарков.")
+os.environ["DATABASE_URL"] = BENCH_DATABASE_URL
+os.environ["DATABASE_DIRECT_URL"] = BENCH_DATABASE_URL
+os.environ.setdefault("BOT_TOKEN", "42:BENCHMARK")
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import itertools  # noqa: E402
+import json  # noqa: E402
+import logging  # noqa: E402
+import platform  # noqa: E402
+import subprocess  # noqa: E402
+import time  # noqa: E402
+from datetime import datetime  # noqa: E402
+from typing import Dict, List  # noqa: E402
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.enums import ParseMode  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+import config  # noqa: E402
+from benchmarks.scenarios import ADMIN_ID, SCENARIOS, Scenario  # noqa: E402
+from benchmarks.seed import seed  # noqa: E402
+from benchmarks.session import FakeSession  # noqa: E402
+from bot import create_dispatcher, create_storage  # noqa: E402
+from database import close_pool, create_pool, initialize_db  # noqa: E402
+from models import settings as settings_db  # noqa: E402
+from services.registration import RegistrationBuffer  # noqa: E402
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_scenario(
+    dp: Dispatcher,
+    bot: Bot,
+    scenario: Scenario,
+    first: int,
+    iterations: int,
+    concurrency: int,
+) -> Dict:
+    # Разбор JSON в Update не замеряем: в проде его делает aiohttp-обработчик вебхука
+    batches = [
+        [Update.model_validate(update, context={"bot": bot}) for update in scenario.steps(i)]
+        for i in range(first, first + iterations)
+    ]
+    latencies: List[float] = []
+    errors = 0
+    calls_before = bot.session.calls.copy()
+    next_batch = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while (index := next(next_batch)) < len(batches):
+            for update in batches[index]:
+                started = time.perf_counter()
+                try:
+                    await dp.feed_update(bot, update)
+                except Exception as e:
+                    errors += 1
+                    logging.error(f"[{scenario.name}] {type(e).__name__}: {e}")
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "updates": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "bot_calls": dict(bot.session.calls - calls_before),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return ""
+
+
+async def main(args: argparse.Namespace):
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    # Админские сценарии идут от имени сгенерированного пользователя; список меняем
+    # на месте, потому что IsAdmin и обработчики импортировали его по ссылке
+    config.ADMIN_IDS[:] = [ADMIN_ID]
+
+    await initialize_db()
+    pool = await create_pool()
+    if args.seed:
+        await seed(pool, users=args.users, payments=args.payments, courses=args.courses)
+
+    session = FakeSession(latency=args.api_latency_ms / 1000)
+    bot = Bot(
+        token=os.environ["BOT_TOKEN"],
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    # Как в bot.main: снимок настроек загружается из пула, а не из обработчика
+    await settings_db.load_settings(pool)
+    storage = create_storage(pool)
+    dp = create_dispatcher(pool, storage, throttling=False)
+    registrations = RegistrationBuffer(pool)
+    dp["registrations"] = registrations
+
+    results = {}
+    try:
+        async with pool.acquire() as conn:
+            volumes = {
+                "users": await conn.fetchval("SELECT COUNT(*) FROM users"),
+                "payments": await conn.fetchval("SELECT COUNT(*) FROM payments"),
+                "courses": await conn.fetchval("SELECT COUNT(*) FROM courses"),
+            }
+        for name in args.scenarios:
+            scenario = SCENARIOS[name]()
+            await scenario.setup(pool, args.warmup + args.iterations)
+            # Первые итерации — прогрев (кэши, подготовленные запросы), их не учитываем
+            if args.warmup:
+                await run_scenario(dp, bot, scenario, 0, args.warmup, args.concurrency)
+            results[name] = await run_scenario(
+                dp, bot, scenario, args.warmup, args.iterations, args.concurrency
+            )
+            print(
+                f"{name:<18} {results[name]['updates_per_sec']:>9.1f} upd/s  "
+                f"p50 {results[name]['p50_ms']:>8.2f} мс  p99 {results[name]['p99_ms']:>8.2f} мс  "
+                f"ошибок {results[name]['errors']}"
+            )
+    finally:
+        await registrations.close()
+        await storage.close()
+        await close_pool(pool)
+
+    report = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "volumes": volumes,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "api_latency_ms": args.api_latency_ms,
+        },
+        "scenarios": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк обработчиков бота на локальной PostgreSQL")
+    parser.add_argument(
+        "--scenarios",
+        type=lambda value: value.split(","),
+        default=list(SCENARIOS),
+        help=f"через запятую: {','.join(SCENARIOS)}",
+    )
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="задержка фейкового Bot API")
+    parser.add_argument("--seed", action="store_true", help="очистить базу и заполнить заново")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--payments", type=int, default=5_000_000)
+    parser.add_argument("--courses", type=int, default=500)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
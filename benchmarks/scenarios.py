@@ -0,0 +1,229 @@
+import itertools
+import random
+import time
+from typing import Dict, List
+
+import asyncpg
+
+from keyboards.admin_kb import (
+    AdminCoursePaginationCallback,
+    _user_cursor_callback,
+)
+from keyboards.user_kb import CourseCallbackFactory
+from models import payments as payments_db
+
+# Администратор бенчмарка — первый из сгенерированных пользователей
+ADMIN_ID = 1
+
+_update_ids = itertools.count(1)
+
+
+# --- Сборка обновлений в формате Bot API ---
+def _user(user_id: int) -> Dict:
+    return {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"user{user_id}"}
+
+
+def _chat(user_id: int) -> Dict:
+    return {"id": user_id, "type": "private"}
+
+
+def message_update(user_id: int, text: str) -> Dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": _chat(user_id),
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+
+
+def callback_update(user_id: int, data: str) -> Dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": _chat(user_id),
+                "text": "...",
+            },
+        },
+    }
+
+
+def pre_checkout_update(user_id: int, payment_id: int, amount: int) -> Dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "pre_checkout_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "currency": "RUB",
+            "total_amount": amount * 100,
+            "invoice_payload": f"payment_{payment_id}",
+        },
+    }
+
+
+def successful_payment_update(user_id: int, payment_id: int, amount: int) -> Dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": _chat(user_id),
+            "from": _user(user_id),
+            "successful_payment": {
+                "currency": "RUB",
+                "total_amount": amount * 100,
+                "invoice_payload": f"payment_{payment_id}",
+                "telegram_payment_charge_id": f"bench_{payment_id}_{update_id}",
+                "provider_payment_charge_id": f"provider_{payment_id}",
+            },
+        },
+    }
+
+
+# --- Сценарии ---
+class Scenario:
+    # Одна итерация — список обновлений, которые подаются последовательно
+    # (как их прислал бы один пользователь); итерации идут параллельно
+    name = ""
+
+    def __init__(self, seed: int = 42):
+        self.random = random.Random(seed)
+        self.users_count = 0
+        self.course_ids: List[int] = []
+
+    async def setup(self, pool: asyncpg.Pool, iterations: int):
+        async with pool.acquire() as conn:
+            self.users_count = await conn.fetchval("SELECT COUNT(*) FROM users")
+            rows = await conn.fetch("SELECT id FROM courses WHERE is_active ORDER BY id")
+        self.course_ids = [row["id"] for row in rows]
+
+    def random_user(self) -> int:
+        # Администратор в пользовательских сценариях не участвует
+        return self.random.randint(ADMIN_ID + 1, self.users_count)
+
+    def random_course(self) -> int:
+        return self.random.choice(self.course_ids)
+
+    def steps(self, iteration: int) -> List[Dict]:
+        raise NotImplementedError
+
+
+class CatalogBrowse(Scenario):
+    name = "catalog_browse"
+
+    def steps(self, iteration: int) -> List[Dict]:
+        user_id = self.random_user()
+        course_id = self.random_course()
+        return [
+            message_update(user_id, "🎓 Доступные курсы"),
+            callback_update(user_id, CourseCallbackFactory(action="view", course_id=course_id).pack()),
+            callback_update(user_id, CourseCallbackFactory(action="back_to_list", course_id=-1).pack()),
+        ]
+
+
+class CatalogPages(Scenario):
+    name = "catalog_pages"
+
+    def steps(self, iteration: int) -> List[Dict]:
+        user_id = self.random_user()
+        return [
+            callback_update(
+                user_id,
+                CourseCallbackFactory(
+                    action="page", course_id=0, sort="p", start=self.random_course()
+                ).pack(),
+            ),
+            callback_update(
+                user_id, CourseCallbackFactory(action="page", course_id=0, sort="n").pack()
+            ),
+        ]
+
+
+class Buy(Scenario):
+    name = "buy"
+
+    def steps(self, iteration: int) -> List[Dict]:
+        course_id = self.random_course()
+        return [
+            callback_update(
+                self.random_user(), CourseCallbackFactory(action="buy", course_id=course_id).pack()
+            )
+        ]
+
+
+class Checkout(Scenario):
+    name = "checkout"
+
+    async def setup(self, pool: asyncpg.Pool, iterations: int):
+        await super().setup(pool, iterations)
+        # Счета создаются заранее, в замер попадают только pre_checkout и successful_payment
+        self.payments = []
+        for _ in range(iterations):
+            user_id = self.random_user()
+            course_id = self.random_course()
+            amount = 990 + (course_id % 20) * 500
+            payment_id = await payments_db.create_pending_payment(
+                pool, user_id, course_id, amount, 3600
+            )
+            self.payments.append((user_id, payment_id, amount))
+
+    def steps(self, iteration: int) -> List[Dict]:
+        user_id, payment_id, amount = self.payments[iteration]
+        return [
+            pre_checkout_update(user_id, payment_id, amount),
+            successful_payment_update(user_id, payment_id, amount),
+        ]
+
+
+class AdminPagination(Scenario):
+    name = "admin_pagination"
+
+    async def setup(self, pool: asyncpg.Pool, iterations: int):
+        await super().setup(pool, iterations)
+        # Курсоры страниц берем из случайной выборки реальных пользователей
+        user_ids = [self.random_user() for _ in range(1000)]
+        async with pool.acquire() as conn:
+            self.user_cursors = await conn.fetch(
+                "SELECT user_id, registration_date FROM users WHERE user_id = ANY($1::bigint[])",
+                user_ids,
+            )
+
+    def steps(self, iteration: int) -> List[Dict]:
+        user = dict(self.random.choice(self.user_cursors))
+        action = self.random.choice(("next", "prev"))
+        course_cursor = AdminCoursePaginationCallback(
+            action="next", cursor=self.random_course()
+        )
+        return [
+            message_update(ADMIN_ID, "👥 Список юзеров"),
+            callback_update(ADMIN_ID, _user_cursor_callback(action, user).pack()),
+            message_update(ADMIN_ID, "📋 Список курсов"),
+            callback_update(ADMIN_ID, course_cursor.pack()),
+        ]
+
+
+class Stats(Scenario):
+    name = "stats"
+
+    def steps(self, iteration: int) -> List[Dict]:
+        return [message_update(ADMIN_ID, "📊 Статистика")]
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in (CatalogBrowse, CatalogPages, Buy, Checkout, AdminPagination, Stats)
+}
@@ -0,0 +1,95 @@
+import logging
+import time
+
+import asyncpg
+
+SEEDED_TABLES = ("users", "courses", "payments", "user_courses")
+
+# Цена курса выводится из id, чтобы платежи можно было генерировать без JOIN
+COURSE_PRICE = "990 + ({id} % 20) * 500"
+
+
+async def seed(pool: asyncpg.Pool, users: int, payments: int, courses: int):
+    started = time.monotonic()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                TRUNCATE user_courses, payments, users, courses, settings,
+                         broadcasts, fsm_storage, stats_counters, stats_daily,
+                         stats_course_revenue
+                RESTART IDENTITY CASCADE
+                """
+            )
+            # Триггеры статистики на миллионах строк только замедлят заливку:
+            # счетчики пересчитываются одним проходом в конце
+            for table in SEEDED_TABLES:
+                await conn.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+
+            await conn.execute(
+                f"""
+                INSERT INTO courses (title, short_description, full_description, price, materials_link, is_active)
+                SELECT 'Курс #' || g,
+                       'Краткое описание курса #' || g,
+                       repeat('Полное описание курса. ', 20),
+                       {COURSE_PRICE.format(id='g')},
+                       'https://example.com/courses/' || g,
+                       g % 10 <> 0
+                FROM generate_series(1, $1) g
+                """,
+                courses,
+            )
+            await conn.execute(
+                """
+                INSERT INTO users (user_id, username, full_name, registration_date)
+                SELECT g, 'user' || g, 'Bench User ' || g,
+                       CURRENT_TIMESTAMP - make_interval(secs => ($1 - g) * 10 + random())
+                FROM generate_series(1, $1) g
+                """,
+                users,
+            )
+            await conn.execute(
+                f"""
+                INSERT INTO payments (user_id, course_id, amount, status, payment_date,
+                                      expires_at, telegram_payment_charge_id)
+                SELECT user_id, course_id, {COURSE_PRICE.format(id='course_id')}, status,
+                       payment_date, payment_date + INTERVAL '10 minutes',
+                       CASE WHEN status = 'succeeded' THEN 'seed_' || g END
+                FROM (
+                    SELECT g,
+                           1 + floor(random() * $2)::bigint AS user_id,
+                           1 + floor(random() * $3)::int AS course_id,
+                           CASE WHEN g % 10 < 7 THEN 'succeeded'
+                                WHEN g % 10 < 9 THEN 'canceled'
+                                ELSE 'pending' END AS status,
+                           CURRENT_TIMESTAMP - make_interval(secs => random() * 365 * 86400) AS payment_date
+                    FROM generate_series(1, $1) g
+                ) p
+                """,
+                payments, users, courses,
+            )
+            await conn.execute(
+                """
+                INSERT INTO user_courses (user_id, course_id, purchase_date)
+                SELECT user_id, course_id, MIN(payment_date)
+                FROM payments
+                WHERE status = 'succeeded'
+                GROUP BY user_id, course_id
+                """
+            )
+            await conn.execute(
+                "INSERT INTO settings (key, value) VALUES ('welcome_message', $1)",
+                "👋 Привет, {user_name}! Это бенчмарк.",
+            )
+
+            for table in SEEDED_TABLES:
+                await conn.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+            await conn.execute("SELECT stats_recompute()")
+
+        for table in SEEDED_TABLES:
+            await conn.execute(f"ANALYZE {table}")
+
+    logging.warning(
+        f"База заполнена за {time.monotonic() - started:.0f} с: "
+        f"{users} пользователей, {payments} платежей, {courses} курсов."
+    )
@@ -1,67 +1,374 @@
 import os
+import sys
+import signal
+import hashlib
 import logging
 import asyncio
+from typing import List
+import asyncpg
 from aiogram.enums import ParseMode
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
 
-from config import BOT_TOKEN
-from database import initialize_db, create_pool, close_pool
+from config import (
+    BOT_TOKEN,
+    BOT_MODE,
+    TELEGRAM_API_URL,
+    HANDLER_CONCURRENCY,
+    REGISTRATION_FLUSH_INTERVAL,
+    REGISTRATION_BATCH_SIZE,
+    REGISTRATION_SEEN_SIZE,
+    ADMISSION_MAX_POOL_WAITERS,
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_LOOP_LAG,
+    BOT_WORKERS,
+    WORKER_BASE_PORT,
+    WORKER_INDEX,
+    WORKER_PORT,
+    WORKER_STOP_TIMEOUT,
+    INVOICE_SWEEP_INTERVAL,
+    INVOICE_SWEEP_BATCH_SIZE,
+    INVOICE_SWEEP_CONCURRENCY,
+    BROADCAST_CHUNK_SIZE,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_LEASE_SECONDS,
+    BROADCAST_MAX_CLAIMS,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS,
+    DB_TRANSACTION_PER_UPDATE,
+    FSM_STORAGE,
+    FSM_CACHE_SIZE,
+    FSM_CACHE_TTL,
+    FSM_FLUSH_DELAY,
+    FSM_STATE_TTL,
+)
+from database import initialize_db, create_pool, close_pool, listen, check_health
+from models import categories as categories_db
+from models import courses as courses_db
+from models import settings as settings_db
 from handlers.user import user_router
 from handlers.admin import admin_router
 from middlewares.throttling import ThrottlingMiddleware
+from middlewares.concurrency import ChatEventIsolation, ConcurrencyLimitMiddleware
+from middlewares.admission import AdmissionControl, AdmissionDispatcher
+from middlewares.db import DbConnectionMiddleware
+from middlewares.metrics import UpdateMetricsMiddleware, HandlerMetricsMiddleware
+from services.invoice_expiry import InvoiceExpiryScheduler
+from services.broadcast import BroadcastEngine
+from services.registration import RegistrationBuffer
+from services import outbound
+from services import metrics
+from services.query_stats import profiler
+from services.loop_monitor import loop_monitor, loop_lag_handler
+from services.supervisor import Supervisor, UpdateFeeder
+from storage.postgres import PostgresStorage
 
 APP_HOST = "0.0.0.0"
 APP_PORT = int(os.environ.get("PORT", 8080))
+POOL_KEY = web.AppKey("pool", asyncpg.Pool)
 
 
 # =======================
-# Фиктивный HTTP-сервер для Render , чтоб слушал порт
+# HTTP-сервер: health-check для Render, метрики, задержка event loop и приём вебхука
 # =======================
 async def handle(request):
     return web.Response(text="Bot is running!")
 
-async def start_dummy_server():
+
+async def healthz(request):
+    if await check_health(request.app[POOL_KEY]):
+        return web.Response(text="ok")
+    return web.Response(status=503, text="database unavailable")
+
+
+def create_app(pool: asyncpg.Pool) -> web.Application:
     app = web.Application()
-    app.add_routes([web.get("/", handle)])
+    app[POOL_KEY] = pool
+    app.add_routes(
+        [
+            web.get("/", handle),
+            web.get("/healthz", healthz),
+            web.get("/metrics", metrics.metrics_handler),
+            web.get("/debug/loop", loop_lag_handler),
+        ]
+    )
+    return app
+
+
+async def start_web_server(
+    app: web.Application, host: str = APP_HOST, port: int = APP_PORT
+) -> web.AppRunner:
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, APP_HOST, APP_PORT)
+    site = web.TCPSite(runner, host, port)
     await site.start()
-    logging.info(f"Dummy HTTP server running on {APP_HOST}:{APP_PORT}")
+    logging.info(f"HTTP server running on {host}:{port}")
+    return runner
 
-async def main():
+
+def setup_logging():
+    prefix = f"[worker {WORKER_INDEX}] " if WORKER_INDEX is not None else ""
     logging.basicConfig(
-        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+        level=logging.INFO, format=f"%(asctime)s - %(levelname)s - {prefix}%(message)s"
     )
 
-    # Запуск фиктивного HTTP-сервера чисто для Render.com
-    asyncio.create_task(start_dummy_server())
 
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    await bot.delete_webhook(drop_pending_updates=True)
+def create_session() -> AiohttpSession:
+    if TELEGRAM_API_URL:
+        logging.warning(f"Bot API: {TELEGRAM_API_URL}")
+        return AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    return AiohttpSession()
 
-    dp = Dispatcher()
 
-    pool = await create_pool()
-    await initialize_db(pool)
+def create_storage(pool) -> BaseStorage:
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    storage = PostgresStorage(
+        pool,
+        cache_size=FSM_CACHE_SIZE,
+        cache_ttl=FSM_CACHE_TTL,
+        flush_delay=FSM_FLUSH_DELAY,
+        state_ttl=FSM_STATE_TTL,
+    )
+    storage.start()
+    return storage
 
-    dp.message.middleware(ThrottlingMiddleware())
-    dp.callback_query.middleware(ThrottlingMiddleware())
+
+def create_dispatcher(
+    pool: asyncpg.Pool, storage: BaseStorage, throttling: bool = True
+) -> Dispatcher:
+    # Используется и в benchmarks/: там троттлинг отключают, чтобы не терять обновления
+    # Допуск — до FSM, очередей чатов и пула: отклоненное обновление не занимает ни то,
+    # ни другое. Очередь чата — изоляция событий aiogram: замок берется до чтения состояния FSM
+    dp = AdmissionDispatcher(
+        admission=AdmissionControl(
+            max_pool_waiters=ADMISSION_MAX_POOL_WAITERS,
+            max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+            max_loop_lag=ADMISSION_MAX_LOOP_LAG,
+        ),
+        storage=storage,
+        events_isolation=ChatEventIsolation(),
+        pool=pool,
+    )
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.update.outer_middleware(ConcurrencyLimitMiddleware(HANDLER_CONCURRENCY))
+    dp.update.outer_middleware(DbConnectionMiddleware(DB_TRANSACTION_PER_UPDATE))
+    if throttling:
+        dp.message.middleware(ThrottlingMiddleware())
+        dp.callback_query.middleware(ThrottlingMiddleware())
+    # После троттлинга: отброшенные обновления в латентность обработчиков не попадают
+    handler_metrics = HandlerMetricsMiddleware()
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
+    dp.pre_checkout_query.middleware(handler_metrics)
     dp.include_router(user_router)
     dp.include_router(admin_router)
+    return dp
+
 
+def resolve_update_types() -> List[str]:
+    # Супервизору диспетчер не нужен, но список типов обновлений берется из роутеров
+    return create_dispatcher(None, MemoryStorage()).resolve_used_update_types()
+
+
+def get_webhook_secret() -> str:
+    # Секрет должен совпадать у всех процессов, поэтому по умолчанию выводим его из токена
+    if WEBHOOK_SECRET:
+        return WEBHOOK_SECRET
+    return hashlib.sha256(BOT_TOKEN.encode()).hexdigest()
+
+
+async def run_polling(bot: Bot, dp: Dispatcher, app: web.Application):
+    runner = await start_web_server(app)
+    await bot.delete_webhook(drop_pending_updates=True)
     try:
         logging.info("Бот запускается в режиме long polling...")
-        await dp.start_polling(bot, pool=pool)
+        await dp.start_polling(bot)
+    finally:
+        await runner.cleanup()
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, app: web.Application):
+    # В отличие от start_polling, сигналы здесь никто не ловит: без обработчика
+    # SIGTERM при деплое процесс умирает, не выполнив finally в main
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+
+    secret = get_webhook_secret()
+    handler = SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret)
+    handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    runner = await start_web_server(app)
+
+    await bot.set_webhook(
+        url=f"{WEBHOOK_HOST.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=secret,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+    try:
+        logging.info(f"Бот запущен в режиме webhook ({WEBHOOK_PATH})...")
+        await stop.wait()
+        logging.info("Бот останавливается...")
+    finally:
+        await runner.cleanup()
+        # Обновления обрабатываются в фоновых задачах SimpleRequestHandler, Telegram
+        # уже получил на них 200. Дорабатываем их до того, как main закроет пул
+        tasks = handler._background_feed_update_tasks
+        if tasks:
+            logging.info(f"Дожидаемся обновлений в обработке: {len(tasks)}")
+            await asyncio.wait(set(tasks), timeout=WORKER_STOP_TIMEOUT)
+
+
+async def run_worker(bot: Bot, dp: Dispatcher, app: web.Application):
+    # Процесс под супервизором: обновления приходят от него, вебхук и getUpdates — его забота
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+
+    feeder = UpdateFeeder(dp, bot, get_webhook_secret())
+    app.router.add_post("/updates", feeder.handle)
+    runner = await start_web_server(app, "127.0.0.1", WORKER_PORT)
+    logging.info(f"Воркер запущен (pid {os.getpid()}).")
+    try:
+        await stop.wait()
+        logging.info("Воркер останавливается...")
+    finally:
+        # Новые обновления супервизор придержит до перезапуска, начатые дорабатываем
+        await runner.cleanup()
+        await feeder.drain(WORKER_STOP_TIMEOUT)
+
+
+async def run_supervisor():
+    setup_logging()
+    supervisor = Supervisor(
+        [sys.executable, os.path.abspath(__file__)],
+        workers=BOT_WORKERS,
+        base_port=WORKER_BASE_PORT,
+        secret=get_webhook_secret(),
+        stop_timeout=WORKER_STOP_TIMEOUT,
+    )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    # kill -HUP <pid супервизора> — поочередный перезапуск воркеров (например, после деплоя)
+    loop.add_signal_handler(
+        signal.SIGHUP, lambda: asyncio.create_task(supervisor.restart_all())
+    )
+
+    bot = Bot(token=BOT_TOKEN, session=create_session())
+    await supervisor.start()
+    runner = await start_web_server(supervisor.create_app(WEBHOOK_PATH))
+    polling = None
+    try:
+        if BOT_MODE == "webhook" and WEBHOOK_HOST:
+            await bot.set_webhook(
+                url=f"{WEBHOOK_HOST.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=get_webhook_secret(),
+                allowed_updates=resolve_update_types(),
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+            logging.info(f"Супервизор принимает вебхук ({WEBHOOK_PATH})...")
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            api = TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else PRODUCTION
+            polling = asyncio.create_task(supervisor.poll(bot, api, resolve_update_types()))
+            logging.info("Супервизор запущен в режиме long polling...")
+        await stop.wait()
+    finally:
+        if polling is not None:
+            polling.cancel()
+        await runner.cleanup()
+        await supervisor.stop()
+        await bot.session.close()
+
+
+async def main():
+    setup_logging()
+
+    bot = Bot(
+        token=BOT_TOKEN,
+        session=create_session(),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    bot.session.middleware(outbound.limiter)
+    loop_monitor.start()
+
+    await initialize_db()
+    pool = await create_pool()
+    metrics.register_pool(pool)
+    profiler.set_pool(pool)
+    await listen(courses_db.CATALOG_CHANNEL, courses_db.on_catalog_notify)
+    await listen(categories_db.CATEGORIES_CHANNEL, categories_db.on_categories_notify)
+    await settings_db.load_settings(pool)
+    await listen(settings_db.SETTINGS_CHANNEL, settings_db.on_settings_notify)
+
+    storage = create_storage(pool)
+    dp = create_dispatcher(pool, storage)
+    registrations = RegistrationBuffer(
+        pool,
+        flush_interval=REGISTRATION_FLUSH_INTERVAL,
+        max_batch=REGISTRATION_BATCH_SIZE,
+        seen_size=REGISTRATION_SEEN_SIZE,
+    )
+    dp["registrations"] = registrations
+
+    invoice_scheduler = InvoiceExpiryScheduler(
+        bot,
+        pool,
+        interval=INVOICE_SWEEP_INTERVAL,
+        batch_size=INVOICE_SWEEP_BATCH_SIZE,
+        concurrency=INVOICE_SWEEP_CONCURRENCY,
+    )
+    invoice_scheduler.start()
+
+    broadcaster = BroadcastEngine(
+        bot,
+        pool,
+        chunk_size=BROADCAST_CHUNK_SIZE,
+        concurrency=BROADCAST_CONCURRENCY,
+        lease_seconds=BROADCAST_LEASE_SECONDS,
+        max_claims=BROADCAST_MAX_CLAIMS,
+    )
+    broadcaster.start()
+    dp["broadcaster"] = broadcaster
+
+    app = create_app(pool)
+    try:
+        if WORKER_PORT:
+            await run_worker(bot, dp, app)
+        elif BOT_MODE == "webhook" and WEBHOOK_HOST:
+            await run_webhook(bot, dp, app)
+        else:
+            if BOT_MODE == "webhook":
+                logging.warning("WEBHOOK_HOST не задан, переключаемся на long polling.")
+            await run_polling(bot, dp, app)
     finally:
+        await outbound.lane.close(WORKER_STOP_TIMEOUT)
+        await broadcaster.stop()
+        await invoice_scheduler.stop()
+        await loop_monitor.stop()
+        await registrations.close()
+        await storage.close()
         await close_pool(pool)
         logging.warning("Пул соединений закрыт.")
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if BOT_WORKERS > 1 and not WORKER_PORT:
+            asyncio.run(run_supervisor())
+        else:
+            asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         logging.info("Бот остановлен!")
@@ -8,12 +8,103 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_IDS = [
     int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id
 ]
+# Адрес Bot API; пусто — api.telegram.org. Для нагрузочных тестов — эмулятор из benchmarks/
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 
 # --- Встроенные платежи Telegram ---
 PAYMENT_PROVIDER_TOKEN = os.getenv("PAYMENT_PROVIDER_TOKEN")
 
+# --- Счета на оплату ---
+# Через сколько секунд неоплаченный счет отменяется
+INVOICE_TTL_SECONDS = int(os.getenv("INVOICE_TTL_SECONDS", 600))
+INVOICE_SWEEP_INTERVAL = int(os.getenv("INVOICE_SWEEP_INTERVAL", 30))
+INVOICE_SWEEP_BATCH_SIZE = int(os.getenv("INVOICE_SWEEP_BATCH_SIZE", 100))
+INVOICE_SWEEP_CONCURRENCY = int(os.getenv("INVOICE_SWEEP_CONCURRENCY", 10))
+
+# --- Исходящие сообщения (лимиты Telegram) ---
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 30))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", 1))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", 3))
+OUTBOUND_CONCURRENCY = int(os.getenv("OUTBOUND_CONCURRENCY", 20))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", 3))
+# Дольше скольких секунд ответ пользователю не ждет очереди и сбрасывается
+OUTBOUND_MAX_DELAY = float(os.getenv("OUTBOUND_MAX_DELAY", 5))
+# Фоновая очередь для уведомлений администраторам
+OUTBOUND_LANE_SIZE = int(os.getenv("OUTBOUND_LANE_SIZE", 1000))
+OUTBOUND_LANE_WORKERS = int(os.getenv("OUTBOUND_LANE_WORKERS", 2))
+
+# --- Рассылки ---
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", 200))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 25))
+# Через сколько секунд без чекпоинта рассылку подхватывает другой процесс
+BROADCAST_LEASE_SECONDS = int(os.getenv("BROADCAST_LEASE_SECONDS", 120))
+# Сколько раз брошенную рассылку можно подхватить, прежде чем признать ее сбойной
+BROADCAST_MAX_CLAIMS = int(os.getenv("BROADCAST_MAX_CLAIMS", 3))
+
 # --- Настройки вебхука ---
 WEBHOOK_HOST = os.getenv("WEBHOOK_HOST")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+
+# --- Режим работы: "webhook" или "polling" ---
+BOT_MODE = os.getenv("BOT_MODE", "webhook" if WEBHOOK_HOST else "polling")
+# Сколько обновлений обрабатывается одновременно
+HANDLER_CONCURRENCY = int(os.getenv("HANDLER_CONCURRENCY", 100))
+
+# --- Регистрация пользователей ---
+# Новые пользователи копятся и пишутся пачкой раз в REGISTRATION_FLUSH_INTERVAL секунд
+REGISTRATION_FLUSH_INTERVAL = float(os.getenv("REGISTRATION_FLUSH_INTERVAL", 0.5))
+REGISTRATION_BATCH_SIZE = int(os.getenv("REGISTRATION_BATCH_SIZE", 500))
+# Сколько недавно виденных пользователей помнить, чтобы не писать их повторно
+REGISTRATION_SEEN_SIZE = int(os.getenv("REGISTRATION_SEEN_SIZE", 100000))
+
+# --- Защита от перегрузки: выше порога обновления отклоняются (0 — порог выключен) ---
+ADMISSION_MAX_POOL_WAITERS = int(os.getenv("ADMISSION_MAX_POOL_WAITERS", 50))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 500))
+# Задержка event loop в секундах
+ADMISSION_MAX_LOOP_LAG = float(os.getenv("ADMISSION_MAX_LOOP_LAG", 0.5))
+
+# --- Наблюдение за event loop ---
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", 0.1))
+# Блокировка дольше порога (в секундах) записывается вместе со стеком
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", 0.5))
+LOOP_STALL_INCIDENTS = int(os.getenv("LOOP_STALL_INCIDENTS", 20))
+
+# --- Несколько процессов ---
+# Больше 1 — супервизор принимает обновления и раздает их процессам-воркерам по id пользователя
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", 1))
+# Воркеры слушают 127.0.0.1:WORKER_BASE_PORT + номер
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", 9100))
+# Задаются супервизором при запуске воркера
+WORKER_INDEX = os.getenv("BOT_WORKER_INDEX")
+WORKER_PORT = int(os.getenv("BOT_WORKER_PORT", 0)) or None
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", 30))
 
 # --- Настройки базы данных (PostgreSQL) ---
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Прямое подключение к PostgreSQL (в обход PgBouncer) для LISTEN/NOTIFY и миграций
+DATABASE_DIRECT_URL = os.getenv("DATABASE_DIRECT_URL") or DATABASE_URL
+# DATABASE_URL указывает на PgBouncer в режиме transaction pooling
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+# Через сколько секунд простоя соединение пула закрывается
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", 300))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 30))
+DB_CONNECT_ATTEMPTS = int(os.getenv("DB_CONNECT_ATTEMPTS", 5))
+# Оборачивать ли каждое обновление в одну транзакцию
+DB_TRANSACTION_PER_UPDATE = os.getenv("DB_TRANSACTION_PER_UPDATE", "false").lower() == "true"
+# Запросы дольше порога пишутся в лог (параметры скрываются)
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+# Доля медленных SELECT, для которых снимается EXPLAIN (ANALYZE, BUFFERS); 0 — выключено
+DB_EXPLAIN_SAMPLE_RATE = float(os.getenv("DB_EXPLAIN_SAMPLE_RATE", 0))
+
+# --- Хранилище состояний FSM: "postgres" или "memory" ---
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres")
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", 10000))
+FSM_CACHE_TTL = int(os.getenv("FSM_CACHE_TTL", 600))
+# Задержка, с которой копятся изменения данных FSM перед записью в БД
+FSM_FLUSH_DELAY = float(os.getenv("FSM_FLUSH_DELAY", 0.5))
+# Через сколько секунд без изменений брошенное состояние удаляется
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", 86400))
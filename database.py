@@ -1,53 +1,361 @@
+import os
+import sys
+import time
+import asyncio
 import asyncpg
 import logging
-from config import DATABASE_URL
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Union
+from config import (
+    DATABASE_URL,
+    DATABASE_DIRECT_URL,
+    DB_PGBOUNCER,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MAX_INACTIVE_LIFETIME,
+    DB_COMMAND_TIMEOUT,
+    DB_CONNECT_ATTEMPTS,
+)
+from services import metrics
+from services.query_stats import profiler, query_source, rows_from_status
 
-async def create_pool():
+# Отдельное соединение под LISTEN/NOTIFY: в пуле соединения переиспользуются,
+# поэтому подписки держим на своём, не занимая слот пула. Идет в обход PgBouncer.
+_listener_conn: Optional[asyncpg.Connection] = None
+_listeners: Dict[str, List[Callable]] = {}
+_listener_closing = False
+
+MIGRATIONS_DIR = "migrations"
+# Ключ advisory lock, под которым применяются миграции
+MIGRATIONS_LOCK_ID = 7_310_001
+
+# Сколько обработчиков сейчас ждут соединение из пула
+_pool_waiters = 0
+
+class InstrumentedConnection(asyncpg.Connection):
+    # Запросы из models/* замеряются и попадают в services.query_stats.
+    # Подготовленные выражения переиспользует кэш asyncpg по тексту запроса: свои
+    # PreparedStatement держать нельзя — после возврата соединения в пул asyncpg
+    # их блокирует, и любой вызов падает с InterfaceError.
+
+    async def _observe(self, query: str, args, call: Awaitable, count_rows: Callable[[Any], int]):
+        source = query_source.get()
+        if source is None:
+            return await call
+        started = time.perf_counter()
+        try:
+            result = await call
+        except Exception:
+            profiler.record(source, query, args, time.perf_counter() - started, 0, error=True)
+            raise
+        profiler.record(source, query, args, time.perf_counter() - started, count_rows(result))
+        return result
+
+    async def execute(self, query: str, *args, timeout: Optional[float] = None) -> str:
+        return await self._observe(
+            query, args, super().execute(query, *args, timeout=timeout), rows_from_status
+        )
+
+    async def executemany(self, command: str, args, *, timeout: Optional[float] = None):
+        return await self._observe(
+            command, (), super().executemany(command, args, timeout=timeout), lambda _: 0
+        )
+
+    async def fetch(self, query: str, *args, timeout: Optional[float] = None, record_class=None):
+        call = super().fetch(query, *args, timeout=timeout, record_class=record_class)
+        return await self._observe(query, args, call, len)
+
+    async def fetchval(self, query: str, *args, column: int = 0, timeout: Optional[float] = None):
+        call = super().fetchval(query, *args, column=column, timeout=timeout)
+        return await self._observe(query, args, call, _count_one)
+
+    async def fetchrow(self, query: str, *args, timeout: Optional[float] = None, record_class=None):
+        call = super().fetchrow(query, *args, timeout=timeout, record_class=record_class)
+        return await self._observe(query, args, call, _count_one)
+
+
+def _count_one(result: Any) -> int:
+    return 0 if result is None else 1
+
+
+def get_pool_waiters() -> int:
+    return _pool_waiters
+
+
+metrics.DB_POOL_WAITERS.set_function(get_pool_waiters)
+
+
+async def _take_connection(pool: asyncpg.Pool) -> asyncpg.Connection:
+    global _pool_waiters
+    _pool_waiters += 1
     try:
-        pool = await asyncpg.create_pool(dsn=DATABASE_URL)
-        logging.info("Пул соединений с PostgreSQL успешно создан.")
-        return pool
-    except Exception as e:
-        logging.error(f"Не удалось создать пул соединений: {e}", exc_info=True)
-        return None
+        return await pool.acquire()
+    finally:
+        _pool_waiters -= 1
+
+
+class ConnectionScope:
+    # Одно соединение на всё обновление: берется из пула при первом запросе
+    # и возвращается после обработчика или раньше, через release(), перед
+    # вызовами Bot API. Повторные acquire() отдают его же.
+    def __init__(self, pool: asyncpg.Pool, transactional: bool = False):
+        self.pool = pool
+        self.transactional = transactional
+        self._conn = None
+        self._transaction = None
+        self._lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def acquire(self):
+        # Соединение asyncpg не допускает параллельных запросов — сериализуем
+        async with self._lock:
+            if self._conn is None:
+                self._conn = await _take_connection(self.pool)
+                if self.transactional:
+                    self._transaction = self._conn.transaction()
+                    await self._transaction.start()
+            yield self._conn
+
+    async def release(self):
+        # Запросы к базе закончились, дальше обработчик ждет Telegram — соединение
+        # нужнее другим обновлениям. Если база понадобится снова, возьмется новое.
+        # Транзакцию обновления разрывать нельзя: она держит соединение до close()
+        if self.transactional:
+            return
+        async with self._lock:
+            if self._conn is not None:
+                await self.pool.release(self._conn)
+                self._conn = None
+
+    async def close(self, commit: bool = True):
+        if self._conn is None:
+            return
+        try:
+            if self._transaction is not None:
+                if commit:
+                    await self._transaction.commit()
+                else:
+                    await self._transaction.rollback()
+        finally:
+            await self.pool.release(self._conn)
+            self._conn = None
+            self._transaction = None
+
+
+# Функции models/* принимают пул, соединение или ConnectionScope
+Executor = Union[asyncpg.Pool, asyncpg.Connection, ConnectionScope]
+
+
+def shared_executor(db: Executor) -> Executor:
+    # Для кэшей, общих на процесс: в транзакции обновления снимок увидел бы
+    # незакоммиченные строки и пережил бы ее откат (NOTIFY тогда не приходит)
+    if isinstance(db, ConnectionScope) and db.transactional:
+        return db.pool
+    return db
+
+
+def acquire(db: Executor):
+    # Запросы внутри блока помечаются вызвавшей функцией для метрик
+    frame = sys._getframe(1)
+    source = f"{frame.f_globals['__name__'].rsplit('.', 1)[-1]}.{frame.f_code.co_name}"
+    if isinstance(db, ConnectionScope):
+        return _tagged(db.acquire(), source)
+    if isinstance(db, asyncpg.Pool):
+        return _tagged(_from_pool(db), source)
+    return _tagged(_borrow(db), source)
+
 
-async def initialize_db(pool: asyncpg.Pool):
-    if not pool:
-        logging.error("Пул соединений не был создан. Инициализация БД невозможна.")
-        return
+@asynccontextmanager
+async def _tagged(connection_context, source: str):
+    async with connection_context as conn:
+        # Метка снимается до возврата соединения в пул, чтобы RESET не попал в метрики функции
+        token = query_source.set(source)
+        try:
+            yield conn
+        finally:
+            query_source.reset(token)
+
+
+@asynccontextmanager
+async def _from_pool(pool: asyncpg.Pool):
+    conn = await _take_connection(pool)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
 
-    async with pool.acquire() as conn:
+
+@asynccontextmanager
+async def _borrow(conn: asyncpg.Connection):
+    yield conn
+
+
+async def _with_retries(connect: Callable[[], Awaitable], what: str):
+    delay = 1
+    for attempt in range(1, DB_CONNECT_ATTEMPTS + 1):
         try:
-            with open("migrations/001_init.sql", "r", encoding="utf-8") as f:
-                sql_script = f.read()
+            return await connect()
+        except Exception as e:
+            if attempt == DB_CONNECT_ATTEMPTS:
+                logging.error(f"Не удалось создать {what}: {e}", exc_info=True)
+                raise
+            logging.warning(
+                f"Не удалось создать {what} (попытка {attempt}/{DB_CONNECT_ATTEMPTS}), "
+                f"повтор через {delay} с: {e}"
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+
+async def create_pool() -> asyncpg.Pool:
+    # min_size соединений открывается сразу, поэтому первые обновления после старта
+    # не ждут подключения
+    pool = await _with_retries(
+        lambda: asyncpg.create_pool(
+            dsn=DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            # 0 — без кэша именованных выражений, иначе PgBouncer их теряет (100 — умолчание asyncpg)
+            statement_cache_size=0 if DB_PGBOUNCER else 100,
+            connection_class=InstrumentedConnection,
+        ),
+        "пул соединений",
+    )
+    logging.info(
+        f"Пул соединений с PostgreSQL создан: {pool.get_size()} из {DB_POOL_MAX_SIZE}"
+        f"{', режим PgBouncer' if DB_PGBOUNCER else ''}."
+    )
+    return pool
+
+
+async def check_health(pool: asyncpg.Pool, timeout: float = 2.0) -> bool:
+    try:
+        async with pool.acquire(timeout=timeout) as conn:
+            return await conn.fetchval("SELECT 1", timeout=timeout) == 1
+    except Exception as e:
+        logging.warning(f"Проверка соединения с БД не прошла: {e}")
+        return False
+
+def _read_migration(version: str) -> str:
+    with open(os.path.join(MIGRATIONS_DIR, f"{version}.sql"), "r", encoding="utf-8") as f:
+        return f.read()
 
-            statements = [stmt.strip() for stmt in sql_script.split(";") if stmt.strip()]
-            for stmt in statements:
-                await conn.execute(stmt)
 
-            logging.info("Основные таблицы успешно созданы (или уже существовали).")
+def _list_migrations() -> List[str]:
+    return sorted(
+        filename[:-len(".sql")]
+        for filename in os.listdir(MIGRATIONS_DIR)
+        if filename.endswith(".sql")
+    )
 
-            column_exists = await conn.fetchval(
+
+async def _get_applied_migrations(conn: asyncpg.Connection) -> Set[str]:
+    exists = await conn.fetchval("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not exists:
+        return set()
+    rows = await conn.fetch("SELECT version FROM schema_migrations")
+    return {row["version"] for row in rows}
+
+
+async def initialize_db():
+    versions = _list_migrations()
+    # Advisory lock держится на сессии, поэтому миграции идут по прямому
+    # соединению в обход PgBouncer и до создания пула: так _init_connection
+    # готовит запросы уже по актуальной схеме
+    conn = await _with_retries(
+        lambda: asyncpg.connect(dsn=DATABASE_DIRECT_URL), "соединение для миграций"
+    )
+    try:
+        # Быстрый путь: схема актуальна, DDL не выполняем и блокировку не берем
+        applied = await _get_applied_migrations(conn)
+        if all(version in applied for version in versions):
+            logging.info("Схема БД актуальна, миграции не требуются.")
+            return
+
+        # Несколько воркеров могут стартовать одновременно: миграции применяет один
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_ID)
+        try:
+            await conn.execute(
                 """
-                SELECT EXISTS (
-                    SELECT 1
-                    FROM information_schema.columns
-                    WHERE table_name='payments' AND column_name='message_id'
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version TEXT PRIMARY KEY,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
                 """
             )
+            applied = await _get_applied_migrations(conn)
+            for version in versions:
+                if version in applied:
+                    continue
+                # Чтение файла — синхронный ввод-вывод, уводим его из event loop
+                sql_script = await asyncio.to_thread(_read_migration, version)
+                async with conn.transaction():
+                    await conn.execute(sql_script)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version) VALUES ($1)", version
+                    )
+                logging.info(f"Миграция {version} применена.")
+        except Exception as e:
+            logging.error(f"Ошибка при применении миграций: {e}", exc_info=True)
+            raise
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
+    finally:
+        await conn.close()
+
+    logging.info("База данных успешно инициализирована и проверена.")
 
-            if not column_exists:
-                logging.warning("Обнаружена старая структура БД. Добавляем колонку 'message_id'...")
-                await conn.execute("ALTER TABLE payments ADD COLUMN message_id BIGINT")
-                logging.info("Колонка 'message_id' успешно добавлена.")
+async def listen(channel: str, callback: Callable):
+    global _listener_conn
+    if _listener_conn is None or _listener_conn.is_closed():
+        _listener_conn = await _connect_listener()
+    _listeners.setdefault(channel, []).append(callback)
+    await _listener_conn.add_listener(channel, callback)
 
-            logging.info("База данных успешно инициализирована и проверена.")
 
+async def _connect_listener() -> asyncpg.Connection:
+    conn = await asyncpg.connect(dsn=DATABASE_DIRECT_URL)
+    conn.add_termination_listener(_on_listener_terminated)
+    return conn
+
+
+def _on_listener_terminated(conn: asyncpg.Connection):
+    if not _listener_closing:
+        logging.warning("Соединение LISTEN/NOTIFY потеряно, переподключаемся...")
+        asyncio.create_task(_reconnect_listener())
+
+
+async def _reconnect_listener():
+    global _listener_conn
+    delay = 1
+    while not _listener_closing:
+        try:
+            conn = await _connect_listener()
+            for channel, callbacks in _listeners.items():
+                for callback in callbacks:
+                    await conn.add_listener(channel, callback)
+                    # Пока соединения не было, уведомления могли потеряться
+                    callback(conn, 0, channel, "")
+            _listener_conn = conn
+            logging.info("Соединение LISTEN/NOTIFY восстановлено.")
+            return
         except Exception as e:
-            logging.error(f"Ошибка при инициализации БД: {e}", exc_info=True)
+            logging.error(f"Не удалось переподключить LISTEN/NOTIFY: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+async def close_listener():
+    global _listener_conn, _listener_closing
+    _listener_closing = True
+    if _listener_conn is not None and not _listener_conn.is_closed():
+        await _listener_conn.close()
+    _listener_conn = None
+
 
 async def close_pool(pool: asyncpg.Pool):
-    if pool:
-        await pool.close()
-        logging.info("Пул соединений с PostgreSQL успешно закрыт.")
+    await close_listener()
+    await pool.close()
+    logging.info("Пул соединений с PostgreSQL успешно закрыт.")
@@ -1,21 +1,29 @@
 import html
-import asyncpg
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from aiogram import F, Bot, Router
-from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
-from aiogram.types import CallbackQuery, Message
-from aiogram.utils.markdown import hbold, hcode, hlink
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message
+from aiogram.utils.markdown import hbold, hcode, hlink, hpre
 
+from database import ConnectionScope
 from filters.admin import IsAdmin
 from keyboards.admin_kb import *
+from models import categories as categories_db
 from models import courses as courses_db
 from models import stats as stats_db
 from models import users as users_db
 from models import settings as settings_db
-from states.admin_states import AddCourse, EditCourse, EditWelcomeMessage
+from models import broadcasts as broadcasts_db
+from services import outbound
+from services.broadcast import BroadcastEngine
+from services.query_stats import profiler
+from services.loop_monitor import loop_monitor
+from services.render_cache import render_cache
+from states.admin_states import AddCourse, EditCourse, EditWelcomeMessage, Broadcast, EditCategory
 
-admin_router = Router()
+admin_router = Router(name="admin")
 
 
 @admin_router.message(Command("admin"), IsAdmin())
@@ -74,7 +82,7 @@ async def process_materials_link(message: Message, state: FSMContext):
 
 
 @admin_router.message(AddCourse.price)
-async def process_price(message: Message, state: FSMContext, pool: asyncpg.Pool):
+async def process_price(message: Message, state: FSMContext, db: ConnectionScope):
     try:
         price = float(message.text.replace(",", "."))
     except ValueError:
@@ -83,7 +91,7 @@ async def process_price(message: Message, state: FSMContext, pool: asyncpg.Pool)
 
     course_data = await state.get_data()
     await courses_db.add_course(
-        pool,
+        db,
         title=course_data["title"],
         short_desc=course_data["short_description"],
         full_desc=course_data["full_description"],
@@ -100,21 +108,16 @@ COURSES_PER_PAGE = 5
 
 
 @admin_router.message(F.text == "📋 Список курсов", IsAdmin())
-async def list_courses(message: Message, pool: asyncpg.Pool):
-    total_courses = await courses_db.get_total_courses_count(pool)
-    courses = await courses_db.get_paginated_courses(
-        pool, limit=COURSES_PER_PAGE, offset=0
-    )
+async def list_courses(message: Message, db: ConnectionScope):
+    page = await courses_db.get_paginated_courses(db, limit=COURSES_PER_PAGE)
 
-    if not courses:
+    if not page.rows:
         await message.answer("Активных курсов в базе данных пока нет.")
         return
 
     await message.answer(
         "Управление активными курсами:",
-        reply_markup=get_admin_courses_kb(
-            courses, offset=0, total_courses=total_courses, page_size=COURSES_PER_PAGE
-        ),
+        reply_markup=get_admin_courses_kb(page),
     )
 
 
@@ -122,27 +125,21 @@ async def list_courses(message: Message, pool: asyncpg.Pool):
 async def paginate_courses_list(
     callback: CallbackQuery,
     callback_data: AdminCoursePaginationCallback,
-    pool: asyncpg.Pool,
+    db: ConnectionScope,
 ):
-    current_offset = callback_data.offset
-    if callback_data.action == "next":
-        new_offset = current_offset + COURSES_PER_PAGE
-    else:
-        new_offset = current_offset - COURSES_PER_PAGE
-
-    total_courses = await courses_db.get_total_courses_count(pool)
-    courses = await courses_db.get_paginated_courses(
-        pool, limit=COURSES_PER_PAGE, offset=new_offset
+    page = await courses_db.get_paginated_courses(
+        db,
+        limit=COURSES_PER_PAGE,
+        cursor=callback_data.cursor,
+        backward=callback_data.action == "prev",
     )
+    if not page.rows:
+        # Курсы перед курсором успели архивировать — начинаем сначала
+        page = await courses_db.get_paginated_courses(db, limit=COURSES_PER_PAGE)
 
     await callback.message.edit_text(
         "Управление активными курсами:",
-        reply_markup=get_admin_courses_kb(
-            courses,
-            offset=new_offset,
-            total_courses=total_courses,
-            page_size=COURSES_PER_PAGE,
-        ),
+        reply_markup=get_admin_courses_kb(page),
     )
     await callback.answer()
 
@@ -168,18 +165,31 @@ def _format_course_details_text(course: Dict, course_id: int, title_prefix: str)
     )
 
 
+def _format_course_category(tree: categories_db.CategoryTree, course: Dict) -> str:
+    # Путь категории берется из дерева при показе: текст курса кэшируется
+    # по строке курса и о переименовании категории не узнает
+    path = categories_db.get_path(tree, course.get("category_id"))
+    name = " / ".join(html.escape(category.name) for category in path) if path else "—"
+    return f"\n{hbold('Категория:')} {name}"
+
+
 @admin_router.callback_query(AdminCourseCallback.filter(F.action == "view"))
 async def view_course(
-    callback: CallbackQuery, callback_data: AdminCourseCallback, pool: asyncpg.Pool
+    callback: CallbackQuery, callback_data: AdminCourseCallback, db: ConnectionScope
 ):
     await callback.answer()
     course_id = callback_data.course_id
-    course = await courses_db.get_course_by_id(pool, course_id)
+    course = await courses_db.get_course_by_id(db, course_id)
     if not course:
         await callback.answer("Курс не найден!", show_alert=True)
         return
 
-    text = _format_course_details_text(course, course_id, "Просмотр курса")
+    tree = await categories_db.get_category_tree(db)
+    text = render_cache.get(
+        ("admin_course", course_id),
+        course,
+        lambda: _format_course_details_text(course, course_id, "Просмотр курса"),
+    ) + _format_course_category(tree, course)
 
     is_active = course.get("is_active", False)
     reply_markup = (
@@ -208,26 +218,21 @@ async def confirm_delete_course(
 
 @admin_router.callback_query(AdminCourseCallback.filter(F.action == "confirm_delete"))
 async def delete_course_confirmed(
-    callback: CallbackQuery, callback_data: AdminCourseCallback, pool: asyncpg.Pool
+    callback: CallbackQuery, callback_data: AdminCourseCallback, db: ConnectionScope
 ):
     course_id = callback_data.course_id
-    await courses_db.delete_course(pool, course_id)
+    await courses_db.delete_course(db, course_id)
     await callback.message.edit_text("✅ Курс был успешно архивирован.")
     await callback.answer()
 
 
 @admin_router.callback_query(AdminCourseCallback.filter(F.action == "back_to_list"))
-async def back_to_course_list_admin(callback: CallbackQuery, pool: asyncpg.Pool):
-    total_courses = await courses_db.get_total_courses_count(pool)
-    courses = await courses_db.get_paginated_courses(
-        pool, limit=COURSES_PER_PAGE, offset=0
-    )
+async def back_to_course_list_admin(callback: CallbackQuery, db: ConnectionScope):
+    page = await courses_db.get_paginated_courses(db, limit=COURSES_PER_PAGE)
 
     await callback.message.edit_text(
         "Выберите курс для управления:",
-        reply_markup=get_admin_courses_kb(
-            courses, offset=0, total_courses=total_courses, page_size=COURSES_PER_PAGE
-        ),
+        reply_markup=get_admin_courses_kb(page),
     )
     await callback.answer()
 
@@ -259,10 +264,18 @@ async def start_edit_course(
 
 @admin_router.callback_query(EditCourseCallback.filter(), EditCourse.choosing_field)
 async def choose_field_to_edit(
-    callback: CallbackQuery, callback_data: EditCourseCallback, state: FSMContext
+    callback: CallbackQuery,
+    callback_data: EditCourseCallback,
+    state: FSMContext,
+    db: ConnectionScope,
 ):
     await callback.answer()
     field = callback_data.field
+    if field == "category_id":
+        # Категория выбирается кнопками, вводить ничего не нужно
+        await state.clear()
+        await show_course_category_picker(callback, db, callback_data.course_id)
+        return
     field_names = {
         "title": "новое название",
         "short_description": "новое краткое описание",
@@ -279,7 +292,7 @@ async def choose_field_to_edit(
 
 
 @admin_router.message(EditCourse.entering_new_value)
-async def process_new_value(message: Message, state: FSMContext, pool: asyncpg.Pool):
+async def process_new_value(message: Message, state: FSMContext, db: ConnectionScope):
     new_value = message.text
     data = await state.get_data()
     course_id = data.get("course_id")
@@ -294,7 +307,7 @@ async def process_new_value(message: Message, state: FSMContext, pool: asyncpg.P
             )
             return
 
-    await courses_db.update_course_field(pool, course_id, field, new_value)
+    await courses_db.update_course_field(db, course_id, field, new_value)
     await state.clear()
 
     display_field_names = {
@@ -308,9 +321,12 @@ async def process_new_value(message: Message, state: FSMContext, pool: asyncpg.P
     text = f"✅ Поле {hbold(display_name)} для курса {hbold('ID ' + str(course_id))} было обновлено!"
     await message.answer(text, reply_markup=admin_main_kb)
 
-    course = await courses_db.get_course_by_id(pool, course_id)
+    course = await courses_db.get_course_by_id(db, course_id)
     if course:
-        text = _format_course_details_text(course, course_id, "Обновленный курс")
+        tree = await categories_db.get_category_tree(db)
+        text = _format_course_details_text(
+            course, course_id, "Обновленный курс"
+        ) + _format_course_category(tree, course)
         await message.answer(
             text,
             reply_markup=get_course_manage_kb(course_id),
@@ -318,16 +334,299 @@ async def process_new_value(message: Message, state: FSMContext, pool: asyncpg.P
         )
 
 
-@admin_router.message(F.text == "📊 Статистика", IsAdmin())
-async def show_stats(message: Message, pool: asyncpg.Pool):
-    stats = await stats_db.get_main_stats(pool)
+async def show_course_category_picker(
+    callback: CallbackQuery, db: ConnectionScope, course_id: int
+):
+    course = await courses_db.get_course_by_id(db, course_id)
+    if not course:
+        await callback.answer("Курс не найден!", show_alert=True)
+        return
+    tree = await categories_db.get_category_tree(db)
+    if not tree.by_id:
+        await callback.message.edit_text(
+            "Категорий пока нет. Создайте их в разделе «🗂 Категории».",
+            reply_markup=get_course_category_kb(course_id, [], course.get("category_id")),
+        )
+        return
+    await callback.message.edit_text(
+        f"Выберите категорию для курса {hbold(html.escape(course.get('title', '')))}:",
+        reply_markup=get_course_category_kb(
+            course_id, list(categories_db.walk(tree)), course.get("category_id")
+        ),
+    )
+
+
+@admin_router.callback_query(CourseCategoryCallback.filter(), IsAdmin())
+async def set_course_category(
+    callback: CallbackQuery, callback_data: CourseCategoryCallback, db: ConnectionScope
+):
+    course_id = callback_data.course_id
+    tree = await categories_db.get_category_tree(db)
+    category_id = callback_data.category_id or None
+    if category_id is not None and category_id not in tree.by_id:
+        await callback.answer("Категория не найдена!", show_alert=True)
+        await show_course_category_picker(callback, db, course_id)
+        return
+
+    await courses_db.update_course_field(db, course_id, "category_id", category_id)
+    await callback.answer("✅ Категория курса обновлена")
+    course = await courses_db.get_course_by_id(db, course_id)
+    if not course:
+        return
+    text = _format_course_details_text(
+        course, course_id, "Обновленный курс"
+    ) + _format_course_category(tree, course)
+    reply_markup = (
+        get_course_manage_kb(course_id)
+        if course.get("is_active", False)
+        else get_archived_course_manage_kb(course_id)
+    )
+    await callback.message.edit_text(
+        text, reply_markup=reply_markup, disable_web_page_preview=True
+    )
+
+
+# --- Категории ---
+async def format_categories_view(
+    db: ConnectionScope, category_id: int = 0
+) -> Tuple[str, InlineKeyboardMarkup]:
+    # Дерево и счетчики — из памяти, как и в пользовательском каталоге
+    tree = await categories_db.get_category_tree(db)
+    catalog = await courses_db.get_catalog(db)
+    counts = categories_db.count_courses(tree, catalog)
+    category = tree.by_id.get(category_id)
+    children = [
+        (child, counts.get(child.id, 0))
+        for child in tree.children.get(category.id if category else None, ())
+    ]
+
+    if category is None:
+        text = f"🗂 {hbold('Категории курсов')}"
+        if not children:
+            text += "\n\nКатегорий пока нет."
+    else:
+        path = " / ".join(
+            html.escape(item.name) for item in categories_db.get_path(tree, category.id)
+        )
+        text = (
+            f"📂 {hbold(path)}\n\n"
+            f"{hbold('ID:')} {hcode(category.id)}\n"
+            f"{hbold('Активных курсов:')} {counts.get(category.id, 0)}\n"
+            f"{hbold('Подкатегорий:')} {len(children)}"
+        )
+    return text, get_admin_categories_kb(children, category)
+
+
+@admin_router.message(F.text == "🗂 Категории", IsAdmin())
+async def list_categories(message: Message, db: ConnectionScope):
+    text, reply_markup = await format_categories_view(db)
+    await message.answer(text, reply_markup=reply_markup)
+
+
+@admin_router.callback_query(AdminCategoryCallback.filter(F.action == "view"), IsAdmin())
+async def view_category(
+    callback: CallbackQuery, callback_data: AdminCategoryCallback, db: ConnectionScope
+):
+    text, reply_markup = await format_categories_view(db, callback_data.category_id)
+    await callback.message.edit_text(text, reply_markup=reply_markup)
+    await callback.answer()
+
+
+@admin_router.callback_query(AdminCategoryCallback.filter(F.action == "add"), IsAdmin())
+async def start_add_category(
+    callback: CallbackQuery, callback_data: AdminCategoryCallback, state: FSMContext
+):
+    await callback.answer()
+    await state.set_state(EditCategory.entering_name)
+    await state.update_data(parent_id=callback_data.category_id or None)
+    await callback.message.delete()
+    await callback.message.answer("Введите название категории:", reply_markup=cancel_kb)
+
+
+@admin_router.message(EditCategory.entering_name, F.text)
+async def process_category_name(
+    message: Message, state: FSMContext, db: ConnectionScope
+):
+    data = await state.get_data()
+    parent_id: Optional[int] = data.get("parent_id")
+    category_id = await categories_db.add_category(db, message.text, parent_id)
+    await state.clear()
+    if category_id is None:
+        # Родитель удален, пока вводили название
+        await message.answer(
+            "Не удалось создать категорию: родительская категория не найдена.",
+            reply_markup=admin_main_kb,
+        )
+        return
+    await message.answer("✅ Категория создана!", reply_markup=admin_main_kb)
+    text, reply_markup = await format_categories_view(db, parent_id or 0)
+    await message.answer(text, reply_markup=reply_markup)
+
+
+@admin_router.callback_query(AdminCategoryCallback.filter(F.action == "rename"), IsAdmin())
+async def start_rename_category(
+    callback: CallbackQuery, callback_data: AdminCategoryCallback, state: FSMContext
+):
+    await callback.answer()
+    await state.set_state(EditCategory.entering_new_name)
+    await state.update_data(category_id=callback_data.category_id)
+    await callback.message.delete()
+    await callback.message.answer("Введите новое название категории:", reply_markup=cancel_kb)
+
+
+@admin_router.message(EditCategory.entering_new_name, F.text)
+async def process_category_new_name(
+    message: Message, state: FSMContext, db: ConnectionScope
+):
+    data = await state.get_data()
+    category_id = data.get("category_id")
+    await categories_db.rename_category(db, category_id, message.text)
+    await state.clear()
+    await message.answer("✅ Категория переименована!", reply_markup=admin_main_kb)
+    text, reply_markup = await format_categories_view(db, category_id)
+    await message.answer(text, reply_markup=reply_markup)
+
+
+@admin_router.callback_query(AdminCategoryCallback.filter(F.action == "delete"), IsAdmin())
+async def confirm_delete_category(
+    callback: CallbackQuery, callback_data: AdminCategoryCallback
+):
+    await callback.message.edit_text(
+        "Удалить категорию вместе с подкатегориями? Курсы останутся в каталоге без категории.",
+        reply_markup=get_confirm_delete_category_kb(callback_data.category_id),
+    )
+    await callback.answer()
+
+
+@admin_router.callback_query(AdminCategoryCallback.filter(F.action == "confirm_delete"), IsAdmin())
+async def delete_category_confirmed(
+    callback: CallbackQuery, callback_data: AdminCategoryCallback, db: ConnectionScope
+):
+    tree = await categories_db.get_category_tree(db)
+    category = tree.by_id.get(callback_data.category_id)
+    await categories_db.delete_category(db, callback_data.category_id)
+    await callback.answer("✅ Категория удалена.")
+    parent_id = category.parent_id if category else None
+    text, reply_markup = await format_categories_view(db, parent_id or 0)
+    await callback.message.edit_text(text, reply_markup=reply_markup)
+
+
+TOP_COURSES_IN_STATS = 3
+
+
+async def format_stats_text(db: ConnectionScope) -> str:
+    stats = await stats_db.get_main_stats(db)
+    top_courses = await stats_db.get_top_courses_by_revenue(db, TOP_COURSES_IN_STATS)
+    cache_stats = courses_db.get_catalog_cache_stats()
+    outbound_stats = outbound.limiter.get_stats()
     text = (
         f"📊 {hbold('Статистика бота')}\n\n"
         f"👥 {hbold('Всего пользователей:')} {stats['users_count']}\n"
         f"🎓 {hbold('Всего куплено курсов:')} {stats['purchases_count']}\n"
         f"💰 {hbold('Успешных платежей:')} {stats['successful_payments_count']} на сумму {stats['total_revenue']:.2f} руб.\n"
-        f"📚 {hbold('Активных курсов в базе:')} {stats['active_courses_count']}"
+        f"📅 {hbold('Сегодня:')} {stats['today_payments_count']} на сумму {stats['today_revenue']:.2f} руб.\n"
+        f"📚 {hbold('Активных курсов в базе:')} {stats['active_courses_count']}\n"
+        f"🗃 {hbold('Кэш каталога:')} попаданий {cache_stats['hits']}, промахов {cache_stats['misses']}\n"
+        f"📤 {hbold('Отправка:')} в очереди {outbound_stats['queue_depth']} "
+        f"(фоном {outbound.lane.queue.qsize()}), "
+        f"средняя задержка {outbound_stats['avg_latency_ms']:.0f} мс, 429: {outbound_stats['retries']}, "
+        f"сброшено {outbound_stats['shed'] + outbound.lane.dropped}"
     )
+    if top_courses:
+        text += f"\n\n🏆 {hbold('Топ курсов по выручке:')}\n"
+        for course in top_courses:
+            title = html.escape(course["title"])
+            text += f"• {title} — {course['payments_count']} шт., {course['revenue']:.2f} руб.\n"
+    return text
+
+
+@admin_router.message(F.text == "📊 Статистика", IsAdmin())
+async def show_stats(message: Message, db: ConnectionScope):
+    text = await format_stats_text(db)
+    await message.answer(text, reply_markup=get_stats_kb())
+
+
+@admin_router.callback_query(
+    AdminStatsCallback.filter(F.action == "recompute"), IsAdmin()
+)
+async def recompute_stats(callback: CallbackQuery, db: ConnectionScope):
+    await callback.answer("Пересчитываем статистику...")
+    await stats_db.recompute_stats(db)
+    text = await format_stats_text(db)
+    try:
+        await callback.message.edit_text(text, reply_markup=get_stats_kb())
+    except TelegramBadRequest:
+        # Цифры не изменились — Telegram отказывается редактировать сообщение
+        pass
+
+
+@admin_router.message(Command("dbstats"), IsAdmin())
+async def show_db_stats(message: Message, command: CommandObject):
+    if command.args == "reset":
+        profiler.reset()
+        await message.answer("Статистика запросов сброшена.")
+        return
+
+    report = profiler.get_report()
+    if not report:
+        await message.answer("Запросов еще не было.")
+        return
+    text = f"🗄 {hbold('Запросы к БД по функциям')} (время в мс)\n\n"
+    for row in report:
+        plan_mark = " 📝" if row["has_plan"] else ""
+        text += (
+            f"{hcode(row['function'])}{plan_mark}\n"
+            f"   вызовов {row['calls']}, всего {row['total_ms']:.0f}, "
+            f"p50 {row['p50_ms']:.1f}, p95 {row['p95_ms']:.1f}, макс {row['max_ms']:.1f}\n"
+            f"   строк в среднем {row['avg_rows']:.1f}, медленных {row['slow']}, ошибок {row['errors']}\n"
+        )
+    text += "\n📝 — есть план: /dbplan &lt;функция&gt;. Сброс: /dbstats reset"
+    await message.answer(text)
+
+
+@admin_router.message(Command("dbplan"), IsAdmin())
+async def show_db_plan(message: Message, command: CommandObject):
+    plan = profiler.get_plan(command.args or "")
+    if not plan:
+        await message.answer("Плана для этой функции пока нет.")
+        return
+    # Ограничение Telegram на длину сообщения
+    await message.answer(hpre(plan[:3900]))
+
+
+@admin_router.message(Command("loopstalls"), IsAdmin())
+async def show_loop_stalls(message: Message, command: CommandObject):
+    lag = loop_monitor.get_percentiles()
+    text = f"⏱ {hbold('Задержка event loop')}\n"
+    if lag:
+        text += (
+            f"p50 {lag['p50_ms']:.1f} мс, p90 {lag['p90_ms']:.1f} мс, "
+            f"p99 {lag['p99_ms']:.1f} мс, макс {lag['max_ms']:.1f} мс\n"
+        )
+    incidents = loop_monitor.incidents
+    if not incidents:
+        await message.answer(text + "\nБлокировок дольше порога не было.")
+        return
+
+    # /loopstalls N — стек N-й по длительности блокировки
+    if command.args and command.args.isdigit():
+        index = int(command.args) - 1
+        if not 0 <= index < len(incidents):
+            await message.answer("Такой блокировки нет.")
+            return
+        incident = incidents[index]
+        stack = "".join(incident["stack"])
+        await message.answer(
+            f"{hbold(incident['at'])}: {incident['lag'] * 1000:.0f} мс\n"
+            # Ограничение Telegram на длину сообщения — оставляем вершину стека
+            + hpre(stack[-3500:])
+        )
+        return
+
+    text += f"\n{hbold('Худшие блокировки:')}\n"
+    for number, incident in enumerate(incidents, 1):
+        text += f"{number}. {incident['at']} — {incident['lag'] * 1000:.0f} мс\n"
+    text += "\nСтек: /loopstalls &lt;номер&gt;"
     await message.answer(text)
 
 
@@ -354,46 +653,34 @@ async def format_users_list(users: List[Dict]) -> str:
 
 
 @admin_router.message(F.text == "👥 Список юзеров", IsAdmin())
-async def list_users(message: Message, pool: asyncpg.Pool):
-    total_users = await users_db.get_total_users_count(pool)
-    users = await users_db.get_paginated_users(pool, limit=USERS_PER_PAGE, offset=0)
-    text = await format_users_list(users)
-    await message.answer(
-        text,
-        reply_markup=get_users_pagination_kb(
-            offset=0, total_users=total_users, page_size=USERS_PER_PAGE
-        ),
-    )
+async def list_users(message: Message, db: ConnectionScope):
+    page = await users_db.get_paginated_users(db, limit=USERS_PER_PAGE)
+    text = await format_users_list(page.rows)
+    await message.answer(text, reply_markup=get_users_pagination_kb(page))
 
 
 @admin_router.callback_query(UserPaginationCallback.filter())
 async def paginate_users_list(
-    callback: CallbackQuery, callback_data: UserPaginationCallback, pool: asyncpg.Pool
+    callback: CallbackQuery, callback_data: UserPaginationCallback, db: ConnectionScope
 ):
-    current_offset = callback_data.offset
-    if callback_data.action == "next":
-        new_offset = current_offset + USERS_PER_PAGE
-    else:
-        new_offset = current_offset - USERS_PER_PAGE
-    total_users = await users_db.get_total_users_count(pool)
-    users = await users_db.get_paginated_users(
-        pool, limit=USERS_PER_PAGE, offset=new_offset
-    )
-    text = await format_users_list(users)
-    await callback.message.edit_text(
-        text,
-        reply_markup=get_users_pagination_kb(
-            offset=new_offset, total_users=total_users, page_size=USERS_PER_PAGE
-        ),
+    page = await users_db.get_paginated_users(
+        db,
+        limit=USERS_PER_PAGE,
+        cursor=callback_data.get_cursor(),
+        backward=callback_data.action == "prev",
     )
+    if not page.rows:
+        page = await users_db.get_paginated_users(db, limit=USERS_PER_PAGE)
+    text = await format_users_list(page.rows)
+    await callback.message.edit_text(text, reply_markup=get_users_pagination_kb(page))
     await callback.answer()
 
 
 @admin_router.message(F.text == "✏️ Изменить приветствие", IsAdmin())
 async def start_edit_welcome_message(
-    message: Message, state: FSMContext, pool: asyncpg.Pool
+    message: Message, state: FSMContext, db: ConnectionScope
 ):
-    current_welcome_message = await settings_db.get_setting(pool, "welcome_message")
+    current_welcome_message = await settings_db.get_setting(db, "welcome_message")
     if current_welcome_message:
         await message.answer(
             f"Текущее приветствие:\n\n{current_welcome_message}\n\nОтправьте новое сообщение.",
@@ -409,9 +696,9 @@ async def start_edit_welcome_message(
 
 @admin_router.message(EditWelcomeMessage.entering_message)
 async def process_new_welcome_message(
-    message: Message, state: FSMContext, pool: asyncpg.Pool
+    message: Message, state: FSMContext, db: ConnectionScope
 ):
-    await settings_db.set_setting(pool, "welcome_message", message.text)
+    await settings_db.set_setting(db, "welcome_message", message.text)
     await state.clear()
     await message.answer(
         "✅ Приветственное сообщение успешно обновлено!",
@@ -420,21 +707,16 @@ async def process_new_welcome_message(
 
 
 @admin_router.message(F.text == "🗄️ Архив курсов", IsAdmin())
-async def list_archived_courses(message: Message, pool: asyncpg.Pool):
-    total_courses = await courses_db.get_total_archived_courses_count(pool)
-    courses = await courses_db.get_paginated_archived_courses(
-        pool, limit=COURSES_PER_PAGE, offset=0
-    )
+async def list_archived_courses(message: Message, db: ConnectionScope):
+    page = await courses_db.get_paginated_archived_courses(db, limit=COURSES_PER_PAGE)
 
-    if not courses:
+    if not page.rows:
         await message.answer("В архиве пока нет курсов.")
         return
 
     await message.answer(
         "Управление архивными курсами:",
-        reply_markup=get_admin_archived_courses_kb(  # Нужна новая функция для клавиатуры
-            courses, offset=0, total_courses=total_courses, page_size=COURSES_PER_PAGE
-        ),
+        reply_markup=get_admin_archived_courses_kb(page),
     )
 
 
@@ -444,37 +726,32 @@ async def list_archived_courses(message: Message, pool: asyncpg.Pool):
 async def paginate_archived_courses_list(
     callback: CallbackQuery,
     callback_data: AdminArchivedCoursePaginationCallback,
-    pool: asyncpg.Pool,
+    db: ConnectionScope,
 ):
-    current_offset = callback_data.offset
-    if callback_data.action == "next":
-        new_offset = current_offset + COURSES_PER_PAGE
-    else:
-        new_offset = current_offset - COURSES_PER_PAGE
-
-    total_courses = await courses_db.get_total_archived_courses_count(pool)
-    courses = await courses_db.get_paginated_archived_courses(
-        pool, limit=COURSES_PER_PAGE, offset=new_offset
+    page = await courses_db.get_paginated_archived_courses(
+        db,
+        limit=COURSES_PER_PAGE,
+        cursor=callback_data.cursor,
+        backward=callback_data.action == "prev",
     )
+    if not page.rows:
+        page = await courses_db.get_paginated_archived_courses(
+            db, limit=COURSES_PER_PAGE
+        )
 
     await callback.message.edit_text(
         "Управление архивными курсами:",
-        reply_markup=get_admin_archived_courses_kb(
-            courses,
-            offset=new_offset,
-            total_courses=total_courses,
-            page_size=COURSES_PER_PAGE,
-        ),
+        reply_markup=get_admin_archived_courses_kb(page),
     )
     await callback.answer()
 
 
 @admin_router.callback_query(AdminCourseCallback.filter(F.action == "restore"))
 async def restore_course(
-    callback: CallbackQuery, callback_data: AdminCourseCallback, pool: asyncpg.Pool
+    callback: CallbackQuery, callback_data: AdminCourseCallback, db: ConnectionScope
 ):
     course_id = callback_data.course_id
-    await courses_db.update_course_field(pool, course_id, "is_active", True)
+    await courses_db.update_course_field(db, course_id, "is_active", True)
     await callback.message.edit_text(
         f"✅ Курс с ID {course_id} успешно восстановлен из архива!"
     )
@@ -484,20 +761,78 @@ async def restore_course(
 @admin_router.callback_query(
     AdminCourseCallback.filter(F.action == "back_to_archive_list")
 )
-async def back_to_archive_list_admin(callback: CallbackQuery, pool: asyncpg.Pool):
+async def back_to_archive_list_admin(callback: CallbackQuery, db: ConnectionScope):
     await callback.answer()
-    total_courses = await courses_db.get_total_archived_courses_count(pool)
-    courses = await courses_db.get_paginated_archived_courses(
-        pool, limit=COURSES_PER_PAGE, offset=0
-    )
+    page = await courses_db.get_paginated_archived_courses(db, limit=COURSES_PER_PAGE)
 
-    if not courses:
+    if not page.rows:
         await callback.message.edit_text("В архиве пока нет курсов.")
         return
 
     await callback.message.edit_text(
         "Управление архивными курсами:",
-        reply_markup=get_admin_archived_courses_kb(
-            courses, offset=0, total_courses=total_courses, page_size=COURSES_PER_PAGE
-        ),
+        reply_markup=get_admin_archived_courses_kb(page),
+    )
+
+
+@admin_router.message(F.text == "📣 Рассылка", IsAdmin())
+async def start_broadcast(message: Message, state: FSMContext):
+    await state.set_state(Broadcast.entering_text)
+    await message.answer(
+        "Отправьте текст рассылки. Его получат все пользователи бота.",
+        reply_markup=cancel_kb,
+    )
+
+
+@admin_router.message(Broadcast.entering_text, F.text)
+async def process_broadcast_text(message: Message, state: FSMContext):
+    await state.update_data(text=message.html_text)
+    await state.set_state(Broadcast.confirming)
+    await message.answer(f"{hbold('Предпросмотр рассылки:')}\n\n{message.html_text}")
+    await message.answer(
+        "Отправить это сообщение всем пользователям?",
+        reply_markup=get_broadcast_confirm_kb(),
+    )
+
+
+@admin_router.callback_query(
+    BroadcastCallback.filter(F.action == "confirm"), Broadcast.confirming
+)
+async def confirm_broadcast(
+    callback: CallbackQuery,
+    state: FSMContext,
+    db: ConnectionScope,
+    broadcaster: BroadcastEngine,
+):
+    data = await state.get_data()
+    await state.clear()
+    await callback.answer()
+    await callback.message.delete()
+
+    stats = await stats_db.get_main_stats(db)
+    broadcast_id = await broadcaster.create(
+        data["text"], callback.message.chat.id, stats["users_count"]
+    )
+    await callback.message.answer(
+        f"✅ Рассылка #{broadcast_id} запущена. Прогресс будет обновляться в отдельном сообщении.",
+        reply_markup=admin_main_kb,
     )
+
+
+@admin_router.callback_query(BroadcastCallback.filter(F.action == "cancel"))
+async def cancel_broadcast_draft(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.answer()
+    await callback.message.edit_text("Рассылка отменена.")
+    await callback.message.answer("Вы вернулись в главное меню.", reply_markup=admin_main_kb)
+
+
+@admin_router.callback_query(BroadcastCallback.filter(F.action == "stop"), IsAdmin())
+async def stop_broadcast(
+    callback: CallbackQuery, callback_data: BroadcastCallback, db: ConnectionScope
+):
+    stopped = await broadcasts_db.cancel_broadcast(db, callback_data.broadcast_id)
+    if stopped:
+        await callback.answer("Рассылка будет остановлена после текущей пачки.")
+    else:
+        await callback.answer("Рассылка уже завершена.", show_alert=True)
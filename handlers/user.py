@@ -1,44 +1,50 @@
 import logging
 import html
-import asyncio
-import asyncpg
+from typing import Optional, Tuple
 from aiogram import Router, F, Bot
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart
-from aiogram.fsm.context import FSMContext
+from aiogram.methods import SendMessage
 from aiogram.types import (
+    InlineKeyboardMarkup,
     Message,
     CallbackQuery,
     LabeledPrice,
     PreCheckoutQuery,
-    SuccessfulPayment,
 )
 from aiogram.utils.markdown import hbold, hlink
 
+from database import ConnectionScope
 from keyboards.user_kb import *
-from models import users as users_db
+from models import categories as categories_db
 from models import courses as courses_db
 from models import payments as payments_db
 from models import user_courses as user_courses_db
 from models import settings as settings_db
-from config import PAYMENT_PROVIDER_TOKEN, ADMIN_IDS
+from services import outbound
+from services.registration import RegistrationBuffer
+from services.render_cache import render_cache
+from config import PAYMENT_PROVIDER_TOKEN, ADMIN_IDS, INVOICE_TTL_SECONDS
 
-user_router = Router()
+user_router = Router(name="user")
 
 
 @user_router.message(CommandStart())
-async def handle_start(message: Message, pool: asyncpg.Pool):
+async def handle_start(
+    message: Message, db: ConnectionScope, registrations: RegistrationBuffer
+):
     user = message.from_user
 
-    await users_db.add_user(
-        pool, user_id=user.id, username=user.username, full_name=user.full_name
-    )
-
-    welcome_message = await settings_db.get_setting(pool, "welcome_message")
-    if not welcome_message:
-        welcome_message = f"👋 Привет, {user.first_name}!\n"
-
-    welcome_message = welcome_message.replace("{user_name}", user.first_name)
+    # Запись в users откладывается и идет пачкой с другими новыми пользователями
+    registrations.add(user.id, user.username, user.full_name)
 
+    # Настройки читаются из снимка в памяти, без запроса к БД
+    settings = await settings_db.get_settings(db)
+    user_name = html.escape(user.first_name)
+    if settings.welcome_message is not None:
+        welcome_message = settings.welcome_message.render(user_name)
+    else:
+        welcome_message = f"👋 Привет, {user_name}!\n"
 
     await message.answer(
         welcome_message,
@@ -46,67 +52,114 @@ async def handle_start(message: Message, pool: asyncpg.Pool):
     )
 
 
+COURSES_PER_PAGE = 8
+
+
+async def get_catalog_view(
+    db: ConnectionScope, sort: str = "", start: int = 0, category_id: Optional[int] = None
+) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    # category_id: None — список категорий, 0 — все курсы, иначе курсы категории.
+    # Дерево, счетчики и страницы берутся из снимков в памяти, без запросов к БД
+    tree = await categories_db.get_category_tree(db)
+    catalog = await courses_db.get_catalog(db)
+    counts = categories_db.count_courses(tree, catalog)
+
+    def non_empty(parent_id: Optional[int]):
+        return [
+            (category, counts[category.id])
+            for category in tree.children.get(parent_id, ())
+            if counts.get(category.id)
+        ]
+
+    if category_id is None:
+        roots = non_empty(None)
+        if roots:
+            markup = render_cache.get(
+                ("categories",), counts, lambda: get_categories_kb(roots, len(catalog.active))
+            )
+            return "Выберите категорию:", markup
+        # Категорий нет — сразу общий список
+        category_id = 0
+    elif category_id not in tree.by_id:
+        # Категорию удалили, пока сообщение висело в чате
+        category_id = 0
+
+    page = courses_db.build_catalog_page(catalog, sort, COURSES_PER_PAGE, start, category_id)
+
+    def build() -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        if category_id:
+            parent_id = tree.by_id[category_id].parent_id
+            subcategories = non_empty(category_id)
+            back = CourseCallbackFactory(
+                action="page" if parent_id else "categories", course_id=0, category=parent_id or 0
+            )
+            path = categories_db.get_path(tree, category_id)
+            text = "📂 " + " / ".join(html.escape(category.name) for category in path)
+        else:
+            subcategories = []
+            back = CourseCallbackFactory(action="categories", course_id=0) if non_empty(None) else None
+            text = "Доступные курсы:"
+
+        if not page.rows and not subcategories:
+            if back is None:
+                return "К сожалению, сейчас нет доступных курсов.", None
+            text += "\n\nЗдесь пока нет курсов."
+        return text, get_courses_list_kb(page, subcategories, back)
+
+    # Счетчики пересобираются при смене дерева или каталога — по ним и сверяем запись
+    return render_cache.get(("catalog", category_id, page.sort, page.start), counts, build)
+
+
+def render_course_card(
+    course, sort: str = "", start: int = 0, category: int = 0
+) -> Tuple[str, InlineKeyboardMarkup]:
+    title = html.escape(course.get("title", ""))
+    full_desc = html.escape(course.get("full_description", ""))
+    price = course.get("price", 0)
+    text = (
+        f"🎓 {hbold(title)}\n\n"
+        f"{full_desc}\n\n"
+        f"💰 {hbold('Цена:')} {price} руб."
+    )
+    return text, get_course_details_kb(course["id"], sort, start, category)
+
+
 @user_router.message(F.text == "🎓 Доступные курсы")
-async def handle_catalog(message: Message, pool: asyncpg.Pool):
-    courses = await courses_db.get_all_courses(pool)
-    if not courses:
-        await message.answer("К сожалению, сейчас нет доступных курсов.")
-        return
-    await message.answer("Доступные курсы:", reply_markup=get_courses_list_kb(courses))
+async def handle_catalog(message: Message, db: ConnectionScope):
+    text, reply_markup = await get_catalog_view(db)
+    await message.answer(text, reply_markup=reply_markup)
 
 
 @user_router.callback_query(CourseCallbackFactory.filter(F.action == "view"))
 async def show_course_details(
-    callback: CallbackQuery, callback_data: CourseCallbackFactory, pool: asyncpg.Pool
+    callback: CallbackQuery, callback_data: CourseCallbackFactory, db: ConnectionScope
 ):
     course_id = callback_data.course_id
-    course = await courses_db.get_course_by_id(pool, course_id)
+    course = await courses_db.get_course_by_id(db, course_id)
     if course:
-        title = html.escape(course.get("title", ""))
-        full_desc = html.escape(course.get("full_description", ""))
-        price = course.get("price", 0)
-        text = (
-            f"🎓 {hbold(title)}\n\n"
-            f"{full_desc}\n\n"
-            f"💰 {hbold('Цена:')} {price} руб."
-        )
-        await callback.message.edit_text(
-            text, reply_markup=get_course_details_kb(course_id)
+        sort, start, category = callback_data.sort, callback_data.start, callback_data.category
+        text, reply_markup = render_cache.get(
+            ("course", course_id, sort, start, category),
+            course,
+            lambda: render_course_card(course, sort, start, category),
         )
+        await callback.message.edit_text(text, reply_markup=reply_markup)
     else:
         await callback.answer("Курс не найден!", show_alert=True)
     await callback.answer()
 
 
-async def expire_invoice_message(
-    bot: Bot, pool: asyncpg.Pool, chat_id: int, message_id: int, payment_id: int
-):
-    await asyncio.sleep(600)
-    payment_info = await payments_db.get_payment_info(pool, payment_id)
-    if payment_info and payment_info["status"] == "pending":
-        try:
-            await payments_db.update_payment_status(pool, payment_id, "canceled")
-            await bot.delete_message(chat_id=chat_id, message_id=message_id)
-            await bot.send_message(
-                chat_id=chat_id,
-                text=f"❌ {hbold('Время для оплаты истекло!')}\n\nДля покупки курса, пожалуйста, создайте новый счет.",
-            )
-        except Exception as e:
-            logging.error(
-                f"Не удалось обработать истекший счет (payment_id: {payment_id}): {e}"
-            )
-
-
 @user_router.callback_query(CourseCallbackFactory.filter(F.action == "buy"))
 async def buy_course_handler(
     callback: CallbackQuery,
     callback_data: CourseCallbackFactory,
     bot: Bot,
-    pool: asyncpg.Pool,
+    db: ConnectionScope,
+    registrations: RegistrationBuffer,
 ):
     await callback.answer()
     course_id = callback_data.course_id
-    course = await courses_db.get_course_by_id(pool, course_id)
+    course = await courses_db.get_course_by_id(db, course_id)
     if not course:
         await callback.message.answer("Курс не найден!")
         return
@@ -116,13 +169,16 @@ async def buy_course_handler(
     price = course.get("price", 0)
     user_id = callback.from_user.id
 
+    # payments ссылается на users: пользователь мог нажать /start только что
+    await registrations.ensure_registered(user_id)
     payment_id = await payments_db.create_pending_payment(
-        pool, user_id, course_id, price
+        db, user_id, course_id, price, INVOICE_TTL_SECONDS
     )
     if not payment_id:
         await callback.message.answer("Произошла ошибка при создании счета.")
         return
 
+    await db.release()
     try:
         invoice_message = await bot.send_invoice(
             chat_id=user_id,
@@ -135,23 +191,19 @@ async def buy_course_handler(
                 LabeledPrice(label=f"Покупка курса: {title}", amount=int(price * 100))
             ],
         )
-        asyncio.create_task(
-            expire_invoice_message(
-                bot,
-                pool,
-                invoice_message.chat.id,
-                invoice_message.message_id,
-                payment_id,
-            )
+        # Просроченный счет удалит InvoiceExpiryScheduler
+        await payments_db.update_payment_message_id(
+            db, payment_id, invoice_message.message_id
         )
     except Exception as e:
+        await payments_db.update_payment_status(db, payment_id, "canceled")
         await callback.message.answer("Произошла ошибка при отправке счета.")
         logging.error(f"Ошибка при отправке инвойса: {e}")
 
 
 @user_router.pre_checkout_query()
 async def process_pre_checkout(
-    pre_checkout_query: PreCheckoutQuery, bot: Bot, pool: asyncpg.Pool
+    pre_checkout_query: PreCheckoutQuery, bot: Bot, db: ConnectionScope
 ):
     payload = pre_checkout_query.invoice_payload
     try:
@@ -162,63 +214,78 @@ async def process_pre_checkout(
         )
         return
 
-    payment_info = await payments_db.get_payment_info(pool, payment_id)
-    if not payment_info or payment_info["status"] != "pending":
+    payment_info = await payments_db.get_payment_info(db, payment_id)
+    if (
+        not payment_info
+        or payment_info["status"] != "pending"
+        or payment_info["is_expired"]
+    ):
         await bot.answer_pre_checkout_query(
             pre_checkout_query.id,
             ok=False,
             error_message="Срок действия счета истек. Пожалуйста, создайте новый счет.",
         )
         return
+    await db.release()
     await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
 
 
 @user_router.message(F.successful_payment)
-async def process_successful_payment(message: Message, pool: asyncpg.Pool, bot: Bot):
-    payment_id = int(message.successful_payment.invoice_payload.split("_")[1])
-    payment_info = await payments_db.get_payment_info(pool, payment_id)
-    if not payment_info:
+async def process_successful_payment(message: Message, db: ConnectionScope, bot: Bot):
+    successful_payment = message.successful_payment
+    payment_id = int(successful_payment.invoice_payload.split("_")[1])
+    payment = await payments_db.complete_payment(
+        db, payment_id, successful_payment.telegram_payment_charge_id
+    )
+    if not payment:
         logging.error(
             f"Не найдена информация о платеже {payment_id} после успешной оплаты."
         )
         return
 
-    user_id = payment_info["user_id"]
-    course_id = payment_info["course_id"]
-    await payments_db.update_payment_status(pool, payment_id, "succeeded")
-    await user_courses_db.add_user_course(pool, user_id, course_id)
+    user_id = payment["user_id"]
+    await db.release()
     await message.answer("✅ Оплата прошла успешно! Вам открыт доступ к курсу.")
+    if not payment["is_new"]:
+        logging.info(f"Повторное уведомление об оплате {payment_id}, доступ уже выдан.")
+        return
     logging.info(f"Платеж {payment_id} успешно завершен для пользователя {user_id}.")
 
     try:
-        course = await courses_db.get_course_by_id(pool, course_id)
-        user = await users_db.get_user(pool, user_id)
-
-        if course and user:
-            user_full_name = html.escape(user.get("full_name", "N/A"))
-            user_username = user.get("username", "N/A")
-            course_title = html.escape(course.get("title", "N/A"))
-            amount = message.successful_payment.total_amount / 100
-
-            text = (
-                f"🎉 {hbold('Новая покупка!')}\n\n"
-                f"👤 {hbold('Пользователь:')} {user_full_name} (@{user_username})\n"
-                f"🎓 {hbold('Курс:')} «{course_title}»\n"
-                f"💰 {hbold('Сумма:')} {amount:.2f} руб."
-            )
+        user_full_name = html.escape(payment["full_name"] or "N/A")
+        user_username = payment["username"] or "N/A"
+        course_title = html.escape(payment["course_title"] or "N/A")
+        amount = successful_payment.total_amount / 100
+
+        text = (
+            f"🎉 {hbold('Новая покупка!')}\n\n"
+            f"👤 {hbold('Пользователь:')} {user_full_name} (@{user_username})\n"
+            f"🎓 {hbold('Курс:')} «{course_title}»\n"
+            f"💰 {hbold('Сумма:')} {amount:.2f} руб."
+        )
 
-            for admin_id in ADMIN_IDS:
-                await bot.send_message(admin_id, text)
+        # Уведомления админам уходят фоном и пропускают вперед ответы пользователям
+        for admin_id in ADMIN_IDS:
+            outbound.lane.submit(bot, SendMessage(chat_id=admin_id, text=text))
     except Exception as e:
         logging.error(f"Ошибка при отправке уведомления администраторам: {e}")
 
 
-@user_router.callback_query(CourseCallbackFactory.filter(F.action == "back_to_list"))
-async def back_to_courses_list(callback: CallbackQuery, pool: asyncpg.Pool):
-    courses = await courses_db.get_all_courses(pool)
-    await callback.message.edit_text(
-        "Доступные курсы:", reply_markup=get_courses_list_kb(courses)
+@user_router.callback_query(
+    CourseCallbackFactory.filter(F.action.in_({"back_to_list", "page", "categories"}))
+)
+async def show_catalog_page(
+    callback: CallbackQuery, callback_data: CourseCallbackFactory, db: ConnectionScope
+):
+    category_id = None if callback_data.action == "categories" else callback_data.category
+    text, reply_markup = await get_catalog_view(
+        db, callback_data.sort, callback_data.start, category_id
     )
+    try:
+        await callback.message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest:
+        # Нажата кнопка текущей страницы — Telegram отказывается редактировать сообщение
+        pass
     await callback.answer()
 
 
@@ -233,9 +300,9 @@ async def handle_contact(message: Message):
 
 
 @user_router.message(F.text == "📚 Мои курсы")
-async def handle_my_courses(message: Message, pool: asyncpg.Pool):
+async def handle_my_courses(message: Message, db: ConnectionScope):
     user_id = message.from_user.id
-    my_courses = await user_courses_db.get_user_courses_with_details(pool, user_id)
+    my_courses = await user_courses_db.get_user_courses_with_details(db, user_id)
     if not my_courses:
         await message.answer("У вас пока нет купленных курсов.")
         return
@@ -248,9 +315,9 @@ async def handle_my_courses(message: Message, pool: asyncpg.Pool):
 
 
 @user_router.message(F.text == "🧾 История покупок")
-async def handle_purchase_history(message: Message, pool: asyncpg.Pool):
+async def handle_purchase_history(message: Message, db: ConnectionScope):
     user_id = message.from_user.id
-    history = await payments_db.get_user_payment_history(pool, user_id)
+    history = await payments_db.get_user_payment_history(db, user_id)
     if not history:
         await message.answer("Ваша история покупок пуста.")
         return
@@ -1,3 +1,5 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Sequence, Tuple
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
@@ -7,6 +9,9 @@ from aiogram.types import (
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.filters.callback_data import CallbackData
 
+from models.categories import Category
+from models.pagination import Page
+
 admin_main_kb = ReplyKeyboardMarkup(
     keyboard=[
         [
@@ -14,8 +19,15 @@ admin_main_kb = ReplyKeyboardMarkup(
             KeyboardButton(text="📋 Список курсов"),
             KeyboardButton(text="🗄️ Архив курсов"),
         ],
-        [KeyboardButton(text="👥 Список юзеров"), KeyboardButton(text="📊 Статистика")],
-        [KeyboardButton(text="✏️ Изменить приветствие")],
+        [
+            KeyboardButton(text="👥 Список юзеров"),
+            KeyboardButton(text="📊 Статистика"),
+            KeyboardButton(text="🗂 Категории"),
+        ],
+        [
+            KeyboardButton(text="✏️ Изменить приветствие"),
+            KeyboardButton(text="📣 Рассылка"),
+        ],
     ],
     resize_keyboard=True,
 )
@@ -31,37 +43,36 @@ class AdminCourseCallback(CallbackData, prefix="admin_course"):
     course_id: int
 
 
+# cursor — id первого курса страницы для "prev" и последнего для "next"
 class AdminCoursePaginationCallback(CallbackData, prefix="admin_course_page"):
     action: str
-    offset: int
+    cursor: int
 
 
-def get_admin_courses_kb(
-    courses: list, offset: int, total_courses: int, page_size: int
-):
+def get_admin_courses_kb(page: Page):
     builder = InlineKeyboardBuilder()
-    for course in courses:
+    for course in page.rows:
         builder.button(
             text=f"ID: {course['id']} | {course['title']}",
             callback_data=AdminCourseCallback(action="view", course_id=course["id"]),
         )
 
     pagination_buttons = []
-    if offset > 0:
+    if page.has_prev:
         pagination_buttons.append(
             InlineKeyboardButton(
                 text="⬅️ Назад",
                 callback_data=AdminCoursePaginationCallback(
-                    action="prev", offset=offset
+                    action="prev", cursor=page.rows[0]["id"]
                 ).pack(),
             )
         )
-    if offset + page_size < total_courses:
+    if page.has_next:
         pagination_buttons.append(
             InlineKeyboardButton(
                 text="Вперёд ➡️",
                 callback_data=AdminCoursePaginationCallback(
-                    action="next", offset=offset
+                    action="next", cursor=page.rows[-1]["id"]
                 ).pack(),
             )
         )
@@ -111,35 +122,33 @@ def get_confirm_delete_kb(course_id: int):
 
 class AdminArchivedCoursePaginationCallback(CallbackData, prefix="admin_archive_page"):
     action: str
-    offset: int
+    cursor: int
 
 
-def get_admin_archived_courses_kb(
-    courses: list, offset: int, total_courses: int, page_size: int
-):
+def get_admin_archived_courses_kb(page: Page):
     builder = InlineKeyboardBuilder()
-    for course in courses:
+    for course in page.rows:
         builder.button(
             text=f"ID: {course['id']} | {course['title']}",
             callback_data=AdminCourseCallback(action="view", course_id=course["id"]),
         )
 
     pagination_buttons = []
-    if offset > 0:
+    if page.has_prev:
         pagination_buttons.append(
             InlineKeyboardButton(
                 text="⬅️ Назад",
                 callback_data=AdminArchivedCoursePaginationCallback(
-                    action="prev", offset=offset
+                    action="prev", cursor=page.rows[0]["id"]
                 ).pack(),
             )
         )
-    if offset + page_size < total_courses:
+    if page.has_next:
         pagination_buttons.append(
             InlineKeyboardButton(
                 text="Вперёд ➡️",
                 callback_data=AdminArchivedCoursePaginationCallback(
-                    action="next", offset=offset
+                    action="next", cursor=page.rows[-1]["id"]
                 ).pack(),
             )
         )
@@ -180,6 +189,7 @@ def get_edit_field_kb(course_id: int):
         "full_description": "Полное описание",
         "materials_link": "Ссылка на материалы",
         "price": "Цена",
+        "category_id": "Категория",
     }
     for field, name in fields.items():
         builder.button(
@@ -190,29 +200,171 @@ def get_edit_field_kb(course_id: int):
         text="⬅️ Назад",
         callback_data=AdminCourseCallback(action="view", course_id=course_id),
     )
-    builder.adjust(2, 2, 1)
+    builder.adjust(2, 2, 2, 1)
     return builder.as_markup()
 
 
-class UserPaginationCallback(CallbackData, prefix="users_page"):
+# category_id = 0 — корень дерева
+class AdminCategoryCallback(CallbackData, prefix="admin_category"):
     action: str
-    offset: int
+    category_id: int
 
 
-def get_users_pagination_kb(
-    offset: int, total_users: int, page_size: int
+def get_admin_categories_kb(
+    children: Sequence[Tuple[Category, int]], category: Optional[Category] = None
 ) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
+    for child, count in children:
+        builder.button(
+            text=f"📂 {child.name} ({count})",
+            callback_data=AdminCategoryCallback(action="view", category_id=child.id),
+        )
 
-    if offset > 0:
+    category_id = category.id if category else 0
+    builder.button(
+        text="➕ Подкатегория" if category else "➕ Добавить категорию",
+        callback_data=AdminCategoryCallback(action="add", category_id=category_id),
+    )
+    if category is None:
+        builder.button(
+            text="⬅️ Назад в меню",
+            callback_data=AdminCourseCallback(action="back_to_main_menu", course_id=0),
+        )
+        builder.adjust(1)
+        return builder.as_markup()
+
+    builder.button(
+        text="✏️ Переименовать",
+        callback_data=AdminCategoryCallback(action="rename", category_id=category_id),
+    )
+    builder.button(
+        text="🗑 Удалить",
+        callback_data=AdminCategoryCallback(action="delete", category_id=category_id),
+    )
+    builder.button(
+        text="⬅️ Назад",
+        callback_data=AdminCategoryCallback(action="view", category_id=category.parent_id or 0),
+    )
+    builder.adjust(*([1] * len(children)), 1, 2, 1)
+    return builder.as_markup()
+
+
+def get_confirm_delete_category_kb(category_id: int) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(
+        text="✅ Да, удалить",
+        callback_data=AdminCategoryCallback(action="confirm_delete", category_id=category_id),
+    )
+    builder.button(
+        text="❌ Нет, отмена",
+        callback_data=AdminCategoryCallback(action="view", category_id=category_id),
+    )
+    builder.adjust(2)
+    return builder.as_markup()
+
+
+# category_id = 0 — убрать курс из категорий
+class CourseCategoryCallback(CallbackData, prefix="course_category"):
+    course_id: int
+    category_id: int
+
+
+def get_course_category_kb(
+    course_id: int, categories: Sequence[Tuple[int, Category]], current: Optional[int]
+) -> InlineKeyboardMarkup:
+    # categories — обход дерева в глубину: (глубина, категория)
+    builder = InlineKeyboardBuilder()
+    for depth, category in categories:
+        mark = "✅ " if category.id == current else ""
+        builder.button(
+            text=f"{'· ' * depth}{mark}{category.name}",
+            callback_data=CourseCategoryCallback(course_id=course_id, category_id=category.id),
+        )
+    builder.button(
+        text="✅ Без категории" if current is None else "Без категории",
+        callback_data=CourseCategoryCallback(course_id=course_id, category_id=0),
+    )
+    builder.button(
+        text="⬅️ Назад",
+        callback_data=AdminCourseCallback(action="view", course_id=course_id),
+    )
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+# Курсор пользователя: (registration_date в микросекундах от эпохи, user_id)
+class UserPaginationCallback(CallbackData, prefix="users_page"):
+    action: str
+    registered_at: int
+    user_id: int
+
+    def get_cursor(self) -> Tuple[datetime, int]:
+        return _EPOCH + timedelta(microseconds=self.registered_at), self.user_id
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _user_cursor_callback(action: str, user: Dict) -> UserPaginationCallback:
+    registered_at = (user["registration_date"] - _EPOCH) // timedelta(microseconds=1)
+    return UserPaginationCallback(
+        action=action, registered_at=registered_at, user_id=user["user_id"]
+    )
+
+
+def get_users_pagination_kb(page: Page) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+
+    if page.has_prev:
         builder.button(
             text="⬅️ Назад",
-            callback_data=UserPaginationCallback(action="prev", offset=offset),
+            callback_data=_user_cursor_callback("prev", page.rows[0]),
         )
-    if offset + page_size < total_users:
+    if page.has_next:
         builder.button(
             text="Вперёд ➡️",
-            callback_data=UserPaginationCallback(action="next", offset=offset),
+            callback_data=_user_cursor_callback("next", page.rows[-1]),
         )
 
     return builder.as_markup()
+
+
+class AdminStatsCallback(CallbackData, prefix="admin_stats"):
+    action: str
+
+
+def get_stats_kb() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(
+        text="🔄 Пересчитать точно",
+        callback_data=AdminStatsCallback(action="recompute"),
+    )
+    return builder.as_markup()
+
+
+class BroadcastCallback(CallbackData, prefix="broadcast"):
+    action: str
+    broadcast_id: int
+
+
+def get_broadcast_confirm_kb() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(
+        text="✅ Отправить всем",
+        callback_data=BroadcastCallback(action="confirm", broadcast_id=0),
+    )
+    builder.button(
+        text="❌ Отмена",
+        callback_data=BroadcastCallback(action="cancel", broadcast_id=0),
+    )
+    builder.adjust(2)
+    return builder.as_markup()
+
+
+def get_broadcast_status_kb(broadcast_id: int) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(
+        text="🛑 Остановить рассылку",
+        callback_data=BroadcastCallback(action="stop", broadcast_id=broadcast_id),
+    )
+    return builder.as_markup()
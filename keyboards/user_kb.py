@@ -1,10 +1,16 @@
+from typing import Optional, Sequence, Tuple
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.filters.callback_data import CallbackData
 
+from models.categories import Category
+from models.courses import CatalogPage
+
 
 main_menu_kb = ReplyKeyboardMarkup(
     keyboard=[
@@ -19,27 +25,130 @@ main_menu_kb = ReplyKeyboardMarkup(
 )
 
 
+# sort, start и category — положение в каталоге: ключ сортировки, id первого курса
+# страницы и открытая категория (0 — все курсы). Их несут кнопки страниц, карточки
+# и «Назад к списку», чтобы вернуть на ту же страницу.
+# Пример: "course:page:0:p:128:12" — укладывается в лимит callback_data в 64 байта.
 class CourseCallbackFactory(CallbackData, prefix="course"):
     action: str
     course_id: int
+    sort: str = ""
+    start: int = 0
+    category: int = 0
+
+
+CATALOG_SORT_TITLES = {
+    "": "📋 Все",
+    "p": "💰 Дешевле",
+    "n": "🆕 Новые",
+}
+
+
+def _category_button(category: Category, count: int) -> InlineKeyboardButton:
+    return InlineKeyboardButton(
+        text=f"📂 {category.name} ({count})",
+        callback_data=CourseCallbackFactory(
+            action="page", course_id=0, category=category.id
+        ).pack(),
+    )
 
 
-def get_courses_list_kb(courses: list):
+def get_categories_kb(categories: Sequence[Tuple[Category, int]], total: int) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
-    for course in courses:
-        course_id = course["id"]
-        title = course["title"]
-        price = course["price"]
-
-        builder.button(
-            text=f"🎓 {title} - {price} руб.",
-            callback_data=CourseCallbackFactory(action="view", course_id=course_id),
-        )
+    for category, count in categories:
+        builder.row(_category_button(category, count))
+    builder.button(
+        text=f"📚 Все курсы ({total})",
+        callback_data=CourseCallbackFactory(action="page", course_id=0),
+    )
     builder.adjust(1)
     return builder.as_markup()
 
 
-def get_course_details_kb(course_id: int):
+# back — куда ведет «Назад»: родительская категория или список категорий
+def get_courses_list_kb(
+    page: CatalogPage,
+    subcategories: Sequence[Tuple[Category, int]] = (),
+    back: Optional[CourseCallbackFactory] = None,
+) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for category, count in subcategories:
+        builder.row(_category_button(category, count))
+    for course in page.rows:
+        builder.row(
+            InlineKeyboardButton(
+                text=f"🎓 {course['title']} - {course['price']} руб.",
+                callback_data=CourseCallbackFactory(
+                    action="view",
+                    course_id=course["id"],
+                    sort=page.sort,
+                    start=page.start,
+                    category=page.category_id,
+                ).pack(),
+            )
+        )
+
+    if page.total > 1:
+        navigation = []
+        if page.prev_start is not None:
+            navigation.append(
+                InlineKeyboardButton(
+                    text="⬅️",
+                    callback_data=CourseCallbackFactory(
+                        action="page",
+                        course_id=0,
+                        sort=page.sort,
+                        start=page.prev_start,
+                        category=page.category_id,
+                    ).pack(),
+                )
+            )
+        navigation.append(
+            InlineKeyboardButton(
+                text=f"{page.number}/{page.total}",
+                callback_data=CourseCallbackFactory(
+                    action="page",
+                    course_id=0,
+                    sort=page.sort,
+                    start=page.start,
+                    category=page.category_id,
+                ).pack(),
+            )
+        )
+        if page.next_start is not None:
+            navigation.append(
+                InlineKeyboardButton(
+                    text="➡️",
+                    callback_data=CourseCallbackFactory(
+                        action="page",
+                        course_id=0,
+                        sort=page.sort,
+                        start=page.next_start,
+                        category=page.category_id,
+                    ).pack(),
+                )
+            )
+        builder.row(*navigation)
+
+        # Смена сортировки открывает первую страницу
+        builder.row(
+            *(
+                InlineKeyboardButton(
+                    text=f"✅ {title}" if sort == page.sort else title,
+                    callback_data=CourseCallbackFactory(
+                        action="page", course_id=0, sort=sort, category=page.category_id
+                    ).pack(),
+                )
+                for sort, title in CATALOG_SORT_TITLES.items()
+            )
+        )
+
+    if back is not None:
+        builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data=back.pack()))
+    return builder.as_markup()
+
+
+def get_course_details_kb(course_id: int, sort: str = "", start: int = 0, category: int = 0):
     builder = InlineKeyboardBuilder()
     builder.button(
         text="💳 Купить курс",
@@ -47,7 +156,9 @@ def get_course_details_kb(course_id: int):
     )
     builder.button(
         text="⬅️ Назад к списку",
-        callback_data=CourseCallbackFactory(action="back_to_list", course_id=-1),
+        callback_data=CourseCallbackFactory(
+            action="back_to_list", course_id=-1, sort=sort, start=start, category=category
+        ),
     )
     builder.adjust(1)
     return builder.as_markup()
@@ -0,0 +1,96 @@
+import logging
+from typing import Callable, Any, Awaitable, Optional
+from aiogram import Bot, Dispatcher
+from aiogram.types.update import UpdateTypeLookupError
+from aiogram.types import Update, User
+
+from config import ADMIN_IDS
+from database import get_pool_waiters
+from middlewares.metrics import event_type
+from services.loop_monitor import loop_monitor
+from services.metrics import SHED
+
+OVERLOADED_TEXT = "Сервер перегружен, попробуйте позже"
+
+
+class AdmissionControl:
+    # Под перегрузкой обновление отклоняется сразу, без соединения из пула.
+    # Иначе обработчики копятся в ожидании пула, а пользователи, не дождавшись
+    # ответа, жмут кнопки снова. Пороги со значением 0 отключены.
+    def __init__(
+        self,
+        max_pool_waiters: int = 50,
+        max_in_flight: int = 500,
+        max_loop_lag: float = 0.5,
+    ):
+        self.max_pool_waiters = max_pool_waiters
+        self.max_in_flight = max_in_flight
+        self.max_loop_lag = max_loop_lag
+        # Обновления, пропущенные дальше: в очереди чата, у семафора или в обработчике
+        self.in_flight = 0
+        self.overloaded: Optional[str] = None
+
+    async def run(self, bot: Bot, update: Update, handler: Callable[[], Awaitable[Any]]) -> Any:
+        if not self._always_admit(update):
+            reason = self._check_overload()
+            if reason is not None:
+                SHED.labels(event_type(update), reason).inc()
+                if update.callback_query is not None:
+                    try:
+                        await bot.answer_callback_query(update.callback_query.id, OVERLOADED_TEXT)
+                    except Exception as e:
+                        logging.warning(f"Не удалось ответить на callback при перегрузке: {e}")
+                return None
+
+        self.in_flight += 1
+        try:
+            return await handler()
+        finally:
+            self.in_flight -= 1
+
+    @staticmethod
+    def _always_admit(update: Update) -> bool:
+        # Платежи пропускаем всегда: на pre_checkout_query у бота 10 секунд,
+        # а successful_payment означает, что деньги уже списаны.
+        # Админов тоже — им нужно, например, остановить рассылку
+        if update.pre_checkout_query is not None:
+            return True
+        if update.message is not None and update.message.successful_payment is not None:
+            return True
+        try:
+            user: Optional[User] = getattr(update.event, "from_user", None)
+        except UpdateTypeLookupError:
+            return False
+        return user is not None and user.id in ADMIN_IDS
+
+    def _check_overload(self) -> Optional[str]:
+        reason = None
+        if self.max_pool_waiters and get_pool_waiters() >= self.max_pool_waiters:
+            reason = "pool_waiters"
+        elif self.max_in_flight and self.in_flight >= self.max_in_flight:
+            reason = "in_flight"
+        elif self.max_loop_lag and loop_monitor.lag >= self.max_loop_lag:
+            reason = "loop_lag"
+
+        # В лог пишем только смену состояния, а не каждое отклоненное обновление
+        if reason != self.overloaded:
+            if reason:
+                logging.warning(f"Перегрузка ({reason}): новые обновления отклоняются.")
+            else:
+                logging.warning("Перегрузка прошла, обновления снова принимаются.")
+            self.overloaded = reason
+        return reason
+
+
+class AdmissionDispatcher(Dispatcher):
+    # Допуск проверяется до feed_update, а не в outer middleware: первым из них
+    # aiogram ставит FSMContextMiddleware, и при промахе кэша PostgresStorage
+    # (новый пользователь, истекший FSM_CACHE_TTL) он уже идет в БД. Через
+    # feed_update проходят polling, вебхук и обновления от супервизора.
+    def __init__(self, *, admission: AdmissionControl, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.admission = admission
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        feed = super().feed_update
+        return await self.admission.run(bot, update, lambda: feed(bot, update, **kwargs))
@@ -0,0 +1,76 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Callable, Dict, Any, Awaitable, Hashable, List
+from aiogram import BaseMiddleware
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.types import Update
+
+from services.metrics import CHAT_QUEUES, HANDLERS_IN_FLIGHT
+
+
+class KeyedLocks:
+    # Замок на ключ живет, пока его держат или ждут, и удаляется сразу после —
+    # словарь не растет с числом пользователей, когда-либо писавших боту
+    def __init__(self):
+        self._locks: Dict[Hashable, List] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+
+class ChatEventIsolation(BaseEventIsolation):
+    # Обновления одного чата — строго по очереди: successful_payment успевает
+    # выдать доступ до следующего нажатия, а сообщения одного FSM-диалога не гонятся.
+    # aiogram берет этот замок в FSMContextMiddleware до чтения состояния, поэтому
+    # следующее обновление видит состояние и данные, уже записанные предыдущим.
+    # asyncio.Lock отдает замок в порядке ожидания, а до него обновление доходит
+    # без переключений задач, поэтому порядок совпадает с порядком прихода.
+    def __init__(self):
+        self.locks = KeyedLocks()
+        CHAT_QUEUES.set_function(self.locks.__len__)
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        # В личке id чата совпадает с id пользователя, а для pre_checkout_query
+        # (без чата) aiogram подставляет id пользователя — покупатель в одной очереди
+        async with self.locks.hold(key.chat_id):
+            yield
+
+    async def close(self) -> None:
+        pass
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    # Обновления разных чатов обрабатываются параллельно, но не больше limit.
+    # Очередь внутри чата держит ChatEventIsolation, до этого middleware.
+    def __init__(self, limit: int = 100):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        HANDLERS_IN_FLIGHT.set_function(lambda: self.in_flight)
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with self.semaphore:
+            self.in_flight += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self.in_flight -= 1
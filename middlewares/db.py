@@ -0,0 +1,26 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from database import ConnectionScope
+
+
+class DbConnectionMiddleware(BaseMiddleware):
+    def __init__(self, transactional: bool = False):
+        self.transactional = transactional
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        scope = ConnectionScope(data["pool"], transactional=self.transactional)
+        data["db"] = scope
+        commit = False
+        try:
+            result = await handler(event, data)
+            commit = True
+            return result
+        finally:
+            await scope.close(commit=commit)
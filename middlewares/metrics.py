@@ -0,0 +1,44 @@
+import time
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from aiogram.types.update import UpdateTypeLookupError
+
+from services.metrics import HANDLER_LATENCY, UPDATES
+
+
+def event_type(update: Update) -> str:
+    # Типы обновлений, которых нет в этой версии aiogram, event_type не знает
+    try:
+        return update.event_type
+    except UpdateTypeLookupError:
+        return "unknown"
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    # Внешний middleware на dp.update: считает все входящие обновления
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        UPDATES.labels(event_type(event)).inc()
+        return await handler(event, data)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Внутренний middleware: вызывается, только когда обработчик уже найден
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_LATENCY.labels(
+                data["event_router"].name, data["handler"].callback.__name__
+            ).observe(time.perf_counter() - started)
@@ -3,6 +3,8 @@ from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
 from cachetools import TTLCache
 
+from services.metrics import THROTTLED
+
 class ThrottlingMiddleware(BaseMiddleware):
     def __init__(self, time_limit: int = 1):
         self.cache = TTLCache(maxsize=10_000, ttl=time_limit)
@@ -15,12 +17,15 @@ class ThrottlingMiddleware(BaseMiddleware):
     ) -> Any:
         if isinstance(event, Message):
             user_id = event.from_user.id
+            event_type = "message"
         elif isinstance(event, CallbackQuery):
             user_id = event.from_user.id
+            event_type = "callback_query"
         else:
             return await handler(event, data)
 
         if user_id in self.cache:
+            THROTTLED.labels(event_type).inc()
             return
 
         self.cache[user_id] = None
@@ -42,3 +42,6 @@ CREATE TABLE IF NOT EXISTS settings (
     key TEXT PRIMARY KEY,
     value TEXT NOT NULL
 );
+
+-- В ранних версиях таблицы payments не было колонки message_id
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS message_id BIGINT;
@@ -1 +1,8 @@
 -- Для удобной миграции , если пользователей будет потом на много больше
+
+-- Keyset-пагинация списка пользователей идёт по (registration_date, user_id)
+UPDATE users SET registration_date = CURRENT_TIMESTAMP WHERE registration_date IS NULL;
+ALTER TABLE users ALTER COLUMN registration_date SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_users_registration_date_user_id
+    ON users (registration_date DESC, user_id DESC);
@@ -0,0 +1,11 @@
+-- Срок действия счета: по нему фоновая задача отменяет неоплаченные платежи
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP;
+
+-- Счета, выставленные до появления колонки, живут те же 10 минут
+UPDATE payments
+SET expires_at = payment_date + INTERVAL '10 minutes'
+WHERE status = 'pending' AND expires_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_payments_pending_expires_at
+    ON payments (expires_at)
+    WHERE status = 'pending';
@@ -0,0 +1,216 @@
+-- Счетчики для админской статистики. Поддерживаются триггерами в той же
+-- транзакции, что и изменения исходных таблиц, поэтому дашборд читает
+-- несколько строк вместо полных проходов по users/payments.
+CREATE TABLE IF NOT EXISTS stats_counters (
+    key TEXT PRIMARY KEY,
+    value NUMERIC(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS stats_daily (
+    day DATE PRIMARY KEY,
+    payments_count BIGINT NOT NULL DEFAULT 0,
+    revenue NUMERIC(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS stats_course_revenue (
+    course_id INTEGER PRIMARY KEY REFERENCES courses(id),
+    payments_count BIGINT NOT NULL DEFAULT 0,
+    revenue NUMERIC(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION stats_bump(p_key TEXT, p_delta NUMERIC) RETURNS VOID AS $$
+BEGIN
+    IF p_delta <> 0 THEN
+        INSERT INTO stats_counters (key, value)
+        VALUES (p_key, p_delta)
+        ON CONFLICT (key) DO UPDATE SET value = stats_counters.value + EXCLUDED.value;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Порядок блокировок везде один: stats_counters -> stats_daily -> stats_course_revenue
+CREATE OR REPLACE FUNCTION stats_apply_payments(
+    p_course_ids INTEGER[], p_days DATE[], p_counts BIGINT[], p_amounts NUMERIC[]
+) RETURNS VOID AS $$
+DECLARE
+    v_count BIGINT;
+    v_amount NUMERIC;
+BEGIN
+    SELECT COALESCE(SUM(cnt), 0), COALESCE(SUM(amount), 0)
+    INTO v_count, v_amount
+    FROM unnest(p_counts, p_amounts) AS c(cnt, amount);
+
+    PERFORM stats_bump('successful_payments_count', v_count);
+    PERFORM stats_bump('total_revenue', v_amount);
+
+    INSERT INTO stats_daily (day, payments_count, revenue)
+    SELECT day, SUM(cnt), SUM(amount)
+    FROM unnest(p_days, p_counts, p_amounts) AS c(day, cnt, amount)
+    GROUP BY day
+    HAVING SUM(cnt) <> 0 OR SUM(amount) <> 0
+    ON CONFLICT (day) DO UPDATE
+    SET payments_count = stats_daily.payments_count + EXCLUDED.payments_count,
+        revenue = stats_daily.revenue + EXCLUDED.revenue;
+
+    INSERT INTO stats_course_revenue (course_id, payments_count, revenue)
+    SELECT course_id, SUM(cnt), SUM(amount)
+    FROM unnest(p_course_ids, p_counts, p_amounts) AS c(course_id, cnt, amount)
+    GROUP BY course_id
+    HAVING SUM(cnt) <> 0 OR SUM(amount) <> 0
+    ON CONFLICT (course_id) DO UPDATE
+    SET payments_count = stats_course_revenue.payments_count + EXCLUDED.payments_count,
+        revenue = stats_course_revenue.revenue + EXCLUDED.revenue;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stats_on_payments_insert() RETURNS TRIGGER AS $$
+DECLARE
+    v_course_ids INTEGER[];
+    v_days DATE[];
+    v_counts BIGINT[];
+    v_amounts NUMERIC[];
+BEGIN
+    SELECT array_agg(course_id), array_agg(payment_date::date), array_agg(1::BIGINT), array_agg(amount)
+    INTO v_course_ids, v_days, v_counts, v_amounts
+    FROM new_rows
+    WHERE status = 'succeeded';
+
+    IF v_course_ids IS NOT NULL THEN
+        PERFORM stats_apply_payments(v_course_ids, v_days, v_counts, v_amounts);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stats_on_payments_update() RETURNS TRIGGER AS $$
+DECLARE
+    v_course_ids INTEGER[];
+    v_days DATE[];
+    v_counts BIGINT[];
+    v_amounts NUMERIC[];
+BEGIN
+    SELECT array_agg(course_id), array_agg(day), array_agg(cnt), array_agg(amount)
+    INTO v_course_ids, v_days, v_counts, v_amounts
+    FROM (
+        SELECT course_id, payment_date::date AS day, 1::BIGINT AS cnt, amount
+        FROM new_rows
+        WHERE status = 'succeeded'
+        UNION ALL
+        SELECT course_id, payment_date::date, -1::BIGINT, -amount
+        FROM old_rows
+        WHERE status = 'succeeded'
+    ) changes;
+
+    IF v_course_ids IS NOT NULL THEN
+        PERFORM stats_apply_payments(v_course_ids, v_days, v_counts, v_amounts);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stats_on_users_insert() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM stats_bump('users_count', (SELECT COUNT(*) FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stats_on_user_courses_insert() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM stats_bump('purchases_count', (SELECT COUNT(*) FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stats_on_courses_insert() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM stats_bump('active_courses_count', (SELECT COUNT(*) FROM new_rows WHERE is_active));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stats_on_courses_update() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM stats_bump(
+        'active_courses_count',
+        (SELECT COUNT(*) FROM new_rows WHERE is_active) - (SELECT COUNT(*) FROM old_rows WHERE is_active)
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_stats_payments_insert ON payments;
+CREATE TRIGGER trg_stats_payments_insert
+    AFTER INSERT ON payments
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION stats_on_payments_insert();
+
+DROP TRIGGER IF EXISTS trg_stats_payments_update ON payments;
+CREATE TRIGGER trg_stats_payments_update
+    AFTER UPDATE ON payments
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION stats_on_payments_update();
+
+DROP TRIGGER IF EXISTS trg_stats_users_insert ON users;
+CREATE TRIGGER trg_stats_users_insert
+    AFTER INSERT ON users
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION stats_on_users_insert();
+
+DROP TRIGGER IF EXISTS trg_stats_user_courses_insert ON user_courses;
+CREATE TRIGGER trg_stats_user_courses_insert
+    AFTER INSERT ON user_courses
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION stats_on_user_courses_insert();
+
+DROP TRIGGER IF EXISTS trg_stats_courses_insert ON courses;
+CREATE TRIGGER trg_stats_courses_insert
+    AFTER INSERT ON courses
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION stats_on_courses_insert();
+
+DROP TRIGGER IF EXISTS trg_stats_courses_update ON courses;
+CREATE TRIGGER trg_stats_courses_update
+    AFTER UPDATE ON courses
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION stats_on_courses_update();
+
+-- Точный пересчет по исходным таблицам (сверка из админки и первичное заполнение).
+-- EXCLUSIVE-блокировка ждет транзакции, чьи триггеры уже тронули счетчики,
+-- а новые триггеры ждут окончания пересчета и применяют свои дельты поверх.
+CREATE OR REPLACE FUNCTION stats_recompute() RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE stats_counters, stats_daily, stats_course_revenue IN EXCLUSIVE MODE;
+
+    DELETE FROM stats_counters;
+    DELETE FROM stats_daily;
+    DELETE FROM stats_course_revenue;
+
+    INSERT INTO stats_counters (key, value) VALUES
+        ('users_count', (SELECT COUNT(*) FROM users)),
+        ('purchases_count', (SELECT COUNT(*) FROM user_courses)),
+        ('successful_payments_count', (SELECT COUNT(*) FROM payments WHERE status = 'succeeded')),
+        ('total_revenue', (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE status = 'succeeded')),
+        ('active_courses_count', (SELECT COUNT(*) FROM courses WHERE is_active));
+
+    INSERT INTO stats_daily (day, payments_count, revenue)
+    SELECT payment_date::date, COUNT(*), SUM(amount)
+    FROM payments
+    WHERE status = 'succeeded'
+    GROUP BY payment_date::date;
+
+    INSERT INTO stats_course_revenue (course_id, payments_count, revenue)
+    SELECT course_id, COUNT(*), SUM(amount)
+    FROM payments
+    WHERE status = 'succeeded'
+    GROUP BY course_id;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM stats_counters) THEN
+        PERFORM stats_recompute();
+    END IF;
+END;
+$$;
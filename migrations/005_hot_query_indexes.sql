@@ -0,0 +1,15 @@
+-- Индексы под горячие запросы.
+-- user_courses(user_id) уже покрыт уникальным индексом (user_id, course_id),
+-- users(registration_date) — индексом (registration_date, user_id) из 002_add_indexes.sql.
+
+-- История покупок: WHERE user_id = $1 ORDER BY payment_date DESC
+CREATE INDEX IF NOT EXISTS idx_payments_user_id_payment_date
+    ON payments (user_id, payment_date);
+
+CREATE INDEX IF NOT EXISTS idx_payments_status
+    ON payments (status);
+
+-- Админские списки активных курсов: WHERE is_active = TRUE AND id > $2 ORDER BY id
+CREATE INDEX IF NOT EXISTS idx_courses_active_id
+    ON courses (id)
+    WHERE is_active = TRUE;
@@ -0,0 +1,6 @@
+-- Идентификатор платежа Telegram: повторная доставка successful_payment
+-- с тем же charge_id не должна выдавать доступ второй раз
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS telegram_payment_charge_id TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_telegram_payment_charge_id
+    ON payments (telegram_payment_charge_id);
@@ -0,0 +1,24 @@
+-- Рассылки администратора. last_user_id — чекпоинт: после рестарта рассылка
+-- продолжается с пользователей, чей user_id больше него.
+-- heartbeat_at обновляется на каждом чекпоинте; рассылку с протухшим heartbeat
+-- подхватывает любой живой процесс.
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id SERIAL PRIMARY KEY,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',
+    admin_chat_id BIGINT NOT NULL,
+    status_message_id BIGINT,
+    last_user_id BIGINT NOT NULL DEFAULT 0,
+    total_count INTEGER NOT NULL DEFAULT 0,
+    sent_count INTEGER NOT NULL DEFAULT 0,
+    blocked_count INTEGER NOT NULL DEFAULT 0,
+    deactivated_count INTEGER NOT NULL DEFAULT 0,
+    failed_count INTEGER NOT NULL DEFAULT 0,
+    heartbeat_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_broadcasts_running
+    ON broadcasts (heartbeat_at)
+    WHERE status = 'running';
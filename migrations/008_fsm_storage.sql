@@ -0,0 +1,11 @@
+-- Хранилище FSM (состояния и данные диалогов админки), общее для всех процессов
+CREATE TABLE IF NOT EXISTS fsm_storage (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Для удаления брошенных состояний
+CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at
+    ON fsm_storage (updated_at);
@@ -0,0 +1,19 @@
+-- Категории курсов: дерево через parent_id, position — порядок среди соседей
+CREATE TABLE IF NOT EXISTS categories (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    parent_id INTEGER REFERENCES categories(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL DEFAULT 0
+);
+
+-- Подкатегории при каскадном удалении ветки
+CREATE INDEX IF NOT EXISTS idx_categories_parent_id
+    ON categories (parent_id);
+
+ALTER TABLE courses
+    ADD COLUMN IF NOT EXISTS category_id INTEGER REFERENCES categories(id) ON DELETE SET NULL;
+
+-- Курсы категории по порядку id; индекс нужен и ON DELETE SET NULL,
+-- чтобы удаление категории не просматривало всю таблицу courses
+CREATE INDEX IF NOT EXISTS idx_courses_category_id
+    ON courses (category_id, id);
@@ -0,0 +1,4 @@
+-- Владелец рассылки: токен аренды выдается при создании и при перехвате.
+-- Чекпоинт и продление heartbeat проходят только с текущим токеном, поэтому
+-- процесс, у которого рассылку перехватили, не может продвинуть last_user_id.
+ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS lease_token TEXT;
@@ -0,0 +1,4 @@
+-- Сколько раз рассылку подхватывали после падения владельца. Рассылка, которая
+-- роняет каждый процесс, иначе перехватывалась бы бесконечно; после
+-- BROADCAST_MAX_CLAIMS перехватов она помечается как 'failed'.
+ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS claim_count INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,131 @@
+from typing import Dict, List, Optional
+
+from database import Executor, acquire
+
+async def create_broadcast(
+    db: Executor, text: str, admin_chat_id: int, total_count: int, lease_token: str
+) -> Dict:
+    async with acquire(db) as conn:
+        row = await conn.fetchrow(
+            """
+            INSERT INTO broadcasts (text, admin_chat_id, total_count, lease_token)
+            VALUES ($1, $2, $3, $4)
+            RETURNING *
+            """,
+            text, admin_chat_id, total_count, lease_token
+        )
+        return dict(row)
+
+async def set_broadcast_status_message(db: Executor, broadcast_id: int, message_id: int):
+    async with acquire(db) as conn:
+        await conn.execute(
+            "UPDATE broadcasts SET status_message_id = $1 WHERE id = $2",
+            message_id, broadcast_id
+        )
+
+async def claim_stale_broadcast(
+    db: Executor, lease_seconds: int, lease_token: str, running_ids: List[int], max_claims: int
+) -> Optional[Dict]:
+    # Забираем рассылку, чей владелец перестал обновлять heartbeat (упал или перезапущен).
+    # Свои же идущие рассылки пропускаем, даже если их heartbeat запоздал
+    async with acquire(db) as conn:
+        row = await conn.fetchrow(
+            """
+            UPDATE broadcasts
+            SET heartbeat_at = CURRENT_TIMESTAMP, lease_token = $2, claim_count = claim_count + 1
+            WHERE id = (
+                SELECT id
+                FROM broadcasts
+                WHERE status = 'running'
+                  AND heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+                  AND id <> ALL($3::int[])
+                  AND claim_count < $4
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+            """,
+            lease_seconds, lease_token, running_ids, max_claims
+        )
+        return dict(row) if row else None
+
+async def fail_exhausted_broadcasts(db: Executor, lease_seconds: int, max_claims: int) -> List[Dict]:
+    # Брошенные рассылки, которые подхватывали уже max_claims раз, больше не продолжаем
+    async with acquire(db) as conn:
+        rows = await conn.fetch(
+            """
+            UPDATE broadcasts
+            SET status = 'failed', finished_at = CURRENT_TIMESTAMP
+            WHERE status = 'running'
+              AND heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+              AND claim_count >= $2
+            RETURNING id, admin_chat_id, claim_count
+            """,
+            lease_seconds, max_claims
+        )
+        return [dict(row) for row in rows]
+
+async def renew_broadcast_lease(db: Executor, broadcast_id: int, lease_token: str) -> bool:
+    # False — рассылку перехватил другой процесс
+    async with acquire(db) as conn:
+        result = await conn.execute(
+            """
+            UPDATE broadcasts
+            SET heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = $1 AND lease_token = $2
+            """,
+            broadcast_id, lease_token
+        )
+        return result == "UPDATE 1"
+
+async def save_broadcast_progress(
+    db: Executor,
+    broadcast_id: int,
+    last_user_id: int,
+    sent: int,
+    blocked: int,
+    deactivated: int,
+    failed: int,
+    lease_token: str,
+) -> Optional[str]:
+    # None — аренда потеряна: чекпоинт не записан, рассылку ведет другой процесс
+    async with acquire(db) as conn:
+        status = await conn.fetchval(
+            """
+            UPDATE broadcasts
+            SET last_user_id = $2,
+                sent_count = sent_count + $3,
+                blocked_count = blocked_count + $4,
+                deactivated_count = deactivated_count + $5,
+                failed_count = failed_count + $6,
+                heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = $1 AND lease_token = $7
+            RETURNING status
+            """,
+            broadcast_id, last_user_id, sent, blocked, deactivated, failed, lease_token
+        )
+        return status
+
+async def finish_broadcast(db: Executor, broadcast_id: int, lease_token: str):
+    async with acquire(db) as conn:
+        await conn.execute(
+            """
+            UPDATE broadcasts
+            SET status = 'finished', finished_at = CURRENT_TIMESTAMP
+            WHERE id = $1 AND status = 'running' AND lease_token = $2
+            """,
+            broadcast_id, lease_token
+        )
+
+async def cancel_broadcast(db: Executor, broadcast_id: int) -> bool:
+    async with acquire(db) as conn:
+        result = await conn.execute(
+            """
+            UPDATE broadcasts
+            SET status = 'canceled', finished_at = CURRENT_TIMESTAMP
+            WHERE id = $1 AND status = 'running'
+            """,
+            broadcast_id
+        )
+        return result == "UPDATE 1"
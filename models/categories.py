@@ -0,0 +1,179 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from database import Executor, acquire, shared_executor
+from models.courses import CATALOG_CHANNEL, CatalogSnapshot, invalidate_catalog
+
+CATEGORIES_CHANNEL = "categories_changed"
+
+
+class Category(NamedTuple):
+    id: int
+    name: str
+    parent_id: Optional[int]
+    position: int
+
+
+class CategoryTree(NamedTuple):
+    version: int
+    by_id: Dict[int, Category]
+    # Дочерние категории по id родителя (None — корень), уже в порядке показа
+    children: Dict[Optional[int], Tuple[Category, ...]]
+
+
+# --- Дерево категорий в памяти ---
+# Категории правятся только из админки, а нужны на каждом шаге навигации по
+# каталогу: держим дерево целиком и перечитываем его после записи (своей или
+# чужого процесса через NOTIFY), как снимок каталога курсов.
+class _CategoryCache:
+    def __init__(self):
+        self.version = 0
+        self.tree: Optional[CategoryTree] = None
+        self.lock = asyncio.Lock()
+        # (дерево, снимок каталога, счетчики) — счетчики действительны для этой пары
+        self.counts: Optional[Tuple[CategoryTree, CatalogSnapshot, Dict[int, int]]] = None
+
+
+_categories = _CategoryCache()
+
+
+def invalidate_categories():
+    _categories.version += 1
+    _categories.tree = None
+
+
+def on_categories_notify(conn, pid, channel, payload):
+    invalidate_categories()
+
+
+async def get_category_tree(db: Executor) -> CategoryTree:
+    tree = _categories.tree
+    if tree is not None:
+        return tree
+
+    async with _categories.lock:
+        if _categories.tree is not None:
+            return _categories.tree
+
+        version = _categories.version
+        async with acquire(shared_executor(db)) as conn:
+            rows = await conn.fetch(
+                "SELECT id, name, parent_id, position FROM categories ORDER BY position, id"
+            )
+
+        children: Dict[Optional[int], List[Category]] = defaultdict(list)
+        by_id = {}
+        for row in rows:
+            category = Category(row["id"], row["name"], row["parent_id"], row["position"])
+            by_id[category.id] = category
+            children[category.parent_id].append(category)
+
+        tree = CategoryTree(
+            version=version,
+            by_id=by_id,
+            children={parent_id: tuple(items) for parent_id, items in children.items()},
+        )
+        # Если во время загрузки пришла инвалидация, дерево уже устарело
+        if version == _categories.version:
+            _categories.tree = tree
+        return tree
+
+
+def get_path(tree: CategoryTree, category_id: int) -> List[Category]:
+    # От корня до самой категории
+    path = []
+    category = tree.by_id.get(category_id)
+    while category is not None:
+        path.append(category)
+        category = tree.by_id.get(category.parent_id)
+    path.reverse()
+    return path
+
+
+def walk(tree: CategoryTree, parent_id: Optional[int] = None, depth: int = 0) -> Iterator[Tuple[int, Category]]:
+    # Обход в глубину для плоских списков с отступами
+    for category in tree.children.get(parent_id, ()):
+        yield depth, category
+        yield from walk(tree, category.id, depth + 1)
+
+
+def count_courses(tree: CategoryTree, catalog: CatalogSnapshot) -> Dict[int, int]:
+    # Активные курсы категории вместе с подкатегориями. Считаются по снимку каталога
+    # в памяти один раз на пару снимков, а не агрегатным запросом на каждый показ.
+    # Возвращаемый словарь меняется вместе с любым из снимков — по нему RenderCache
+    # понимает, что клавиатура навигации устарела.
+    cached = _categories.counts
+    if cached is not None and cached[0] is tree and cached[1] is catalog:
+        return cached[2]
+
+    counts: Dict[int, int] = defaultdict(int)
+    for course in catalog.active:
+        category = tree.by_id.get(course["category_id"])
+        while category is not None:
+            counts[category.id] += 1
+            category = tree.by_id.get(category.parent_id)
+
+    counts = dict(counts)
+    _categories.counts = (tree, catalog, counts)
+    return counts
+
+
+async def add_category(db: Executor, name: str, parent_id: Optional[int] = None) -> Optional[int]:
+    # Новая категория встает последней среди соседей. Если родителя уже удалили,
+    # ничего не вставляется и возвращается None
+    async with acquire(db) as conn:
+        category_id = await conn.fetchval(
+            """
+            WITH inserted AS (
+                INSERT INTO categories (name, parent_id, position)
+                SELECT $1, $2, COALESCE(
+                    (SELECT MAX(position) + 1 FROM categories WHERE parent_id IS NOT DISTINCT FROM $2),
+                    0
+                )
+                WHERE $2::int IS NULL OR EXISTS (SELECT 1 FROM categories WHERE id = $2)
+                RETURNING id
+            )
+            SELECT id, pg_notify($3, id::text) FROM inserted
+            """,
+            name,
+            parent_id,
+            CATEGORIES_CHANNEL,
+        )
+    invalidate_categories()
+    return category_id
+
+
+async def rename_category(db: Executor, category_id: int, name: str):
+    async with acquire(db) as conn:
+        await conn.execute(
+            """
+            WITH updated AS (
+                UPDATE categories SET name = $1 WHERE id = $2 RETURNING id
+            )
+            SELECT pg_notify($3, id::text) FROM updated
+            """,
+            name,
+            category_id,
+            CATEGORIES_CHANNEL,
+        )
+    invalidate_categories()
+
+
+async def delete_category(db: Executor, category_id: int):
+    # Подкатегории удаляются каскадом, их курсы остаются без категории —
+    # поэтому меняется и каталог
+    async with acquire(db) as conn:
+        await conn.execute(
+            """
+            WITH deleted AS (
+                DELETE FROM categories WHERE id = $1 RETURNING id
+            )
+            SELECT pg_notify($2, id::text), pg_notify($3, id::text) FROM deleted
+            """,
+            category_id,
+            CATEGORIES_CHANNEL,
+            CATALOG_CHANNEL,
+        )
+    invalidate_categories()
+    invalidate_catalog()
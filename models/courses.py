@@ -1,51 +1,247 @@
-from typing import List, Optional
+import asyncio
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
 import asyncpg
 
+from database import Executor, acquire, shared_executor
+from models.pagination import Page, build_page
 
-async def get_all_courses(pool: asyncpg.Pool) -> List:
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            "SELECT * FROM courses WHERE is_active = TRUE ORDER BY id"
+CATALOG_CHANNEL = "courses_changed"
+
+_GET_COURSE = "SELECT * FROM courses WHERE id = $1"
+
+
+# --- Кэш каталога в памяти ---
+# Каталог меняется только из админки, поэтому читаем его целиком один раз и
+# отдаём из памяти до следующей записи (своей или чужого процесса через NOTIFY).
+class CatalogSnapshot(NamedTuple):
+    version: int
+    by_id: Dict[int, asyncpg.Record]
+    active: Tuple[asyncpg.Record, ...]
+    # Отсортированные активные курсы по (ключу сортировки, категории), строятся при первом запросе
+    orders: Dict[Tuple[str, int], Tuple[List[Any], Tuple[asyncpg.Record, ...]]]
+
+
+class _CatalogCache:
+    def __init__(self):
+        self.version = 0
+        self.snapshot: Optional[CatalogSnapshot] = None
+        self.lock = asyncio.Lock()
+        # id, которых нет в БД: устаревшие кнопки и подделанные callback_data не ходят
+        # в базу повторно. Сбрасывается вместе со снимком при любой смене каталога
+        self.missing: Set[int] = set()
+        self.hits = 0
+        self.misses = 0
+
+
+_catalog = _CatalogCache()
+# Сколько отсутствующих id помнить: перебор случайных id не должен раздувать память
+MISSING_COURSES_LIMIT = 10_000
+
+
+def invalidate_catalog():
+    _catalog.version += 1
+    _catalog.snapshot = None
+    _catalog.missing = set()
+
+
+def on_catalog_notify(conn, pid, channel, payload):
+    invalidate_catalog()
+
+
+def get_catalog_version() -> int:
+    return _catalog.version
+
+
+def get_catalog_cache_stats() -> Dict:
+    snapshot = _catalog.snapshot
+    return {
+        "version": _catalog.version,
+        "hits": _catalog.hits,
+        "misses": _catalog.misses,
+        "size": len(snapshot.by_id) if snapshot else 0,
+    }
+
+
+async def get_catalog(db: Executor) -> CatalogSnapshot:
+    snapshot = _catalog.snapshot
+    if snapshot is not None:
+        _catalog.hits += 1
+        return snapshot
+
+    async with _catalog.lock:
+        if _catalog.snapshot is not None:
+            _catalog.hits += 1
+            return _catalog.snapshot
+
+        _catalog.misses += 1
+        version = _catalog.version
+        async with acquire(shared_executor(db)) as conn:
+            rows = await conn.fetch("SELECT * FROM courses ORDER BY id")
+
+        snapshot = CatalogSnapshot(
+            version=version,
+            by_id={row["id"]: row for row in rows},
+            active=tuple(row for row in rows if row["is_active"]),
+            orders={},
         )
-        return rows
+        # Если во время загрузки пришла инвалидация, снимок уже устарел
+        if version == _catalog.version:
+            _catalog.snapshot = snapshot
+        return snapshot
+
+
+# --- Страницы пользовательского каталога ---
+# Ключи сортировки однобуквенные: они передаются в callback_data (лимит 64 байта).
+# Ключ уникален за счет id, поэтому курсор страницы — просто id ее первого курса.
+# "Новые" — по убыванию id: отдельной даты создания у курсов нет.
+CATALOG_SORTS: Dict[str, Callable[[asyncpg.Record], Tuple]] = {
+    "": lambda row: (row["id"],),
+    "p": lambda row: (row["price"], row["id"]),
+    "n": lambda row: (-row["id"],),
+}
+
+
+class CatalogPage(NamedTuple):
+    rows: Tuple[asyncpg.Record, ...]
+    sort: str
+    start: int
+    prev_start: Optional[int]
+    next_start: Optional[int]
+    number: int
+    total: int
+    # 0 — все курсы, иначе только курсы, привязанные к этой категории
+    category_id: int
+    # Объект, по которому RenderCache понимает, что страница не устарела
+    source: Tuple[asyncpg.Record, ...]
+
+
+def _get_order(
+    snapshot: CatalogSnapshot, sort: str, category_id: int = 0
+) -> Tuple[List[Any], Tuple[asyncpg.Record, ...]]:
+    order = snapshot.orders.get((sort, category_id))
+    if order is None:
+        key = CATALOG_SORTS[sort]
+        rows = snapshot.active
+        if sort and category_id:
+            # Срез категории выбирается один раз, остальные сортировки берут его готовым
+            rows = _get_order(snapshot, "", category_id)[1]
+        elif category_id:
+            rows = tuple(row for row in rows if row["category_id"] == category_id)
+        rows = tuple(sorted(rows, key=key))
+        order = snapshot.orders[(sort, category_id)] = ([key(row) for row in rows], rows)
+    return order
+
 
+def build_catalog_page(
+    snapshot: CatalogSnapshot, sort: str, limit: int, start: int = 0, category_id: int = 0
+) -> CatalogPage:
+    # Keyset по отсортированному снимку: позиция курсора ищется бинарным поиском
+    # по ключу сортировки, поэтому работает и для курса, который уже в архиве
+    # (by_id хранит все курсы), а время не зависит от размера каталога
+    if sort not in CATALOG_SORTS:
+        sort = ""
+    keys, rows = _get_order(snapshot, sort, category_id)
+    position = 0
+    course = snapshot.by_id.get(start) if start else None
+    if course is not None:
+        position = bisect_left(keys, CATALOG_SORTS[sort](course))
+        # Курсы в конце списка убрали — показываем последнюю страницу
+        if position >= len(rows):
+            position = max(0, len(rows) - limit)
 
-async def get_course_by_id(pool: asyncpg.Pool, course_id: int) -> Optional:
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT * FROM courses WHERE id = $1", course_id)
+    end = position + limit
+    return CatalogPage(
+        rows=rows[position:end],
+        sort=sort,
+        start=rows[position]["id"] if position < len(rows) else 0,
+        prev_start=rows[max(0, position - limit)]["id"] if position > 0 else None,
+        next_start=rows[end]["id"] if end < len(rows) else None,
+        number=min((position + limit - 1) // limit + 1, max(1, (len(rows) + limit - 1) // limit)),
+        total=max(1, (len(rows) + limit - 1) // limit),
+        source=rows,
+        category_id=category_id,
+    )
+
+
+async def get_catalog_page(
+    db: Executor, sort: str, limit: int, start: int = 0, category_id: int = 0
+) -> CatalogPage:
+    snapshot = await get_catalog(db)
+    return build_catalog_page(snapshot, sort, limit, start, category_id)
+
+
+async def get_all_courses(db: Executor) -> List:
+    snapshot = await get_catalog(db)
+    return list(snapshot.active)
+
+
+async def get_course_by_id(db: Executor, course_id: int) -> Optional:
+    snapshot = await get_catalog(db)
+    row = snapshot.by_id.get(course_id)
+    if row is not None:
         return row
 
+    if course_id in _catalog.missing:
+        _catalog.hits += 1
+        return None
+
+    # Курс мог появиться в другом процессе раньше, чем до нас дошёл NOTIFY
+    _catalog.misses += 1
+    version = _catalog.version
+    async with acquire(db) as conn:
+        row = await conn.fetchrow(_GET_COURSE, course_id)
+    if row is not None:
+        invalidate_catalog()
+    elif version == _catalog.version and len(_catalog.missing) < MISSING_COURSES_LIMIT:
+        _catalog.missing.add(course_id)
+    return row
+
 
 async def add_course(
-    pool: asyncpg.Pool,
+    db: Executor,
     title: str,
     short_desc: str,
     full_desc: str,
     link: str,
     price: float,
 ):
-    async with pool.acquire() as conn:
+    async with acquire(db) as conn:
         await conn.execute(
             """
-            INSERT INTO courses (title, short_description, full_description, materials_link, price)
-            VALUES ($1, $2, $3, $4, $5)
+            WITH inserted AS (
+                INSERT INTO courses (title, short_description, full_description, materials_link, price)
+                VALUES ($1, $2, $3, $4, $5)
+                RETURNING id
+            )
+            SELECT pg_notify($6, id::text) FROM inserted
             """,
             title,
             short_desc,
             full_desc,
             link,
             price,
+            CATALOG_CHANNEL,
         )
+    invalidate_catalog()
 
 
-async def delete_course(pool: asyncpg.Pool, course_id: int):
-    async with pool.acquire() as conn:
+async def delete_course(db: Executor, course_id: int):
+    async with acquire(db) as conn:
         await conn.execute(
-            "UPDATE courses SET is_active = FALSE WHERE id = $1", course_id
+            """
+            WITH updated AS (
+                UPDATE courses SET is_active = FALSE WHERE id = $1 RETURNING id
+            )
+            SELECT pg_notify($2, id::text) FROM updated
+            """,
+            course_id,
+            CATALOG_CHANNEL,
         )
+    invalidate_catalog()
 
 
-async def update_course_field(pool: asyncpg.Pool, course_id: int, field: str, value):
+async def update_course_field(db: Executor, course_id: int, field: str, value):
     if field not in {
         "title",
         "short_description",
@@ -53,60 +249,59 @@ async def update_course_field(pool: asyncpg.Pool, course_id: int, field: str, va
         "materials_link",
         "price",
         "is_active",
+        "category_id",
     }:
         raise ValueError("Недопустимое поле для обновления")
 
-    async with pool.acquire() as conn:
+    async with acquire(db) as conn:
         await conn.execute(
-            f"UPDATE courses SET {field} = $1 WHERE id = $2", value, course_id
-        )
-
-
-async def get_total_courses_count(pool: asyncpg.Pool) -> int:
-    async with pool.acquire() as conn:
-        count = await conn.fetchval(
-            "SELECT COUNT(*) FROM courses WHERE is_active = TRUE"
+            f"""
+            WITH updated AS (
+                UPDATE courses SET {field} = $1 WHERE id = $2 RETURNING id
+            )
+            SELECT pg_notify($3, id::text) FROM updated
+            """,
+            value,
+            course_id,
+            CATALOG_CHANNEL,
         )
-        return count
+    invalidate_catalog()
 
 
-async def get_paginated_courses(pool: asyncpg.Pool, limit: int, offset: int) -> List:
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
+async def _get_courses_page(
+    db: Executor, is_active: bool, limit: int, cursor: int, backward: bool
+) -> Page:
+    # Флаг подставляем литералом, чтобы планировщик мог взять частичный индекс
+    # idx_courses_active_id и для подготовленного (generic) плана
+    status = "TRUE" if is_active else "FALSE"
+    if backward:
+        query = f"""
+            SELECT *
+            FROM courses
+            WHERE is_active = {status} AND id < $1
+            ORDER BY id DESC
+            LIMIT $2
+        """
+    else:
+        query = f"""
             SELECT *
             FROM courses
-            WHERE is_active = TRUE
+            WHERE is_active = {status} AND id > $1
             ORDER BY id
-            LIMIT $1 OFFSET $2
-            """,
-            limit,
-            offset,
-        )
-        return rows
+            LIMIT $2
+        """
+    async with acquire(db) as conn:
+        rows = await conn.fetch(query, cursor, limit + 1)
+    return build_page(rows, limit, backward, has_cursor=cursor > 0)
 
 
-async def get_total_archived_courses_count(pool: asyncpg.Pool) -> int:
-    async with pool.acquire() as conn:
-        count = await conn.fetchval(
-            "SELECT COUNT(*) FROM courses WHERE is_active = FALSE"
-        )
-        return count
+async def get_paginated_courses(
+    db: Executor, limit: int, cursor: int = 0, backward: bool = False
+) -> Page:
+    return await _get_courses_page(db, True, limit, cursor, backward)
 
 
 async def get_paginated_archived_courses(
-    pool: asyncpg.Pool, limit: int, offset: int
-) -> List:
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-            SELECT *
-            FROM courses
-            WHERE is_active = FALSE
-            ORDER BY id
-            LIMIT $1 OFFSET $2
-            """,
-            limit,
-            offset,
-        )
-        return rows
+    db: Executor, limit: int, cursor: int = 0, backward: bool = False
+) -> Page:
+    return await _get_courses_page(db, False, limit, cursor, backward)
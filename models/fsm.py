@@ -0,0 +1,49 @@
+import json
+from typing import Dict, List, Optional, Tuple
+
+from database import Executor, acquire
+
+_GET_FSM_RECORD = "SELECT state, data::text AS data FROM fsm_storage WHERE key = $1"
+
+async def get_fsm_record(db: Executor, key: str) -> Optional[Tuple[Optional[str], Dict]]:
+    async with acquire(db) as conn:
+        row = await conn.fetchrow(_GET_FSM_RECORD, key)
+        if not row:
+            return None
+        return row["state"], json.loads(row["data"])
+
+async def save_fsm_records(db: Executor, records: List[Tuple[str, Optional[str], Dict]]):
+    # Пустые записи (нет ни состояния, ни данных) удаляем, остальные пишем одним запросом
+    upserts = [(key, state, data) for key, state, data in records if state or data]
+    deletes = [key for key, state, data in records if not (state or data)]
+    async with acquire(db) as conn:
+        if upserts:
+            await conn.execute(
+                """
+                INSERT INTO fsm_storage (key, state, data, updated_at)
+                SELECT key, state, data::jsonb, CURRENT_TIMESTAMP
+                FROM unnest($1::text[], $2::text[], $3::text[]) AS t(key, state, data)
+                ON CONFLICT (key) DO UPDATE
+                SET state = EXCLUDED.state,
+                    data = EXCLUDED.data,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                [key for key, _, _ in upserts],
+                [state for _, state, _ in upserts],
+                [json.dumps(data, ensure_ascii=False) for _, _, data in upserts],
+            )
+        if deletes:
+            await conn.execute(
+                "DELETE FROM fsm_storage WHERE key = ANY($1::text[])", deletes
+            )
+
+async def delete_expired_fsm_records(db: Executor, ttl_seconds: int) -> int:
+    async with acquire(db) as conn:
+        result = await conn.execute(
+            """
+            DELETE FROM fsm_storage
+            WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+            """,
+            ttl_seconds
+        )
+        return int(result.split()[-1])
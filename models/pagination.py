@@ -0,0 +1,17 @@
+from typing import List, NamedTuple
+
+
+class Page(NamedTuple):
+    rows: List
+    has_prev: bool
+    has_next: bool
+
+
+def build_page(rows: List, limit: int, backward: bool, has_cursor: bool) -> Page:
+    # Запрашиваем limit + 1 строк: лишняя строка означает, что дальше есть ещё страница
+    has_more = len(rows) > limit
+    rows = list(rows[:limit])
+    if backward:
+        rows.reverse()
+        return Page(rows, has_prev=has_more, has_next=True)
+    return Page(rows, has_prev=has_cursor, has_next=has_more)
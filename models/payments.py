@@ -1,50 +1,134 @@
 from typing import Optional, List, Dict
+
 import asyncpg
 
-async def create_pending_payment(pool: asyncpg.Pool, user_id: int, course_id: int, amount: float) -> Optional[int]:
-    async with pool.acquire() as conn:
+from database import Executor, acquire
+
+_GET_PAYMENT_INFO = """
+    SELECT user_id, course_id, message_id, status,
+           COALESCE(expires_at <= CURRENT_TIMESTAMP, FALSE) AS is_expired
+    FROM payments
+    WHERE id = $1
+    """
+_GET_PAYMENT_HISTORY = """
+    SELECT p.amount, p.status, p.payment_date, c.title
+    FROM payments p
+    JOIN courses c ON p.course_id = c.id
+    WHERE p.user_id = $1
+    ORDER BY p.payment_date DESC
+    """
+_GET_PROCESSED_PAYMENT = """
+    SELECT p.user_id, p.course_id,
+           FALSE AS is_new,
+           c.title AS course_title,
+           u.username, u.full_name
+    FROM payments p
+    JOIN courses c ON c.id = p.course_id
+    JOIN users u ON u.user_id = p.user_id
+    WHERE p.telegram_payment_charge_id = $1
+    """
+
+async def create_pending_payment(
+    db: Executor, user_id: int, course_id: int, amount: float, ttl_seconds: int
+) -> Optional[int]:
+    async with acquire(db) as conn:
         payment_id = await conn.fetchval(
             """
-            INSERT INTO payments (user_id, course_id, amount, status)
-            VALUES ($1, $2, $3, 'pending')
+            INSERT INTO payments (user_id, course_id, amount, status, expires_at)
+            VALUES ($1, $2, $3, 'pending', CURRENT_TIMESTAMP + make_interval(secs => $4))
             RETURNING id
             """,
-            user_id, course_id, amount
+            user_id, course_id, amount, ttl_seconds
         )
         return payment_id
 
-async def update_payment_status(pool: asyncpg.Pool, payment_id: int, status: str):
-    async with pool.acquire() as conn:
+async def update_payment_status(db: Executor, payment_id: int, status: str):
+    async with acquire(db) as conn:
         await conn.execute(
             "UPDATE payments SET status = $1 WHERE id = $2",
             status, payment_id
         )
 
-async def update_payment_message_id(pool: asyncpg.Pool, payment_id: int, message_id: int):
-    async with pool.acquire() as conn:
+async def update_payment_message_id(db: Executor, payment_id: int, message_id: int):
+    async with acquire(db) as conn:
         await conn.execute(
             "UPDATE payments SET message_id = $1 WHERE id = $2",
             message_id, payment_id
         )
 
-async def get_payment_info(pool: asyncpg.Pool, payment_id: int) -> Optional[Dict]:
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT user_id, course_id, message_id, status FROM payments WHERE id = $1",
-            payment_id
-        )
+async def get_payment_info(db: Executor, payment_id: int) -> Optional[Dict]:
+    async with acquire(db) as conn:
+        row = await conn.fetchrow(_GET_PAYMENT_INFO, payment_id)
         return dict(row) if row else None
 
-async def get_user_payment_history(pool: asyncpg.Pool, user_id: int) -> List[Dict]:
-    async with pool.acquire() as conn:
+async def cancel_expired_payments(db: Executor, limit: int) -> List[Dict]:
+    # SKIP LOCKED позволяет нескольким процессам разбирать просроченные счета параллельно
+    async with acquire(db) as conn:
         rows = await conn.fetch(
             """
-            SELECT p.amount, p.status, p.payment_date, c.title
-            FROM payments p
-            JOIN courses c ON p.course_id = c.id
-            WHERE p.user_id = $1
-            ORDER BY p.payment_date DESC
+            UPDATE payments
+            SET status = 'canceled'
+            WHERE id IN (
+                SELECT id
+                FROM payments
+                WHERE status = 'pending' AND expires_at <= CURRENT_TIMESTAMP
+                ORDER BY expires_at
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            AND status = 'pending'
+            RETURNING id, user_id, message_id
             """,
-            user_id
+            limit
         )
         return [dict(row) for row in rows]
+
+async def complete_payment(
+    db: Executor, payment_id: int, telegram_payment_charge_id: str
+) -> Optional[Dict]:
+    # Один запрос: перевод в succeeded, выдача доступа и данные для уведомления.
+    # 'canceled' тоже допускаем: деньги уже списаны, даже если счет успел истечь.
+    # Повтор с тем же charge_id вернет строку с is_new = FALSE и ничего не изменит.
+    async with acquire(db) as conn:
+        try:
+            # Точка сохранения: в транзакции обновления ошибка уникальности иначе
+            # оборвала бы и ее, и повторный запрос ниже
+            async with conn.transaction():
+                row = await conn.fetchrow(
+                    """
+                    WITH updated AS (
+                        UPDATE payments
+                        SET status = 'succeeded', telegram_payment_charge_id = $2
+                        WHERE id = $1 AND status IN ('pending', 'canceled')
+                        RETURNING user_id, course_id
+                    ),
+                    granted AS (
+                        INSERT INTO user_courses (user_id, course_id)
+                        SELECT user_id, course_id FROM updated
+                        ON CONFLICT (user_id, course_id) DO NOTHING
+                    )
+                    SELECT p.user_id, p.course_id,
+                           EXISTS (SELECT 1 FROM updated) AS is_new,
+                           c.title AS course_title,
+                           u.username, u.full_name
+                    FROM payments p
+                    JOIN courses c ON c.id = p.course_id
+                    JOIN users u ON u.user_id = p.user_id
+                    WHERE p.id = $1
+                      AND (EXISTS (SELECT 1 FROM updated) OR p.telegram_payment_charge_id = $2)
+                    """,
+                    payment_id, telegram_payment_charge_id
+                )
+        except asyncpg.UniqueViolationError:
+            row = None
+        if row is None:
+            # Параллельный дубль того же successful_payment успел записать charge_id:
+            # он упирается в уникальный индекс или не виден снимку запроса выше.
+            # Свежий запрос видит его коммит — платеж уже обработан
+            row = await conn.fetchrow(_GET_PROCESSED_PAYMENT, telegram_payment_charge_id)
+        return dict(row) if row else None
+
+async def get_user_payment_history(db: Executor, user_id: int) -> List[Dict]:
+    async with acquire(db) as conn:
+        rows = await conn.fetch(_GET_PAYMENT_HISTORY, user_id)
+        return [dict(row) for row in rows]
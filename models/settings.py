@@ -1,16 +1,121 @@
+import asyncio
+import logging
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional
 import asyncpg
 
-async def get_setting(pool: asyncpg.Pool, key: str) -> str | None:
-    query = "SELECT value FROM settings WHERE key = $1"
-    result = await pool.fetchval(query, key)
-    return result
+from database import Executor, acquire, shared_executor
 
+SETTINGS_CHANNEL = "settings_changed"
+WELCOME_MESSAGE = "welcome_message"
 
-async def set_setting(pool: asyncpg.Pool, key: str, value: str):
+
+class Template:
+    # Шаблон разбирается один раз при загрузке настроек: подстановка имени —
+    # это склейка готовых кусков, без поиска плейсхолдера в строке
+    __slots__ = ("source", "_parts")
+
+    def __init__(self, source: str, placeholder: str = "{user_name}"):
+        self.source = source
+        self._parts = source.split(placeholder)
+
+    def render(self, user_name: str) -> str:
+        return user_name.join(self._parts)
+
+
+class SettingsSnapshot(NamedTuple):
+    version: int
+    values: Mapping[str, str]
+    welcome_message: Optional[Template]
+
+
+def _build_snapshot(version: int, values: dict) -> SettingsSnapshot:
+    welcome = values.get(WELCOME_MESSAGE)
+    return SettingsSnapshot(
+        version=version,
+        values=MappingProxyType(values),
+        welcome_message=Template(welcome) if welcome else None,
+    )
+
+
+# --- Снимок настроек в памяти ---
+# Настройки меняются раз в месяц, а читаются на каждый /start: держим их целиком
+# в неизменяемом снимке и подменяем его одной операцией. Другие процессы узнают
+# об изменении через NOTIFY и перечитывают таблицу.
+class _SettingsRegistry:
+    def __init__(self):
+        self.version = 0
+        self.snapshot: Optional[SettingsSnapshot] = None
+        self.db: Optional[Executor] = None
+        self.lock = asyncio.Lock()
+
+
+_registry = _SettingsRegistry()
+
+
+async def load_settings(db: Executor) -> SettingsSnapshot:
+    # Для перечитывания по NOTIFY запоминаем только пул: ConnectionScope обработчика
+    # к тому времени уже закрыт
+    if isinstance(db, asyncpg.Pool):
+        _registry.db = db
+    async with _registry.lock:
+        version = _registry.version
+        async with acquire(shared_executor(db)) as conn:
+            rows = await conn.fetch("SELECT key, value FROM settings")
+        snapshot = _build_snapshot(version, {row["key"]: row["value"] for row in rows})
+        # Если во время загрузки настройка изменилась, свежее значение уже в снимке
+        if version == _registry.version:
+            _registry.snapshot = snapshot
+        return _registry.snapshot or snapshot
+
+
+def on_settings_notify(conn, pid, channel, payload):
+    _registry.version += 1
+    if _registry.db is not None:
+        asyncio.create_task(_reload())
+    else:
+        # Пул не передавали — перечитаем при следующем обращении
+        _registry.snapshot = None
+
+
+async def _reload():
+    try:
+        await load_settings(_registry.db)
+    except Exception as e:
+        logging.error(f"Не удалось перечитать настройки: {e}", exc_info=True)
+
+
+async def get_settings(db: Executor) -> SettingsSnapshot:
+    snapshot = _registry.snapshot
+    if snapshot is not None:
+        return snapshot
+    return await load_settings(db)
+
+
+async def get_setting(db: Executor, key: str) -> str | None:
+    snapshot = await get_settings(db)
+    return snapshot.values.get(key)
+
+
+async def set_setting(db: Executor, key: str, value: str):
     query = """
-        INSERT INTO settings (key, value)
-        VALUES ($1, $2)
-        ON CONFLICT (key) DO UPDATE
-        SET value = EXCLUDED.value;
+        WITH upserted AS (
+            INSERT INTO settings (key, value)
+            VALUES ($1, $2)
+            ON CONFLICT (key) DO UPDATE
+            SET value = EXCLUDED.value
+            RETURNING key
+        )
+        SELECT pg_notify($3, key) FROM upserted
     """
-    await pool.execute(query, key, value)
+    async with acquire(db) as conn:
+        await conn.execute(query, key, value, SETTINGS_CHANNEL)
+
+    # Свой процесс обновляем сразу, не дожидаясь NOTIFY
+    _registry.version += 1
+    current = _registry.snapshot
+    if current is None:
+        return
+    values = dict(current.values)
+    values[key] = value
+    _registry.snapshot = _build_snapshot(_registry.version, values)
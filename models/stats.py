@@ -1,22 +1,48 @@
-from typing import Dict
-import asyncpg
+from typing import Dict, List
 
-async def get_main_stats(pool: asyncpg.Pool) -> Dict:
-    async with pool.acquire() as conn:
+from database import Executor, acquire
+
+async def get_main_stats(db: Executor) -> Dict:
+    # Читаем готовые счетчики из stats_counters/stats_daily (см. 004_stats_rollup.sql)
+    async with acquire(db) as conn:
         query = """
         SELECT
-            (SELECT COUNT(*) FROM users) AS users_count,
-            (SELECT COUNT(*) FROM user_courses) AS purchases_count,
-            (SELECT COUNT(*) FROM payments WHERE status = 'succeeded') AS successful_payments_count,
-            (SELECT SUM(amount) FROM payments WHERE status = 'succeeded') AS total_revenue,
-            (SELECT COUNT(*) FROM courses) AS active_courses_count
+            (SELECT value FROM stats_counters WHERE key = 'users_count') AS users_count,
+            (SELECT value FROM stats_counters WHERE key = 'purchases_count') AS purchases_count,
+            (SELECT value FROM stats_counters WHERE key = 'successful_payments_count') AS successful_payments_count,
+            (SELECT value FROM stats_counters WHERE key = 'total_revenue') AS total_revenue,
+            (SELECT value FROM stats_counters WHERE key = 'active_courses_count') AS active_courses_count,
+            (SELECT payments_count FROM stats_daily WHERE day = CURRENT_DATE) AS today_payments_count,
+            (SELECT revenue FROM stats_daily WHERE day = CURRENT_DATE) AS today_revenue
         """
         stats_row = await conn.fetchrow(query)
 
     return {
-        "users_count": stats_row['users_count'] or 0,
-        "purchases_count": stats_row['purchases_count'] or 0,
-        "successful_payments_count": stats_row['successful_payments_count'] or 0,
+        "users_count": int(stats_row['users_count'] or 0),
+        "purchases_count": int(stats_row['purchases_count'] or 0),
+        "successful_payments_count": int(stats_row['successful_payments_count'] or 0),
         "total_revenue": float(stats_row['total_revenue'] or 0.0),
-        "active_courses_count": stats_row['active_courses_count'] or 0,
+        "active_courses_count": int(stats_row['active_courses_count'] or 0),
+        "today_payments_count": int(stats_row['today_payments_count'] or 0),
+        "today_revenue": float(stats_row['today_revenue'] or 0.0),
     }
+
+async def get_top_courses_by_revenue(db: Executor, limit: int) -> List[Dict]:
+    async with acquire(db) as conn:
+        rows = await conn.fetch(
+            """
+            SELECT c.title, s.payments_count, s.revenue
+            FROM stats_course_revenue s
+            JOIN courses c ON c.id = s.course_id
+            WHERE s.payments_count > 0
+            ORDER BY s.revenue DESC
+            LIMIT $1
+            """,
+            limit
+        )
+        return [dict(row) for row in rows]
+
+async def recompute_stats(db: Executor):
+    async with acquire(db) as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT stats_recompute()")
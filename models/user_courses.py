@@ -1,8 +1,16 @@
 from typing import List, Dict
-import asyncpg
 
-async def add_user_course(pool: asyncpg.Pool, user_id: int, course_id: int):
-    async with pool.acquire() as conn:
+from database import Executor, acquire
+
+_GET_USER_COURSES = """
+    SELECT c.title, c.materials_link
+    FROM user_courses uc
+    JOIN courses c ON uc.course_id = c.id
+    WHERE uc.user_id = $1
+    """
+
+async def add_user_course(db: Executor, user_id: int, course_id: int):
+    async with acquire(db) as conn:
         await conn.execute(
             """
             INSERT INTO user_courses (user_id, course_id)
@@ -12,15 +20,7 @@ async def add_user_course(pool: asyncpg.Pool, user_id: int, course_id: int):
             user_id, course_id
         )
 
-async def get_user_courses_with_details(pool: asyncpg.Pool, user_id: int) -> List[Dict]:
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-            SELECT c.title, c.materials_link
-            FROM user_courses uc
-            JOIN courses c ON uc.course_id = c.id
-            WHERE uc.user_id = $1
-            """,
-            user_id
-        )
+async def get_user_courses_with_details(db: Executor, user_id: int) -> List[Dict]:
+    async with acquire(db) as conn:
+        rows = await conn.fetch(_GET_USER_COURSES, user_id)
         return [dict(row) for row in rows]
@@ -1,8 +1,13 @@
-from typing import List, Dict
-import asyncpg
+from datetime import datetime
+from typing import List, Optional, Tuple
 
-async def add_user(pool: asyncpg.Pool, user_id: int, username: str, full_name: str):
-    async with pool.acquire() as conn:
+from database import Executor, acquire
+from models.pagination import Page, build_page
+
+_GET_USER = "SELECT * FROM users WHERE user_id = $1"
+
+async def add_user(db: Executor, user_id: int, username: str, full_name: str):
+    async with acquire(db) as conn:
         await conn.execute(
             """
             INSERT INTO users (user_id, username, full_name)
@@ -12,27 +17,67 @@ async def add_user(pool: asyncpg.Pool, user_id: int, username: str, full_name: s
             user_id, username, full_name
         )
 
-async def get_total_users_count(pool: asyncpg.Pool) -> int:
-    async with pool.acquire() as conn:
-        count = await conn.fetchval("SELECT COUNT(*) FROM users")
-        return count
+async def upsert_users(db: Executor, users: List[Tuple[int, Optional[str], Optional[str]]]):
+    # Пачка из RegistrationBuffer одним запросом. Строки перезаписываются,
+    # только если username или full_name действительно изменились
+    async with acquire(db) as conn:
+        await conn.execute(
+            """
+            INSERT INTO users (user_id, username, full_name)
+            SELECT * FROM unnest($1::bigint[], $2::text[], $3::text[])
+            ON CONFLICT (user_id) DO UPDATE
+            SET username = EXCLUDED.username,
+                full_name = EXCLUDED.full_name
+            WHERE (users.username, users.full_name)
+                IS DISTINCT FROM (EXCLUDED.username, EXCLUDED.full_name)
+            """,
+            [user_id for user_id, _, _ in users],
+            [username for _, username, _ in users],
+            [full_name for _, _, full_name in users],
+        )
+
+async def get_paginated_users(
+    db: Executor,
+    limit: int,
+    cursor: Optional[Tuple[datetime, int]] = None,
+    backward: bool = False,
+) -> Page:
+    # Ключ страницы: (registration_date, user_id), новые пользователи первыми.
+    # Число покупок считаем только для строк страницы через индекс user_courses.
+    if cursor is None:
+        where, order, args = "", "DESC", []
+    elif backward:
+        where, order, args = "WHERE (u.registration_date, u.user_id) > ($2, $3)", "ASC", list(cursor)
+    else:
+        where, order, args = "WHERE (u.registration_date, u.user_id) < ($2, $3)", "DESC", list(cursor)
 
-async def get_paginated_users(pool: asyncpg.Pool, limit: int, offset: int) -> List[Dict]:
-    async with pool.acquire() as conn:
+    async with acquire(db) as conn:
         rows = await conn.fetch(
-            """
-            SELECT u.user_id, u.username, u.full_name, COUNT(uc.course_id) AS courses_purchased
+            f"""
+            SELECT u.user_id, u.username, u.full_name, u.registration_date, uc.courses_purchased
             FROM users u
-            LEFT JOIN user_courses uc ON u.user_id = uc.user_id
-            GROUP BY u.user_id
-            ORDER BY u.registration_date DESC
-            LIMIT $1 OFFSET $2
+            CROSS JOIN LATERAL (
+                SELECT COUNT(*) AS courses_purchased
+                FROM user_courses
+                WHERE user_id = u.user_id
+            ) uc
+            {where}
+            ORDER BY u.registration_date {order}, u.user_id {order}
+            LIMIT $1
             """,
-            limit, offset
+            limit + 1, *args
+        )
+    return build_page([dict(row) for row in rows], limit, backward, has_cursor=cursor is not None)
+
+async def get_user_ids_after(db: Executor, after_user_id: int, limit: int) -> List[int]:
+    # Очередная пачка получателей рассылки по первичному ключу
+    async with acquire(db) as conn:
+        rows = await conn.fetch(
+            "SELECT user_id FROM users WHERE user_id > $1 ORDER BY user_id LIMIT $2",
+            after_user_id, limit
         )
-        return [dict(row) for row in rows]
+        return [row["user_id"] for row in rows]
 
-async def get_user(pool: asyncpg.Pool, user_id: int):
-    async with pool.acquire() as connection:
-        query = "SELECT * FROM users WHERE user_id = $1"
-        return await connection.fetchrow(query, user_id)
+async def get_user(db: Executor, user_id: int):
+    async with acquire(db) as connection:
+        return await connection.fetchrow(_GET_USER, user_id)
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Dict, Optional
+import asyncpg
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+from aiogram.utils.markdown import hbold
+
+from keyboards.admin_kb import get_broadcast_status_kb
+from models import broadcasts as broadcasts_db
+from models import users as users_db
+from services.outbound import Priority, outbound_priority
+
+SENT = "sent"
+BLOCKED = "blocked"
+DEACTIVATED = "deactivated"
+FAILED = "failed"
+
+
+class BroadcastEngine:
+    def __init__(
+        self,
+        bot: Bot,
+        pool: asyncpg.Pool,
+        chunk_size: int = 200,
+        concurrency: int = 25,
+        lease_seconds: int = 120,
+        max_claims: int = 3,
+        status_interval: int = 5,
+    ):
+        self.bot = bot
+        self.pool = pool
+        self.chunk_size = chunk_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.lease_seconds = lease_seconds
+        self.max_claims = max_claims
+        self.status_interval = status_interval
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._watcher: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        if self._watcher is not None:
+            tasks.append(self._watcher)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def create(self, text: str, admin_chat_id: int, total_count: int) -> int:
+        broadcast = await broadcasts_db.create_broadcast(
+            self.pool, text, admin_chat_id, total_count, uuid.uuid4().hex
+        )
+        self._spawn(broadcast)
+        return broadcast["id"]
+
+    async def _watch(self):
+        # Подхватываем рассылки, брошенные упавшими или перезапущенными процессами
+        while True:
+            try:
+                await self._fail_exhausted()
+                while True:
+                    broadcast = await broadcasts_db.claim_stale_broadcast(
+                        self.pool,
+                        self.lease_seconds,
+                        uuid.uuid4().hex,
+                        list(self._tasks),
+                        self.max_claims,
+                    )
+                    if not broadcast:
+                        break
+                    logging.info(f"Продолжаем рассылку #{broadcast['id']} с чекпоинта.")
+                    self._spawn(broadcast)
+            except Exception as e:
+                logging.error(f"Ошибка при поиске прерванных рассылок: {e}", exc_info=True)
+            await asyncio.sleep(self.lease_seconds)
+
+    async def _fail_exhausted(self):
+        for broadcast in await broadcasts_db.fail_exhausted_broadcasts(
+            self.pool, self.lease_seconds, self.max_claims
+        ):
+            logging.error(
+                f"Рассылка #{broadcast['id']} брошена после {broadcast['claim_count']} перехватов."
+            )
+            try:
+                with outbound_priority(Priority.ADMIN):
+                    await self.bot.send_message(
+                        broadcast["admin_chat_id"],
+                        f"⚠️ Рассылка #{broadcast['id']} остановлена: процессы, которые "
+                        f"ее вели, падали {broadcast['claim_count']} раз подряд.",
+                    )
+            except Exception as e:
+                logging.warning(f"Не удалось сообщить о сбое рассылки #{broadcast['id']}: {e}")
+
+    def _spawn(self, broadcast: Dict):
+        if broadcast["id"] in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast))
+        self._tasks[broadcast["id"]] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast["id"], None))
+
+    async def _run(self, broadcast: Dict):
+        broadcast_id = broadcast["id"]
+        counters = {
+            SENT: broadcast["sent_count"],
+            BLOCKED: broadcast["blocked_count"],
+            DEACTIVATED: broadcast["deactivated_count"],
+            FAILED: broadcast["failed_count"],
+        }
+        last_user_id = broadcast["last_user_id"]
+        started_at = time.monotonic()
+        processed_at_start = sum(counters.values())
+        status_updated_at = 0.0
+        heartbeat = asyncio.create_task(
+            self._heartbeat(broadcast_id, broadcast["lease_token"], asyncio.current_task())
+        )
+
+        try:
+            if not broadcast["status_message_id"]:
+                try:
+                    await self._create_status_message(broadcast)
+                except Exception as e:
+                    # Без сообщения о прогрессе рассылка все равно доходит до пользователей
+                    logging.warning(f"Не удалось отправить статус рассылки #{broadcast_id}: {e}")
+
+            while True:
+                user_ids = await users_db.get_user_ids_after(
+                    self.pool, last_user_id, self.chunk_size
+                )
+                if not user_ids:
+                    break
+
+                results = await asyncio.gather(
+                    *(self._send(user_id, broadcast["text"]) for user_id in user_ids)
+                )
+                chunk = {key: results.count(key) for key in counters}
+                for key, value in chunk.items():
+                    counters[key] += value
+                last_user_id = user_ids[-1]
+
+                status = await broadcasts_db.save_broadcast_progress(
+                    self.pool,
+                    broadcast_id,
+                    last_user_id,
+                    chunk[SENT],
+                    chunk[BLOCKED],
+                    chunk[DEACTIVATED],
+                    chunk[FAILED],
+                    broadcast["lease_token"],
+                )
+                if status is None:
+                    logging.warning(f"Рассылку #{broadcast_id} перехватил другой процесс, останавливаемся.")
+                    return
+                if status != "running":
+                    await self._update_status(broadcast, counters, started_at, processed_at_start, "🛑 Остановлена")
+                    return
+
+                if time.monotonic() - status_updated_at >= self.status_interval:
+                    await self._update_status(broadcast, counters, started_at, processed_at_start)
+                    status_updated_at = time.monotonic()
+
+            await broadcasts_db.finish_broadcast(self.pool, broadcast_id, broadcast["lease_token"])
+            await self._update_status(broadcast, counters, started_at, processed_at_start, "✅ Завершена")
+            logging.info(f"Рассылка #{broadcast_id} завершена: {counters}")
+        except asyncio.CancelledError:
+            # Процесс останавливается: чекпоинт уже в БД, рассылку продолжит следующий запуск
+            raise
+        except Exception as e:
+            logging.error(f"Рассылка #{broadcast_id} прервана: {e}", exc_info=True)
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, broadcast_id: int, lease_token: str, runner: asyncio.Task):
+        # Аренда продлевается по таймеру, а не на чекпоинтах: чанк может идти дольше
+        # lease_seconds, если BULK-отправки вытесняет пользовательский трафик или
+        # _send ждет retry_after
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await broadcasts_db.renew_broadcast_lease(
+                    self.pool, broadcast_id, lease_token
+                )
+            except Exception as e:
+                logging.warning(f"Не удалось продлить аренду рассылки #{broadcast_id}: {e}")
+                continue
+            if not renewed:
+                # Рассылку уже ведет другой процесс — не шлем тем же пользователям второй раз
+                logging.warning(f"Аренда рассылки #{broadcast_id} потеряна, останавливаемся.")
+                runner.cancel()
+                return
+
+    async def _send(self, user_id: int, text: str) -> str:
+        async with self.semaphore:
+            with outbound_priority(Priority.BULK):
+                for _ in range(3):
+                    try:
+                        await self.bot.send_message(user_id, text)
+                        return SENT
+                    except TelegramRetryAfter as e:
+                        # OutboundLimiter уже выждал свои повторы, ждем еще и пробуем снова
+                        await asyncio.sleep(e.retry_after)
+                    except TelegramForbiddenError as e:
+                        if "deactivated" in e.message:
+                            return DEACTIVATED
+                        return BLOCKED
+                    except TelegramBadRequest:
+                        # chat not found и подобное — пользователь недоступен
+                        return FAILED
+                    except Exception as e:
+                        logging.warning(f"Не удалось отправить рассылку {user_id}: {e}")
+                        return FAILED
+                return FAILED
+
+    async def _create_status_message(self, broadcast: Dict):
+        with outbound_priority(Priority.ADMIN):
+            message = await self.bot.send_message(
+                broadcast["admin_chat_id"],
+                f"📣 {hbold('Рассылка #' + str(broadcast['id']))} запускается...",
+                reply_markup=get_broadcast_status_kb(broadcast["id"]),
+            )
+        broadcast["status_message_id"] = message.message_id
+        await broadcasts_db.set_broadcast_status_message(
+            self.pool, broadcast["id"], message.message_id
+        )
+
+    async def _update_status(
+        self,
+        broadcast: Dict,
+        counters: Dict[str, int],
+        started_at: float,
+        processed_at_start: int,
+        final_status: Optional[str] = None,
+    ):
+        processed = sum(counters.values())
+        total = max(broadcast["total_count"], processed)
+        elapsed = time.monotonic() - started_at
+        rate = (processed - processed_at_start) / elapsed if elapsed > 0 else 0.0
+
+        text = (
+            f"📣 {hbold('Рассылка #' + str(broadcast['id']))}\n\n"
+            f"📬 {hbold('Обработано:')} {processed} из {total}\n"
+            f"✅ {hbold('Доставлено:')} {counters[SENT]}\n"
+            f"🚫 {hbold('Заблокировали бота:')} {counters[BLOCKED]}\n"
+            f"👻 {hbold('Удаленные аккаунты:')} {counters[DEACTIVATED]}\n"
+            f"⚠️ {hbold('Ошибки:')} {counters[FAILED]}\n"
+            f"⚡ {hbold('Скорость:')} {rate:.1f} сообщ./с\n"
+        )
+        if final_status:
+            text += f"\n{hbold('Статус:')} {final_status}"
+            reply_markup = None
+        else:
+            eta = (total - processed) / rate if rate > 0 else 0
+            text += f"⏳ {hbold('Осталось примерно:')} {int(eta // 60)} мин {int(eta % 60)} с"
+            reply_markup = get_broadcast_status_kb(broadcast["id"])
+
+        if not broadcast["status_message_id"]:
+            return
+        try:
+            with outbound_priority(Priority.ADMIN):
+                await self.bot.edit_message_text(
+                    text,
+                    chat_id=broadcast["admin_chat_id"],
+                    message_id=broadcast["status_message_id"],
+                    reply_markup=reply_markup,
+                )
+        except Exception as e:
+            logging.warning(f"Не удалось обновить статус рассылки #{broadcast['id']}: {e}")
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+import asyncpg
+from aiogram import Bot
+from aiogram.utils.markdown import hbold
+
+from models import payments as payments_db
+
+
+class InvoiceExpiryScheduler:
+    def __init__(
+        self,
+        bot: Bot,
+        pool: asyncpg.Pool,
+        interval: int = 30,
+        batch_size: int = 100,
+        concurrency: int = 10,
+    ):
+        self.bot = bot
+        self.pool = pool
+        self.interval = interval
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        logging.info("Планировщик отмены просроченных счетов запущен.")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                canceled = await self.sweep()
+                if canceled:
+                    logging.info(f"Отменено просроченных счетов: {canceled}")
+            except Exception as e:
+                logging.error(f"Ошибка при отмене просроченных счетов: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self) -> int:
+        total = 0
+        while True:
+            expired = await payments_db.cancel_expired_payments(self.pool, self.batch_size)
+            if not expired:
+                break
+            await asyncio.gather(*(self._notify(payment) for payment in expired))
+            total += len(expired)
+            if len(expired) < self.batch_size:
+                break
+        return total
+
+    async def _notify(self, payment: Dict):
+        chat_id = payment["user_id"]
+        async with self.semaphore:
+            if payment["message_id"]:
+                try:
+                    await self.bot.delete_message(
+                        chat_id=chat_id, message_id=payment["message_id"]
+                    )
+                except Exception as e:
+                    logging.warning(
+                        f"Не удалось удалить счет (payment_id: {payment['id']}): {e}"
+                    )
+            try:
+                await self.bot.send_message(
+                    chat_id=chat_id,
+                    text=f"❌ {hbold('Время для оплаты истекло!')}\n\nДля покупки курса, пожалуйста, создайте новый счет.",
+                )
+            except Exception as e:
+                logging.error(
+                    f"Не удалось обработать истекший счет (payment_id: {payment['id']}): {e}"
+                )
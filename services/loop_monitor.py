@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+from aiohttp import web
+
+from config import LOOP_MONITOR_INTERVAL, LOOP_STALL_THRESHOLD, LOOP_STALL_INCIDENTS
+from services.metrics import LOOP_LAG, LOOP_STALLS
+
+
+class LoopMonitor:
+    # Задержка event loop: насколько позже запланированного просыпается sleep.
+    # Если она растет, кто-то держит loop синхронной работой и все обработчики стоят.
+    # Пока loop заблокирован, сам он ничего сделать не может, поэтому стек
+    # виновника снимает сторожевой поток, который видит, что пульс loop остановился.
+    def __init__(
+        self,
+        interval: float = 0.1,
+        stall_threshold: float = 0.5,
+        max_incidents: int = 20,
+        window: int = 3000,
+    ):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.max_incidents = max_incidents
+        self.lag = 0.0
+        self.samples: Deque[float] = deque(maxlen=window)
+        # Худшие задержки со стеками, по убыванию длительности
+        self.incidents: List[Dict] = []
+        self._heartbeat = time.monotonic()
+        self._captured_stack: Optional[List[str]] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        LOOP_LAG.set_function(lambda: self.lag)
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            self.lag = max(0.0, now - started - self.interval)
+            self.samples.append(self.lag)
+
+            stack = self._captured_stack
+            if stack is not None:
+                self._captured_stack = None
+                self._record_incident(stack)
+
+    def _watch(self):
+        # Отдельный поток: GIL отпускается и при синхронной работе в loop,
+        # так что он успевает проснуться и снять стек главного потока
+        while not self._stopped.wait(self.interval):
+            stalled = time.monotonic() - self._heartbeat
+            if stalled < self.stall_threshold or self._captured_stack is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self._captured_stack = traceback.format_stack(frame)
+            logging.warning(
+                f"Event loop заблокирован уже {stalled:.2f} с, стек:\n"
+                + "".join(self._captured_stack[-10:])
+            )
+
+    def _record_incident(self, stack: List[str]):
+        LOOP_STALLS.inc()
+        logging.warning(f"Event loop был заблокирован на {self.lag:.2f} с")
+        self.incidents.append(
+            {
+                "at": datetime.now().isoformat(timespec="seconds"),
+                "lag": self.lag,
+                "stack": stack,
+            }
+        )
+        self.incidents.sort(key=lambda incident: incident["lag"], reverse=True)
+        del self.incidents[self.max_incidents:]
+
+    def get_percentiles(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {}
+
+        def percentile(q: float) -> float:
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+        return {
+            "samples": len(ordered),
+            "p50_ms": percentile(0.5) * 1000,
+            "p90_ms": percentile(0.9) * 1000,
+            "p99_ms": percentile(0.99) * 1000,
+            "max_ms": ordered[-1] * 1000,
+        }
+
+
+async def loop_lag_handler(request: web.Request) -> web.Response:
+    return web.json_response(
+        {
+            "interval_ms": loop_monitor.interval * 1000,
+            "stall_threshold_ms": loop_monitor.stall_threshold * 1000,
+            "lag": loop_monitor.get_percentiles(),
+            "incidents": [
+                {"at": incident["at"], "lag_ms": incident["lag"] * 1000}
+                for incident in loop_monitor.incidents
+            ],
+        }
+    )
+
+
+loop_monitor = LoopMonitor(
+    interval=LOOP_MONITOR_INTERVAL,
+    stall_threshold=LOOP_STALL_THRESHOLD,
+    max_incidents=LOOP_STALL_INCIDENTS,
+)
@@ -0,0 +1,71 @@
+import time
+from contextlib import contextmanager
+
+import asyncpg
+from aiohttp import web
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+# --- Обработка обновлений ---
+UPDATES = Counter("bot_updates_total", "Входящие обновления по типам", ["type"])
+HANDLER_LATENCY = Histogram(
+    "bot_handler_latency_seconds", "Время работы обработчика", ["router", "handler"]
+)
+THROTTLED = Counter("bot_throttled_total", "Обновления, отброшенные троттлингом", ["type"])
+HANDLERS_IN_FLIGHT = Gauge("bot_handlers_in_flight", "Обновлений в обработке")
+SHED = Counter(
+    "bot_shed_total", "Обновления, отклоненные из-за перегрузки", ["type", "reason"]
+)
+LOOP_LAG = Gauge("bot_event_loop_lag_seconds", "Последняя измеренная задержка event loop")
+LOOP_STALLS = Counter("bot_event_loop_stalls_total", "Блокировки event loop дольше порога")
+CHAT_QUEUES = Gauge("bot_chat_queues", "Чатов с обновлениями в обработке или в очереди")
+
+# --- База данных ---
+DB_POOL_SIZE = Gauge("bot_db_pool_size", "Открытых соединений в пуле")
+DB_POOL_IDLE = Gauge("bot_db_pool_idle", "Свободных соединений в пуле")
+DB_POOL_MAX_SIZE = Gauge("bot_db_pool_max_size", "Максимальный размер пула")
+DB_POOL_WAITERS = Gauge("bot_db_pool_waiters", "Ожидающих соединение из пула")
+DB_QUERY_LATENCY = Histogram(
+    "bot_db_query_latency_seconds",
+    "Время выполнения запроса по функциям models/*",
+    ["function"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_QUERY_ERRORS = Counter("bot_db_query_errors_total", "Запросы, завершившиеся ошибкой", ["function"])
+DB_QUERY_ROWS = Counter("bot_db_query_rows_total", "Строк прочитано или изменено", ["function"])
+
+# --- Bot API ---
+OUTBOUND_LATENCY = Histogram(
+    "bot_outbound_latency_seconds", "Время ответа Bot API", ["method"]
+)
+OUTBOUND_ERRORS = Counter(
+    "bot_outbound_errors_total", "Ошибки запросов к Bot API", ["method", "error"]
+)
+
+
+def register_pool(pool: asyncpg.Pool):
+    # Размеры пула читаются в момент запроса /metrics
+    DB_POOL_SIZE.set_function(pool.get_size)
+    DB_POOL_IDLE.set_function(pool.get_idle_size)
+    DB_POOL_MAX_SIZE.set_function(pool.get_max_size)
+
+
+@contextmanager
+def observe_outbound(method: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        OUTBOUND_ERRORS.labels(method, type(e).__name__).inc()
+        raise
+    finally:
+        OUTBOUND_LATENCY.labels(method).observe(time.perf_counter() - started)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
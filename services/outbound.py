@@ -0,0 +1,337 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from config import (
+    BOT_WORKERS,
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_CONCURRENCY,
+    OUTBOUND_MAX_RETRIES,
+    OUTBOUND_MAX_DELAY,
+    OUTBOUND_LANE_SIZE,
+    OUTBOUND_LANE_WORKERS,
+)
+from services.metrics import observe_outbound
+
+
+class Priority(IntEnum):
+    USER = 0  # ответы пользователям
+    ADMIN = 1  # уведомления администраторам
+    BULK = 2  # рассылки
+
+
+_priority: ContextVar[Priority] = ContextVar("outbound_priority", default=Priority.USER)
+
+
+@contextmanager
+def outbound_priority(priority: Priority):
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+# Сколько разных чатов должны получить 429 за окно, чтобы считать ограничение общим
+FLOOD_CHATS = 3
+FLOOD_WINDOW = 1.0
+# Как часто из памяти убираются бакеты чатов, которые уже полностью восстановились
+CHAT_BUCKETS_SWEEP_INTERVAL = 60
+
+
+class OutboundOverloaded(Exception):
+    # Ответ пришлось бы ждать дольше OUTBOUND_MAX_DELAY — он сброшен, не отправлен
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        # Во время паузы после 429 лежит в будущем: токены начисляются с ее конца
+        self.updated = time.monotonic()
+
+    def reserve(self, max_delay: Optional[float] = None) -> Optional[float]:
+        # Токен забирается сразу (баланс может уйти в минус),
+        # а вызывающий ждет возвращенное число секунд — так сохраняется FIFO.
+        # Если ждать пришлось бы дольше max_delay, токен не забирается и возвращается None
+        now = time.monotonic()
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        delay = self.updated - now + max(0.0, 1 - self.tokens) / self.rate
+        if max_delay is not None and delay > max_delay:
+            return None
+        self.tokens -= 1
+        return delay
+
+    def pause(self, seconds: float):
+        until = time.monotonic() + seconds
+        if until > self.updated:
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = until
+
+    def is_idle(self, now: float) -> bool:
+        # Полный бакет без паузы ничем не отличается от нового — его можно забыть
+        return now >= self.updated and (
+            self.tokens + (now - self.updated) * self.rate >= self.capacity
+        )
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        concurrency: int = 20,
+        max_retries: int = 3,
+        max_delay: float = 5,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        # Бакеты не вытесняются по времени: иначе чат, исчерпавший лимит, получал бы
+        # его заново. Удаляются только восстановившиеся (см. _chat_bucket)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self._swept_at = time.monotonic()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_retries = max_retries
+        self.max_delay = max_delay
+        self._flood: Deque[Tuple[float, int]] = deque()
+
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self.waiting_for_chat = 0
+        self.sent = 0
+        self.errors = 0
+        self.retries = 0
+        self.shed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def get_stats(self) -> Dict:
+        return {
+            "queue_depth": len(self._waiters) + self.waiting_for_chat,
+            "sent": self.sent,
+            "errors": self.errors,
+            "retries": self.retries,
+            "shed": self.shed,
+            "avg_latency_ms": self.latency_total / self.sent * 1000 if self.sent else 0.0,
+            "max_latency_ms": self.latency_max * 1000,
+        }
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        # answerCallbackQuery, answerPreCheckoutQuery, getUpdates и т.п. не адресованы
+        # чату, под лимиты рассылки не попадают и должны уходить без задержек
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            with observe_outbound(method.__api_method__):
+                return await make_request(bot, method)
+
+        priority = _priority.get()
+        # Ответ пользователю ждут прямо в обработчике, который держит блокировку чата,
+        # слот конкурентности и соединение с базой, — долгую очередь для него не копим.
+        # Фоновые отправки (рассылки, OutboundLane) ждут сколько нужно
+        max_delay = self.max_delay if priority == Priority.USER else None
+
+        attempt = 0
+        while True:
+            await self._wait_for_chat(chat_id, max_delay)
+            await self._wait_for_global(priority, max_delay)
+            retry_after = None
+            async with self.semaphore:
+                started = time.monotonic()
+                try:
+                    with observe_outbound(method.__api_method__):
+                        response = await make_request(bot, method)
+                except TelegramRetryAfter as e:
+                    self.retries += 1
+                    retry_after = e.retry_after
+                    self._on_retry_after(chat_id, retry_after)
+                    if attempt >= self.max_retries:
+                        self.errors += 1
+                        raise
+                except Exception:
+                    self.errors += 1
+                    raise
+                else:
+                    self._record_latency(time.monotonic() - started)
+                    return response
+
+            attempt += 1
+            logging.warning(
+                f"Telegram ограничил отправку ({method.__api_method__}), повтор через {retry_after} с."
+            )
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        now = time.monotonic()
+        if now - self._swept_at > CHAT_BUCKETS_SWEEP_INTERVAL:
+            self._swept_at = now
+            self.chat_buckets = {
+                key: bucket for key, bucket in self.chat_buckets.items() if not bucket.is_idle(now)
+            }
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _shed(self):
+        self.shed += 1
+        raise OutboundOverloaded()
+
+    async def _wait_for_chat(self, chat_id, max_delay: Optional[float]):
+        delay = self._chat_bucket(chat_id).reserve(max_delay)
+        if delay is None:
+            self._shed()
+        if delay:
+            self.waiting_for_chat += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.waiting_for_chat -= 1
+
+    async def _wait_for_global(self, priority: Priority, max_delay: Optional[float]):
+        if max_delay is not None:
+            # Оценка снизу: пауза после общего 429 плюс очередь не ниже этого приоритета
+            ahead = sum(1 for waiter in self._waiters if waiter[0] <= priority)
+            expected = max(0.0, self._paused_until - time.monotonic())
+            if expected + ahead / self.global_bucket.rate > max_delay:
+                self._shed()
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        # Единственный потребитель глобального бакета: выдает токены по приоритету
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            delay = self.global_bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+
+            # За время ожидания мог прийти запрос с более высоким приоритетом
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+    def _on_retry_after(self, chat_id, seconds: float):
+        # Обычно 429 относится к одному чату — ждет только он. Если за короткое окно
+        # 429 получили несколько разных чатов, упираемся в общий лимит и ждут все
+        self._chat_bucket(chat_id).pause(seconds)
+
+        now = time.monotonic()
+        self._flood.append((now, chat_id))
+        while self._flood and self._flood[0][0] < now - FLOOD_WINDOW:
+            self._flood.popleft()
+        if len({flooded for _, flooded in self._flood}) >= FLOOD_CHATS:
+            self._paused_until = max(self._paused_until, now + seconds)
+
+    def _record_latency(self, elapsed: float):
+        self.sent += 1
+        self.latency_total += elapsed
+        self.latency_max = max(self.latency_max, elapsed)
+
+
+class OutboundLane:
+    # Отправки, результат которых обработчику не нужен (уведомления администраторам):
+    # обработчик только кладет запрос в очередь и сразу освобождает блокировку чата,
+    # слот и соединение, а лимиты выжидают фоновые воркеры
+    def __init__(self, maxsize: int = 1000, workers: int = 2):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.workers_count = workers
+        self._workers: List[asyncio.Task] = []
+        self.dropped = 0
+
+    def submit(self, bot: Bot, method: TelegramMethod, priority: Priority = Priority.ADMIN) -> bool:
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._work()) for _ in range(self.workers_count)
+            ]
+        try:
+            self.queue.put_nowait((bot, method, priority))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logging.warning(f"Очередь фоновой отправки переполнена, {method.__api_method__} сброшен.")
+            return False
+        return True
+
+    async def _work(self):
+        while True:
+            bot, method, priority = await self.queue.get()
+            try:
+                with outbound_priority(priority):
+                    await bot(method)
+            except Exception as e:
+                logging.error(f"Ошибка фоновой отправки {method.__api_method__}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def close(self, timeout: float):
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Не отправлено фоновых сообщений: {self.queue.qsize()}.")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+# Общий лимит Telegram делится между воркерами; лимиты чатов остаются локальными,
+# потому что супервизор направляет пользователя всегда в один воркер
+limiter = OutboundLimiter(
+    global_rate=OUTBOUND_GLOBAL_RATE / BOT_WORKERS,
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_burst=OUTBOUND_CHAT_BURST,
+    concurrency=OUTBOUND_CONCURRENCY,
+    max_retries=OUTBOUND_MAX_RETRIES,
+    max_delay=OUTBOUND_MAX_DELAY,
+)
+lane = OutboundLane(maxsize=OUTBOUND_LANE_SIZE, workers=OUTBOUND_LANE_WORKERS)
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import random
+import re
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+import asyncpg
+
+from config import DB_SLOW_QUERY_MS, DB_EXPLAIN_SAMPLE_RATE
+from services.metrics import DB_QUERY_ERRORS, DB_QUERY_LATENCY, DB_QUERY_ROWS
+
+# Функция models/*, от имени которой сейчас выполняются запросы ("courses.get_catalog").
+# Выставляется в database.acquire(); запросы без метки (миграции, RESET пула) не учитываются.
+query_source: ContextVar[Optional[str]] = ContextVar("query_source", default=None)
+
+# Сколько последних замеров на функцию храним для перцентилей
+SAMPLES_PER_FUNCTION = 1000
+EXPLAIN_TIMEOUT_MS = 5000
+
+
+class FunctionStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=SAMPLES_PER_FUNCTION)
+        self.last_plan: Optional[str] = None
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class QueryProfiler:
+    def __init__(self, slow_ms: float = 200, explain_sample_rate: float = 0.0):
+        self.slow_seconds = slow_ms / 1000
+        self.explain_sample_rate = explain_sample_rate
+        self.functions: Dict[str, FunctionStats] = {}
+        self._pool: Optional[asyncpg.Pool] = None
+        self._explain_task: Optional[asyncio.Task] = None
+
+    def set_pool(self, pool: asyncpg.Pool):
+        # Пул нужен только для EXPLAIN: план снимается на отдельном соединении
+        self._pool = pool
+
+    def record(
+        self,
+        function: str,
+        query: str,
+        args: Sequence[Any],
+        elapsed: float,
+        rows: int,
+        error: bool = False,
+    ):
+        stats = self.functions.get(function)
+        if stats is None:
+            stats = self.functions[function] = FunctionStats()
+        stats.calls += 1
+        stats.rows += rows
+        stats.total += elapsed
+        stats.max = max(stats.max, elapsed)
+        stats.samples.append(elapsed)
+
+        DB_QUERY_LATENCY.labels(function).observe(elapsed)
+        DB_QUERY_ROWS.labels(function).inc(rows)
+        if error:
+            stats.errors += 1
+            DB_QUERY_ERRORS.labels(function).inc()
+
+        if elapsed >= self.slow_seconds:
+            stats.slow += 1
+            logging.warning(
+                f"Медленный запрос в {function}: {elapsed * 1000:.0f} мс, строк {rows}. "
+                f"{_compact(query)} | {_redact(args)}"
+            )
+            if not error and self._should_explain(query):
+                self._explain_task = asyncio.create_task(
+                    self._explain(function, query, args)
+                )
+
+    def _should_explain(self, query: str) -> bool:
+        if self._pool is None or random.random() >= self.explain_sample_rate:
+            return False
+        # Не больше одного EXPLAIN одновременно, чтобы не нагружать базу еще сильнее
+        if self._explain_task is not None and not self._explain_task.done():
+            return False
+        return query.lstrip().upper().startswith("SELECT")
+
+    async def _explain(self, function: str, query: str, args: Sequence[Any]):
+        # Этот запрос сам не должен попадать в статистику
+        query_source.set(None)
+        try:
+            async with self._pool.acquire() as conn:
+                # ANALYZE выполняет запрос: только чтение и всегда откат
+                transaction = conn.transaction(readonly=True)
+                await transaction.start()
+                try:
+                    await conn.execute(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+                    rows = await conn.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}", *args)
+                finally:
+                    await transaction.rollback()
+            plan = "\n".join(row[0] for row in rows)
+            self.functions[function].last_plan = plan
+            logging.info(f"План медленного запроса {function}:\n{plan}")
+        except Exception as e:
+            logging.warning(f"Не удалось получить план запроса {function}: {e}")
+
+    def get_report(self, limit: int = 15) -> List[Dict]:
+        # Функции, занявшие больше всего суммарного времени базы
+        top = sorted(self.functions.items(), key=lambda item: item[1].total, reverse=True)
+        return [
+            {
+                "function": function,
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "slow": stats.slow,
+                "total_ms": stats.total * 1000,
+                "avg_ms": stats.total / stats.calls * 1000,
+                "p50_ms": stats.percentile(0.5) * 1000,
+                "p95_ms": stats.percentile(0.95) * 1000,
+                "max_ms": stats.max * 1000,
+                "avg_rows": stats.rows / stats.calls,
+                "has_plan": stats.last_plan is not None,
+            }
+            for function, stats in top[:limit]
+        ]
+
+    def get_plan(self, function: str) -> Optional[str]:
+        stats = self.functions.get(function)
+        return stats.last_plan if stats else None
+
+    def reset(self):
+        self.functions.clear()
+
+
+def rows_from_status(status: Optional[str]) -> int:
+    # Статус команды: "UPDATE 3", "INSERT 0 5", "CREATE TABLE"
+    tail = (status or "").rsplit(" ", 1)[-1]
+    return int(tail) if tail.isdigit() else 0
+
+
+def _compact(query: str, limit: int = 500) -> str:
+    query = re.sub(r"\s+", " ", query).strip()
+    return query if len(query) <= limit else query[:limit] + "..."
+
+
+def _redact(args: Sequence[Any]) -> str:
+    # Значения параметров в лог не пишем: там могут быть персональные данные
+    parts = []
+    for index, value in enumerate(args, start=1):
+        kind = type(value).__name__
+        if isinstance(value, (str, bytes, list, tuple)):
+            kind += f"[{len(value)}]"
+        parts.append(f"${index}=<{kind}>")
+    return ", ".join(parts) or "без параметров"
+
+
+profiler = QueryProfiler(slow_ms=DB_SLOW_QUERY_MS, explain_sample_rate=DB_EXPLAIN_SAMPLE_RATE)
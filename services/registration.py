@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Set, Tuple
+import asyncpg
+from cachetools import LRUCache
+
+from models import users as users_db
+
+Profile = Tuple[Optional[str], Optional[str]]
+
+
+class RegistrationBuffer:
+    # Регистрация пользователей с отложенной записью. Каждый /start раньше делал
+    # INSERT ... ON CONFLICT, даже для давно известных пользователей. Теперь:
+    # - известные с тем же username/full_name пропускаются без запроса;
+    # - новые и сменившие имя копятся и пишутся одним запросом раз в flush_interval
+    #   или сразу при накоплении max_batch.
+    # Перед записью, которая ссылается на users (счет на оплату), вызывайте
+    # ensure_registered — он досылает пользователя синхронно.
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        flush_interval: float = 0.5,
+        max_batch: int = 500,
+        seen_size: int = 100_000,
+    ):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        # Последний записанный профиль пользователя
+        self.seen: LRUCache = LRUCache(maxsize=seen_size)
+        self._pending: Dict[int, Profile] = {}
+        self._flushing: Set[int] = set()
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def add(self, user_id: int, username: Optional[str], full_name: Optional[str]):
+        profile = (username, full_name)
+        if self.seen.get(user_id) == profile:
+            return
+        self._pending[user_id] = profile
+        if len(self._pending) >= self.max_batch:
+            self._schedule(0)
+        else:
+            self._schedule(self.flush_interval)
+
+    async def ensure_registered(self, user_id: int):
+        if user_id in self._pending or user_id in self._flushing:
+            await self.flush()
+
+    def _schedule(self, delay: float):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush(delay))
+        elif not delay:
+            asyncio.create_task(self._delayed_flush(0))
+
+    async def _delayed_flush(self, delay: float):
+        await asyncio.sleep(delay)
+        retry_delay = self.flush_interval
+        while True:
+            try:
+                await self.flush()
+                return
+            except Exception:
+                # Ошибка уже в логе, незаписанные пользователи остались в буфере
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)
+
+    async def flush(self):
+        # Под замком: ensure_registered дожидается записи, начатой другой задачей
+        async with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            self._flushing = set(pending)
+            try:
+                await users_db.upsert_users(
+                    self.pool,
+                    [(user_id, username, full_name) for user_id, (username, full_name) in pending.items()],
+                )
+            except Exception as e:
+                logging.error(f"Не удалось записать новых пользователей: {e}", exc_info=True)
+                # Возвращаем незаписанное, если за это время не пришел более свежий профиль
+                for user_id, profile in pending.items():
+                    self._pending.setdefault(user_id, profile)
+                raise
+            else:
+                for user_id, profile in pending.items():
+                    self.seen[user_id] = profile
+            finally:
+                self._flushing = set()
+
+    async def close(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        try:
+            await self.flush()
+        except Exception:
+            # Ошибка уже в логе; пользователи зарегистрируются при следующем /start
+            pass
@@ -0,0 +1,48 @@
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from models import courses as courses_db
+
+
+class RenderCache:
+    # Готовые тексты и клавиатуры каталога. Запись действительна, пока не сменился
+    # исходный объект: строка курса, кортеж активных курсов из снимка каталога или
+    # счетчики курсов по категориям (они пересчитываются и при смене дерева).
+    # Любое изменение курса (свое или через NOTIFY) пересобирает снимок с новыми
+    # объектами, поэтому устаревшая запись не отдается, даже если запрос начался
+    # до инвалидации. При смене версии каталога кэш очищается целиком.
+    def __init__(self, maxsize: int = 5000):
+        self.maxsize = maxsize
+        self.version = courses_db.get_catalog_version()
+        self._items: Dict[Hashable, Tuple[Any, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, source: Any, build: Callable[[], Any]) -> Any:
+        version = courses_db.get_catalog_version()
+        if version != self.version:
+            self._items.clear()
+            self.version = version
+
+        item = self._items.get(key)
+        if item is not None and item[0] is source:
+            self.hits += 1
+            return item[1]
+
+        self.misses += 1
+        value = build()
+        if len(self._items) >= self.maxsize:
+            # Словарь хранит порядок вставки — вытесняем самую старую запись
+            del self._items[next(iter(self._items))]
+        self._items[key] = (source, value)
+        return value
+
+    def get_stats(self) -> Dict:
+        return {
+            "version": self.version,
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+render_cache = RenderCache()
@@ -0,0 +1,334 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+WORKER_SECRET_HEADER = "X-Worker-Secret"
+TELEGRAM_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def route_key(update: Dict) -> int:
+    # Маршрутизируем по id пользователя: все его обновления, включая pre_checkout_query
+    # без чата, попадают в один процесс — порядок, троттлинг и кэш FSM остаются локальными
+    for payload in update.values():
+        if not isinstance(payload, dict):
+            continue
+        user = payload.get("from") or payload.get("user")
+        if user:
+            return user["id"]
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+
+class Worker:
+    def __init__(self, index: int, port: int, queue_size: int):
+        self.index = index
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.ready = asyncio.Event()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.restarting = False
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+
+class Supervisor:
+    # Принимает обновления (вебхук или getUpdates) и раздает их N процессам bot.py.
+    # JSON здесь разбирается только до id пользователя, тяжелая валидация aiogram
+    # идет в воркерах. У каждого воркера своя очередь и один отправитель,
+    # поэтому обновления пользователя доходят до воркера в порядке прихода.
+    def __init__(
+        self,
+        command: List[str],
+        workers: int,
+        base_port: int,
+        secret: str,
+        queue_size: int = 1000,
+        start_timeout: float = 60,
+        stop_timeout: float = 30,
+        accept_timeout: float = 50,
+    ):
+        self.command = command
+        self.secret = secret
+        self.start_timeout = start_timeout
+        self.stop_timeout = stop_timeout
+        self.accept_timeout = accept_timeout
+        self.workers = [Worker(i, base_port + i, queue_size) for i in range(workers)]
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        for worker in self.workers:
+            self._tasks.append(asyncio.create_task(self._supervise(worker)))
+            self._tasks.append(asyncio.create_task(self._forward(worker)))
+        logging.info(f"Супервизор запускает воркеров: {len(self.workers)}")
+
+    async def stop(self):
+        self._stopping = True
+        # Сначала отдаем воркерам уже принятые обновления, потом останавливаем их
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(worker.queue.join() for worker in self.workers)),
+                self.stop_timeout,
+            )
+        except asyncio.TimeoutError:
+            logging.warning("Не все принятые обновления переданы воркерам до остановки.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.gather(
+            *(self._terminate(worker) for worker in self.workers if worker.alive)
+        )
+        await self._session.close()
+        logging.info("Все воркеры остановлены.")
+
+    async def restart(self, worker: Worker):
+        # Плавный перезапуск: воркер дорабатывает начатые обновления, а новые
+        # копятся в его очереди, пока не поднимется замена
+        if not worker.alive:
+            return
+        logging.info(f"Перезапуск воркера {worker.index}...")
+        worker.restarting = True
+        worker.ready.clear()
+        await self._terminate(worker)
+        await worker.ready.wait()
+
+    async def restart_all(self):
+        # По одному, чтобы остальные воркеры продолжали обслуживать своих пользователей
+        for worker in self.workers:
+            await self.restart(worker)
+        logging.info("Все воркеры перезапущены.")
+
+    def route(self, update: Dict) -> Worker:
+        return self.workers[route_key(update) % len(self.workers)]
+
+    async def enqueue(self, update: Dict, body: bytes) -> asyncio.Future:
+        # Ждет только места в очереди воркера. Встав в очередь, обновление будет
+        # доставлено в любом случае; возвращаемый future завершится, когда воркер его примет
+        done = asyncio.get_running_loop().create_future()
+        await self.route(update).queue.put((body, done))
+        return done
+
+    async def submit(self, update: Dict, body: bytes):
+        # Завершается, когда воркер принял обновление
+        await (await self.enqueue(update, body))
+
+    # --- Процессы воркеров ---
+    async def _supervise(self, worker: Worker):
+        backoff = 1
+        while not self._stopping:
+            started_at = time.monotonic()
+            await self._spawn(worker)
+            code = await worker.process.wait()
+            worker.ready.clear()
+            if self._stopping:
+                return
+            if worker.restarting:
+                worker.restarting = False
+                continue
+            worker.restarts += 1
+            logging.error(f"Воркер {worker.index} завершился с кодом {code}, перезапускаем...")
+            if time.monotonic() - started_at > 60:
+                backoff = 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    async def _spawn(self, worker: Worker):
+        env = dict(
+            os.environ,
+            BOT_WORKER_INDEX=str(worker.index),
+            BOT_WORKER_PORT=str(worker.port),
+        )
+        # Своя группа процессов: Ctrl+C получает только супервизор и останавливает воркеров сам
+        worker.process = await asyncio.create_subprocess_exec(
+            *self.command, env=env, start_new_session=True
+        )
+        logging.info(f"Воркер {worker.index} запущен (pid {worker.process.pid}, порт {worker.port}).")
+
+        deadline = time.monotonic() + self.start_timeout
+        while worker.alive and time.monotonic() < deadline:
+            try:
+                async with self._session.get(f"{worker.url}/healthz") as response:
+                    if response.status == 200:
+                        worker.ready.set()
+                        logging.info(f"Воркер {worker.index} готов.")
+                        return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            await asyncio.sleep(0.5)
+        if worker.alive:
+            logging.error(f"Воркер {worker.index} не поднялся за {self.start_timeout} с.")
+            await self._terminate(worker)
+
+    async def _terminate(self, worker: Worker):
+        worker.process.terminate()
+        try:
+            await asyncio.wait_for(worker.process.wait(), self.stop_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Воркер {worker.index} не остановился за {self.stop_timeout} с, убиваем.")
+            worker.process.kill()
+            await worker.process.wait()
+
+    async def _forward(self, worker: Worker):
+        while True:
+            body, done = await worker.queue.get()
+            try:
+                await self._deliver(worker, body)
+                if not done.done():
+                    done.set_result(None)
+            finally:
+                worker.queue.task_done()
+
+    async def _deliver(self, worker: Worker, body: bytes):
+        while True:
+            await worker.ready.wait()
+            try:
+                async with self._session.post(
+                    f"{worker.url}/updates",
+                    data=body,
+                    headers={WORKER_SECRET_HEADER: self.secret, "Content-Type": "application/json"},
+                ) as response:
+                    if response.status == 200:
+                        return
+                    if 400 <= response.status < 500:
+                        logging.error(f"Воркер {worker.index} отклонил обновление: {response.status}")
+                        return
+                    logging.warning(f"Воркер {worker.index} ответил {response.status}, повторяем...")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"Воркер {worker.index} недоступен: {e}")
+            await asyncio.sleep(0.5)
+
+    # --- Источники обновлений ---
+    async def handle_webhook(self, request: web.Request) -> web.Response:
+        if request.headers.get(TELEGRAM_SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        # 200 отвечаем, как только обновление встало в очередь: ждать, пока его примет
+        # воркер, нельзя — после 503 по таймауту оно все равно ушло бы воркеру, а
+        # Telegram прислал бы его повторно
+        try:
+            await asyncio.wait_for(self.enqueue(update, body), self.accept_timeout)
+        except asyncio.TimeoutError:
+            # Очередь воркера так и не освободилась, обновление не принято —
+            # Telegram повторит доставку позже
+            return web.Response(status=503)
+        return web.Response()
+
+    async def poll(self, bot: Bot, api: TelegramAPIServer, allowed_updates: List[str]):
+        # Опрашиваем getUpdates напрямую: разбирать ответ в модели aiogram здесь незачем
+        url = api.api_url(token=bot.token, method="getUpdates")
+        offset = None
+        while True:
+            params = {"timeout": 30, "allowed_updates": json.dumps(allowed_updates)}
+            if offset is not None:
+                params["offset"] = offset
+            try:
+                async with self._session.get(
+                    url, params=params, timeout=aiohttp.ClientTimeout(total=40)
+                ) as response:
+                    payload = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logging.warning(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not payload.get("ok"):
+                logging.warning(f"getUpdates: {payload.get('description')}")
+                await asyncio.sleep(payload.get("parameters", {}).get("retry_after", 1))
+                continue
+            # offset подтверждаем только после того, как воркеры приняли всю пачку
+            await asyncio.gather(
+                *(self.submit(update, json.dumps(update).encode()) for update in payload["result"])
+            )
+            if payload["result"]:
+                offset = payload["result"][-1]["update_id"] + 1
+
+    # --- HTTP ---
+    def create_app(self, webhook_path: str) -> web.Application:
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/", self.handle_index),
+                web.get("/healthz", self.handle_health),
+                web.get("/workers/{index}/metrics", self.handle_worker_metrics),
+                web.post(webhook_path, self.handle_webhook),
+            ]
+        )
+        return app
+
+    async def handle_index(self, request: web.Request) -> web.Response:
+        return web.Response(text="Bot is running!")
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        lines = [
+            f"worker {worker.index}: "
+            f"{'ready' if worker.ready.is_set() else 'starting'}, "
+            f"queue {worker.queue.qsize()}, restarts {worker.restarts}"
+            for worker in self.workers
+        ]
+        # Пока хоть один воркер жив, сервис доступен: остальные перезапускаются
+        status = 200 if any(worker.ready.is_set() for worker in self.workers) else 503
+        return web.Response(status=status, text="\n".join(lines))
+
+    async def handle_worker_metrics(self, request: web.Request) -> web.Response:
+        # У каждого воркера свой реестр Prometheus, супервизор только проксирует
+        try:
+            worker = self.workers[int(request.match_info["index"])]
+        except (ValueError, IndexError):
+            raise web.HTTPNotFound()
+        try:
+            async with self._session.get(f"{worker.url}/metrics") as response:
+                return web.Response(
+                    body=await response.read(),
+                    status=response.status,
+                    content_type=response.content_type,
+                )
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return web.Response(status=503, text="worker unavailable")
+
+
+class UpdateFeeder:
+    # Сторона воркера: принимает обновления от супервизора и обрабатывает их в фоне
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if request.headers.get(WORKER_SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+        update = await request.json()
+        task = asyncio.create_task(self._feed(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _feed(self, update: Dict[str, Any]):
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            logging.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}", exc_info=True)
+
+    async def drain(self, timeout: float):
+        if self._tasks:
+            logging.info(f"Дожидаемся обновлений в обработке: {len(self._tasks)}")
+            await asyncio.wait(self._tasks, timeout=timeout)
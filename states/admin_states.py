@@ -16,3 +16,13 @@ class EditCourse(StatesGroup):
 
 class EditWelcomeMessage(StatesGroup):
     entering_message = State()
+
+
+class Broadcast(StatesGroup):
+    entering_text = State()
+    confirming = State()
+
+
+class EditCategory(StatesGroup):
+    entering_name = State()
+    entering_new_name = State()
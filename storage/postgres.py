@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+import asyncpg
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from cachetools import TTLCache
+
+from models import fsm as fsm_db
+
+
+class PostgresStorage(BaseStorage):
+    # Состояния FSM в таблице fsm_storage с кэшем в памяти.
+    # Смена состояния пишется сразу (вместе с накопленными данными этого ключа),
+    # update_data/set_data копятся и сбрасываются одним запросом раз в flush_delay.
+    # Кэш локальный, поэтому апдейты одного пользователя должны попадать в один процесс.
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        cache_size: int = 10_000,
+        cache_ttl: int = 600,
+        flush_delay: float = 0.5,
+        state_ttl: int = 86_400,
+        cleanup_interval: int = 3_600,
+    ):
+        self.pool = pool
+        self.cache: TTLCache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.flush_delay = flush_delay
+        self.state_ttl = state_ttl
+        self.cleanup_interval = cleanup_interval
+        self._dirty: Dict[str, Tuple[Optional[str], Dict[str, Any]]] = {}
+        # Последняя начатая запись каждого ключа: следующая запись того же ключа ждет ее,
+        # чтобы более старая не легла поверх более новой. Разные ключи пишутся параллельно
+        self._writes: Dict[str, asyncio.Future] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._cleanup_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._cleanup_task = asyncio.create_task(self._cleanup())
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(
+            str(part) if part is not None else ""
+            for part in (
+                key.bot_id,
+                key.chat_id,
+                key.user_id,
+                key.thread_id,
+                key.business_connection_id,
+                key.destiny,
+            )
+        )
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        record = self._dirty.get(key)
+        if record is not None:
+            return record
+        record = self.cache.get(key)
+        if record is not None:
+            return record
+        # Отсутствие состояния тоже кэшируем: FSM спрашивает его на каждом апдейте
+        record = await fsm_db.get_fsm_record(self.pool, key) or (None, {})
+        self.cache[key] = record
+        return record
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self._key(key)
+        _, data = await self._load(storage_key)
+        state = state.state if isinstance(state, State) else state
+        record = (state, data)
+        self.cache[storage_key] = record
+        self._dirty.pop(storage_key, None)
+        await self._write([(storage_key, *record)])
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self._key(key)
+        state, _ = await self._load(storage_key)
+        record = (state, data.copy())
+        self.cache[storage_key] = record
+        self._dirty[storage_key] = record
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self._key(key))
+        return data.copy()
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    async def _write(self, records: List[Tuple[str, Optional[str], Dict[str, Any]]]):
+        # Очередь занимается синхронно, до первого await: порядок записей в БД
+        # совпадает с порядком, в котором решили, что писать. Отложенный сброс идет
+        # по другому соединению и без этого мог бы затереть новое состояние старым
+        keys = [key for key, _, _ in records]
+        previous = {self._writes[key] for key in keys if key in self._writes}
+        done = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self._writes[key] = done
+        try:
+            if previous:
+                await asyncio.wait(previous)
+            await fsm_db.save_fsm_records(self.pool, records)
+        finally:
+            done.set_result(None)
+            for key in keys:
+                if self._writes.get(key) is done:
+                    del self._writes[key]
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            await self._write([(key, state, data) for key, (state, data) in dirty.items()])
+        except Exception as e:
+            logging.error(f"Не удалось сохранить данные FSM: {e}", exc_info=True)
+            self._restore(dirty)
+        except asyncio.CancelledError:
+            self._restore(dirty)
+            raise
+
+    def _restore(self, dirty: Dict[str, Tuple[Optional[str], Dict[str, Any]]]):
+        # Возвращаем несохраненное, если за это время не появилось более свежих данных
+        for key, record in dirty.items():
+            self._dirty.setdefault(key, record)
+
+    async def _cleanup(self):
+        while True:
+            try:
+                deleted = await fsm_db.delete_expired_fsm_records(self.pool, self.state_ttl)
+                if deleted:
+                    logging.info(f"Удалено брошенных состояний FSM: {deleted}")
+            except Exception as e:
+                logging.error(f"Ошибка при очистке FSM: {e}", exc_info=True)
+            await asyncio.sleep(self.cleanup_interval)
+
+    async def close(self) -> None:
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            self._cleanup_task = None
+        if self._flush_task is not None:
+            # Не отменяем: начатый flush уже забрал _dirty, и отмена потеряла бы эти записи
+            await self._flush_task
+        await self.flush()
@@ -0,0 +1,41 @@
+import os
+import unittest
+
+import asyncpg
+
+from database import InstrumentedConnection, acquire
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+_QUERY = "SELECT $1::bigint + 1"
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, "TEST_DATABASE_URL не задан")
+class PooledConnectionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # Одно соединение на пул, чтобы повторная выдача гарантированно вернула то же самое
+        self.pool = await asyncpg.create_pool(
+            dsn=TEST_DATABASE_URL,
+            min_size=1,
+            max_size=1,
+            connection_class=InstrumentedConnection,
+        )
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+
+    async def test_query_after_release(self):
+        # Выражение из кэша соединения должно переживать возврат соединения в пул
+        async with acquire(self.pool) as conn:
+            first = conn._con
+            self.assertEqual(await conn.fetchval(_QUERY, 1), 2)
+
+        async with acquire(self.pool) as conn:
+            self.assertIs(conn._con, first)
+            self.assertEqual(await conn.fetchval(_QUERY, 2), 3)
+            self.assertEqual((await conn.fetchrow(_QUERY, 3))[0], 4)
+            self.assertEqual(len(await conn.fetch(_QUERY, 4)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
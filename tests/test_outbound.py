@@ -0,0 +1,49 @@
+import unittest
+from unittest import mock
+
+from services.outbound import CHAT_BUCKETS_SWEEP_INTERVAL, OutboundLimiter, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_reserve_respects_max_delay(self):
+        bucket = TokenBucket(rate=1, capacity=1)
+        self.assertEqual(bucket.reserve(max_delay=0.5), 0.0)
+        # Второй токен будет только через секунду — в полсекунды не укладываемся
+        self.assertIsNone(bucket.reserve(max_delay=0.5))
+        self.assertAlmostEqual(bucket.reserve(), 1.0, places=2)
+
+    def test_pause_delays_refill(self):
+        bucket = TokenBucket(rate=1, capacity=3)
+        bucket.pause(10)
+        self.assertGreater(bucket.reserve(), 10)
+
+
+class OutboundLimiterTest(unittest.TestCase):
+    def test_retry_after_pauses_only_the_chat(self):
+        limiter = OutboundLimiter()
+        limiter._on_retry_after(1, 30)
+        self.assertIsNone(limiter._chat_bucket(1).reserve(max_delay=5))
+        self.assertEqual(limiter._chat_bucket(2).reserve(max_delay=5), 0.0)
+        self.assertEqual(limiter._paused_until, 0.0)
+
+    def test_flood_across_chats_pauses_everyone(self):
+        limiter = OutboundLimiter()
+        for chat_id in range(3):
+            limiter._on_retry_after(chat_id, 30)
+        self.assertGreater(limiter._paused_until, 0.0)
+
+    def test_sweep_keeps_exhausted_buckets(self):
+        limiter = OutboundLimiter(chat_rate=1, chat_burst=1)
+        limiter._chat_bucket(1).pause(3600)
+        limiter._chat_bucket(2)
+        with mock.patch(
+            "services.outbound.time.monotonic",
+            return_value=limiter._swept_at + CHAT_BUCKETS_SWEEP_INTERVAL + 1,
+        ):
+            limiter._chat_bucket(3)
+        self.assertIn(1, limiter.chat_buckets)
+        self.assertNotIn(2, limiter.chat_buckets)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,16 @@
+import unittest
+
+from aiogram.fsm.storage.memory import MemoryStorage
+
+
+class ImportSmokeTest(unittest.TestCase):
+    # Сломанный импорт в любом модуле роутеров и middleware валит запуск бота целиком
+    def test_create_dispatcher(self):
+        import bot
+
+        dp = bot.create_dispatcher(None, MemoryStorage())
+        self.assertIn("callback_query", dp.resolve_used_update_types())
+
+
+if __name__ == "__main__":
+    unittest.main()